@@ -7,21 +7,434 @@ import time
 import threading
 import glob # Added import
 import re
+import queue
+import random
+import tempfile
+import json
+import hashlib
+import sqlite3
+import urllib.request
+import itertools
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+DOWNLOAD_ROOT = '/Users/qiqizhou/bili-dl/' # 各专辑文件夹所在的目录
+
+# you-get 的进度行，如 " 45.3% ( 12.3/ 27.2MB) ├███───┤[1/2]    2 MB/s"
+PROGRESS_RE = re.compile(r"(\d+(?:\.\d+)?)%\s*\(\s*[\d.]+/\s*[\d.]+\s*[KMG]?B\)")
+PROGRESS_PART_RE = re.compile(r"\[(\d+/\d+)\]")
+
+JOB_FINISHED_STATES = ("完成", "失败")
+
+# 已下载文件的索引，放在所有专辑文件夹的上一级，跨专辑共用
+DOWNLOAD_INDEX_PATH = os.path.join(DOWNLOAD_ROOT, "download_index.sqlite3")
+BVID_RE = re.compile(r"BV[0-9A-Za-z]{10}")
+# you-get 开始下载 / 跳过已存在文件时输出的文件名
+DOWNLOADED_FILE_RE = re.compile(r"^(?:Downloading (.+?) \.\.\.|Skipping (?:\./)?(.+?): file already exists)$")
+
+# 日志由后台线程放进队列，Tk 定时器每 LOG_FLUSH_INTERVAL_MS 毫秒批量插入一次；输出框最多保留 MAX_LOG_LINES 行
+LOG_FLUSH_INTERVAL_MS = 100
+MAX_LOG_LINES = 5000
+
+# 同时运行的 ffmpeg 后期处理（合并、转音频）数量；libmp3lame / aac 编码基本是单线程的，按 CPU 核数并行
+POSTPROC_WORKERS = os.cpu_count() or 2
+
+# 各输出容器可以直接复制 (-c copy) 的音频编码；源编码不在表中时才转码
+COPYABLE_AUDIO_CODECS = {
+    ".m4a": ("aac", "alac"),
+    ".mp4": ("aac", "mp3", "alac", "ac3", "eac3"),
+    ".mp3": ("mp3",),
+}
+AUDIO_TRANSCODE_ARGS = {
+    ".m4a": ['-c:a', 'aac', '-b:a', '192k'],
+    ".mp4": ['-c:a', 'aac', '-b:a', '192k'],
+    ".mp3": ['-c:a', 'libmp3lame', '-b:a', '128k'],
+}
+
+
+def probe_codecs(path):
+    """用 ffprobe 读取第一条视频流和音频流的编码名，如 {"video": "h264", "audio": "aac"}；没有的为 None"""
+    codecs = {"video": None, "audio": None}
+    try:
+        out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'stream=codec_type,codec_name',
+                              '-of', 'json', path], capture_output=True, text=True, check=True).stdout
+        streams = json.loads(out).get("streams", [])
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return codecs
+    for stream in streams:
+        if stream.get("codec_type") in codecs and codecs[stream["codec_type"]] is None:
+            codecs[stream["codec_type"]] = stream.get("codec_name")
+    return codecs
+
+
+def audio_codec_args(source_codec, output_ext):
+    """输出为 output_ext 时的音频参数：源编码可以直接放进该容器时复制，否则转码；返回 (参数, 是否复制)"""
+    if source_codec in COPYABLE_AUDIO_CODECS.get(output_ext, ()):
+        return ['-c:a', 'copy'], True
+    return AUDIO_TRANSCODE_ARGS[output_ext], False
+
+
+def probe_duration(path):
+    """用 ffprobe 读取媒体时长（秒），读不到时返回 None"""
+    try:
+        out = subprocess.run(['ffprobe', '-v', 'error', '-show_entries', 'format=duration',
+                              '-of', 'default=noprint_wrappers=1:nokey=1', path],
+                             capture_output=True, text=True, check=True).stdout.strip()
+        return float(out)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return None
+
+
+def run_ffmpeg_atomic(input_args, output_path, duration=None, on_progress=None):
+    """执行 ffmpeg 并把结果写到 output_path：先写到同目录的 .part 临时文件，成功后再改名
+
+    input_args 为输入和编码参数（不含输出路径）；给出 duration 时根据 -progress 的 out_time 调用 on_progress(百分比)。
+    失败时删除临时文件并抛出 RuntimeError，已存在的 output_path 不会被写坏。
+    """
+    root, ext = os.path.splitext(output_path)
+    temp_path = f"{root}.part{ext}" # 保留扩展名，ffmpeg 按它选择输出格式
+    command = ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-progress', 'pipe:1', '-nostats'] + input_args + [temp_path]
+    # stderr 写到临时文件，避免与读取 stdout 的进度信息互相阻塞
+    with tempfile.TemporaryFile() as stderr:
+        try:
+            process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, text=True)
+            for line in process.stdout:
+                key, _, value = line.strip().partition("=")
+                # out_time_ms 在旧版 ffmpeg 里其实也是微秒
+                if duration and on_progress and key in ("out_time_us", "out_time_ms") and value.isdigit():
+                    on_progress(min(100.0, int(value) / 1e6 / duration * 100))
+            process.wait()
+            if process.returncode != 0:
+                stderr.seek(0)
+                error = stderr.read().decode("utf-8", errors="replace").strip()
+                raise RuntimeError(f"ffmpeg 返回码 {process.returncode}: {error[-500:]}")
+            os.replace(temp_path, output_path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+
+def normalize_video_url(url):
+    """BV / av 号补全为视频页地址，其余原样返回"""
+    if url.lower().startswith("bv") or url.lower().startswith("av"):
+        return f"https://www.bilibili.com/video/{url}"
+    return url
+
+
+def extract_bvid(url):
+    match = BVID_RE.search(url)
+    return match.group(0) if match else None
+
+
+def extract_part(url):
+    """地址中的分 P 序号 (?p=N)，没有时为第 1 P"""
+    match = re.search(r"[?&]p=(\d+)", url)
+    return int(match.group(1)) if match else 1
+
+
+def fetch_part_numbers(bvid, timeout=10):
+    """从 B 站接口读取视频的分 P 序号列表，失败时返回 None"""
+    request = urllib.request.Request(f"https://api.bilibili.com/x/player/pagelist?bvid={bvid}",
+                                     headers={"User-Agent": "Mozilla/5.0"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            data = json.loads(response.read())
+        if data.get("code") != 0:
+            return None
+        return [int(page["page"]) for page in data["data"]]
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class DownloadIndex:
+    """已下载文件的 SQLite 索引：每个文件一行，记录 BV 号、分 P、清晰度、路径、大小和内容哈希
+
+    后期处理删除、合并或转换文件时同步更新路径，索引始终反映磁盘上实际存在的文件；
+    查询时顺带删除文件已经不在的记录。所有方法都可以在任意线程中调用。
+    """
+
+    def __init__(self, path=DOWNLOAD_INDEX_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self._lock, self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS downloads (
+                path TEXT PRIMARY KEY, bvid TEXT NOT NULL, part INTEGER NOT NULL, quality TEXT NOT NULL,
+                size INTEGER NOT NULL, sha256 TEXT NOT NULL, downloaded_at TEXT NOT NULL)""")
+            self._db.execute("CREATE INDEX IF NOT EXISTS downloads_item ON downloads (bvid, part, quality)")
+            self._db.execute("CREATE INDEX IF NOT EXISTS downloads_hash ON downloads (sha256, size)")
+
+    def _existing(self, rows):
+        """过滤出文件仍然存在且大小未变的记录，其余记录从索引中删除"""
+        alive = []
+        for row in rows:
+            path, size = row[0], row[1]
+            if os.path.isfile(path) and os.path.getsize(path) == size:
+                alive.append(row)
+            else:
+                with self._lock, self._db:
+                    self._db.execute("DELETE FROM downloads WHERE path = ?", (path,))
+        return alive
+
+    def lookup(self, bvid, part, quality):
+        """返回该视频分 P 在该清晰度下现存的文件 [(路径, 大小, 哈希)]"""
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, sha256 FROM downloads WHERE bvid = ? AND part = ? AND quality = ?",
+                                    (bvid, part, quality)).fetchall()
+        return self._existing(rows)
+
+    def record(self, bvid, part, quality, path, sha256=None):
+        path = os.path.abspath(path)
+        size = os.path.getsize(path)
+        sha256 = sha256 or file_sha256(path)
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO downloads VALUES (?, ?, ?, ?, ?, ?, ?)",
+                             (path, bvid, part, quality, size, sha256, datetime.now().isoformat(timespec="seconds")))
+        return size, sha256
+
+    def replace_paths(self, old_paths, new_path):
+        """后期处理把 old_paths 合并或转换成 new_path 后调用；old_paths 都不在索引中时什么也不做"""
+        old_paths = [os.path.abspath(path) for path in old_paths]
+        with self._lock:
+            row = self._db.execute(f"SELECT bvid, part, quality FROM downloads WHERE path IN ({','.join('?' * len(old_paths))})",
+                                   old_paths).fetchone()
+        if row is None:
+            return
+        for path in old_paths:
+            self.remove_path(path)
+        self.record(*row, new_path)
+
+    def remove_path(self, path):
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM downloads WHERE path = ?", (os.path.abspath(path),))
+
+    def find_duplicate(self, path, size, sha256):
+        """内容相同 (哈希和大小一致)、但不是同一个文件 (inode 不同) 的已索引文件路径，没有时返回 None"""
+        with self._lock:
+            rows = self._db.execute("SELECT path, size, sha256 FROM downloads WHERE sha256 = ? AND size = ? AND path != ?",
+                                    (sha256, size, os.path.abspath(path))).fetchall()
+        for row in self._existing(rows):
+            if not os.path.samefile(row[0], path):
+                return row[0]
+        return None
+
+
+def downloaded_paths(directory, name):
+    """you-get 报告的文件名 name 对应的磁盘路径：name 本身，以及分段下载的 X[00].ext、X[01].ext ..."""
+    stem, ext = os.path.splitext(name)
+    part_re = re.compile(re.escape(stem) + r"\[\d{2}\]" + re.escape(ext))
+    try:
+        parts = sorted(entry for entry in os.listdir(directory) if part_re.fullmatch(entry))
+    except OSError:
+        parts = []
+    return [os.path.abspath(os.path.join(directory, entry)) for entry in [name] + parts]
+
+
+def hard_link_replace(source, target):
+    """把 target 换成指向 source 的硬链接；先链接到临时名再改名，失败时 target 保持不变"""
+    temp_path = target + ".link"
+    if os.path.exists(temp_path):
+        os.remove(temp_path)
+    os.link(source, temp_path)
+    os.replace(temp_path, target)
+
+
+class AlbumWatcher(threading.Thread):
+    """下载过程中轮询专辑文件夹 (os.scandir)，发现下载完成的文件就交给 handle(path)，让后期处理与下载重叠
+
+    you-get 下载时写 .download 临时文件，完成后才改成正式文件名；正式文件在相邻两次扫描之间
+    大小和修改时间都不变才算完成。每个文件只交给 handle 一次；文件被删除后又出现同名文件 (如重试、重新下载)，
+    或大小、修改时间变了，算作新文件。handle 返回 False 表示暂时还不能处理，之后的扫描会再交给它。
+    handle 可以返回 Future，stop() 会等这些后期处理全部结束。
+    """
+    IGNORED_SUFFIXES = (".download", ".link")
+
+    def __init__(self, directory, handle, interval=2.0):
+        super().__init__(daemon=True)
+        self.directory = directory
+        self.handle = handle
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._seen = {} # 文件名 -> 上次扫描时的 (大小, 修改时间)
+        self._handled = {} # 已交给 handle 的文件名 -> 当时的 (大小, 修改时间)
+        self._futures = []
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self._scan()
+
+    def _scan(self):
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        current = {}
+        for entry in entries:
+            name = entry.name
+            # .part.* 是后期处理自己写的临时文件
+            if name.endswith(self.IGNORED_SUFFIXES) or ".part." in name:
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+            except OSError:
+                continue # 扫描期间被删除或改名
+            signature = (stat.st_size, stat.st_mtime_ns)
+            current[name] = signature
+            if self._handled.get(name) == signature:
+                continue
+            if self._seen.get(name) == signature:
+                future = self.handle(entry.path)
+                if future is False:
+                    continue
+                self._handled[name] = signature
+                if future is not None:
+                    self._futures.append(future)
+        self._seen = current
+        # 已经不在的文件不再记着，之后同名的新文件照常处理
+        self._handled = {name: signature for name, signature in self._handled.items() if name in current}
+
+    def stop(self):
+        """停止扫描，并等待已经提交的后期处理结束"""
+        self._stop_event.set()
+        if self.is_alive():
+            self.join()
+        for future in self._futures:
+            future.exception() # 只等待结束，错误已由处理函数记录
+
+
+class DownloadJob:
+    """下载队列中的一个任务：一个视频地址 (或 BV 号) 和它的下载命令、状态"""
+
+    def __init__(self, job_id, url, download_path, command, bvid=None, part=None, quality=None):
+        self.id = job_id
+        self.url = url
+        self.download_path = download_path
+        self.command = command
+        # 下载完成后写入下载索引用；整个播放列表一次下载的任务没有 part，不写入索引
+        self.bvid = bvid
+        self.part = part
+        self.quality = quality
+        self.status = "排队中"
+        self.progress = ""
+        self.attempts = 0
+        self.message = ""
+        self.files = set() # you-get 报告写出的文件 (绝对路径)，判断 [00]/[01] 分段属于哪个任务
+        self.cleaned = False # 所在专辑文件夹是否已在本任务完成后自动清理过
+
+
+class DownloadManager:
+    """有界的下载线程池：任务排队，最多 max_workers 个 you-get 同时运行，失败的任务退避后重新排队
+
+    run_job(job) 执行一次下载并返回 you-get 的返回码；on_update(job) 在任务状态或进度变化时调用（在工作线程中）。
+    返回码 > 0 视为暂时性失败（网络中断、限速等），按 backoff_seconds * 2^(n-1) 退避后重试，最多 max_retries 次；
+    返回码 < 0 表示命令无法启动 (如未安装 you-get)，不重试。
+    """
+
+    def __init__(self, run_job, on_update, max_workers=2, max_retries=3, backoff_seconds=10):
+        self.run_job = run_job
+        self.on_update = on_update
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        self._jobs = [] # 提交过的全部任务；用 jobs() 取快照
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._workers = 0
+
+    def submit(self, job):
+        with self._lock:
+            self._jobs.append(job)
+        self.on_update(job)
+        self._queue.put(job)
+        self._ensure_workers()
+
+    def jobs(self):
+        """提交过的全部任务的快照；submit 可能在其他线程中同时进行"""
+        with self._lock:
+            return list(self._jobs)
+
+    def set_max_workers(self, max_workers):
+        """调整并行数：调大时立即启动新的工作线程，调小时多余的线程做完手上的任务后退出"""
+        self.max_workers = max(1, max_workers)
+        self._ensure_workers()
+
+    def _ensure_workers(self):
+        with self._lock:
+            while self._workers < self.max_workers and not self._queue.empty():
+                self._workers += 1
+                threading.Thread(target=self._worker, daemon=True).start()
+
+    def _worker(self):
+        while True:
+            with self._lock:
+                if self._workers > self.max_workers:
+                    self._workers -= 1
+                    return
+            try:
+                job = self._queue.get(timeout=1)
+            except queue.Empty:
+                with self._lock:
+                    # 没有排队的任务时退出；之后再提交会重新启动线程
+                    if self._queue.empty():
+                        self._workers -= 1
+                        return
+                continue
+            self._run(job)
+
+    def _run(self, job):
+        job.attempts += 1
+        job.status = "下载中"
+        job.progress = ""
+        job.message = ""
+        self.on_update(job)
+        return_code = self.run_job(job)
+        if return_code == 0:
+            job.status = "完成"
+            job.progress = "100%"
+        elif return_code > 0 and job.attempts <= self.max_retries:
+            # 加一点随机抖动，避免同时失败的任务同时重试
+            delay = self.backoff_seconds * 2 ** (job.attempts - 1) * random.uniform(0.8, 1.2)
+            job.status = "等待重试"
+            job.message = f"返回码 {return_code}，{delay:.0f} 秒后重试"
+            timer = threading.Timer(delay, self._requeue, args=(job,))
+            timer.daemon = True
+            timer.start()
+        else:
+            job.status = "失败"
+            job.message = f"返回码 {return_code}"
+        self.on_update(job)
+
+    def _requeue(self, job):
+        job.status = "排队中"
+        self.on_update(job)
+        self._queue.put(job)
+        self._ensure_workers()
+
 
 class BiliDownloaderApp:
     def __init__(self, master):
         self.master = master
         master.title("Bilibili 视频下载器")
-        master.geometry("700x550")
+        master.geometry("900x800")
 
         # --- 输入区域 ---
         input_frame = ttk.LabelFrame(master, text="输入参数")
         input_frame.pack(padx=10, pady=10, fill="x")
 
-        ttk.Label(input_frame, text="视频 URL 或 ID:").grid(row=0, column=0, padx=5, pady=5, sticky="w")
-        self.url_entry = ttk.Entry(input_frame, width=60)
-        self.url_entry.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
-        self.url_entry.insert(0, "https://www.bilibili.com/video/BV1hx4y1t721/") # 默认示例
+        ttk.Label(input_frame, text="视频 URL 或 ID:\n(可输入多个，每行一个)").grid(row=0, column=0, padx=5, pady=5, sticky="nw")
+        self.url_text = tk.Text(input_frame, width=60, height=4)
+        self.url_text.grid(row=0, column=1, padx=5, pady=5, sticky="ew")
+        self.url_text.insert(tk.END, "https://www.bilibili.com/video/BV1hx4y1t721/") # 默认示例
 
         self.is_playlist_var = tk.BooleanVar()
         self.playlist_check = ttk.Checkbutton(input_frame, text="是否为播放列表 (Playlist)", variable=self.is_playlist_var)
@@ -46,6 +459,20 @@ class BiliDownloaderApp:
         self.quality_combo = ttk.Combobox(input_frame, textvariable=self.quality_var, values=["720p", "480p", "360p"], state="readonly", width=10)
         self.quality_combo.grid(row=4, column=1, padx=5, pady=5, sticky="w")
 
+        ttk.Label(input_frame, text="同时下载数:").grid(row=5, column=0, padx=5, pady=5, sticky="w")
+        concurrency_frame = ttk.Frame(input_frame)
+        concurrency_frame.grid(row=5, column=1, padx=5, pady=5, sticky="w")
+        self.max_workers_var = tk.IntVar(value=2)
+        ttk.Spinbox(concurrency_frame, from_=1, to=8, width=5, textvariable=self.max_workers_var,
+                    command=self._on_max_workers_changed).pack(side=tk.LEFT)
+        ttk.Label(concurrency_frame, text="失败重试次数:").pack(side=tk.LEFT, padx=(15, 5))
+        self.max_retries_var = tk.IntVar(value=3)
+        ttk.Spinbox(concurrency_frame, from_=0, to=10, width=5, textvariable=self.max_retries_var).pack(side=tk.LEFT)
+        # m4a 直接复制 B 站的 AAC 音轨，不损失音质；mp3 需要转码
+        ttk.Label(concurrency_frame, text="音频格式:").pack(side=tk.LEFT, padx=(15, 5))
+        self.audio_format_var = tk.StringVar(value="m4a")
+        ttk.Combobox(concurrency_frame, textvariable=self.audio_format_var, values=["m4a", "mp3"], state="readonly", width=6).pack(side=tk.LEFT)
+
         input_frame.columnconfigure(1, weight=1) # 使输入框可伸缩
 
         # --- 操作按钮区域 ---
@@ -55,7 +482,7 @@ class BiliDownloaderApp:
         self.info_button = ttk.Button(action_frame, text="获取视频信息", command=self.get_video_info)
         self.info_button.pack(side=tk.LEFT, padx=5)
 
-        self.download_button = ttk.Button(action_frame, text="开始下载", command=self.download_video)
+        self.download_button = ttk.Button(action_frame, text="加入下载队列", command=self.download_video)
         self.download_button.pack(side=tk.LEFT, padx=5)
 
         self.clean_button = ttk.Button(action_frame, text="清理重复文件", command=self.clean_duplicate_files_manual)
@@ -64,9 +491,48 @@ class BiliDownloaderApp:
         self.clean_current_album_button = ttk.Button(action_frame, text="清理当前专辑文件夹", command=self.clean_current_album_folder)
         self.clean_current_album_button.pack(side=tk.LEFT, padx=5)
 
-        self.rename_mp3_button = ttk.Button(action_frame, text="重命名 MP4 为 MP3", command=self.rename_mp4_to_mp3_in_album)
+        self.rename_mp3_button = ttk.Button(action_frame, text="MP4 转为音频 (M4A/MP3)", command=self.rename_mp4_to_mp3_in_album)
         self.rename_mp3_button.pack(side=tk.LEFT, padx=5)
 
+        # --- 下载队列 ---
+        queue_frame = ttk.LabelFrame(master, text="下载队列")
+        queue_frame.pack(padx=10, pady=5, fill="both", expand=True)
+
+        columns = ("id", "url", "status", "progress", "attempts", "message")
+        self.job_table = ttk.Treeview(queue_frame, columns=columns, show="headings", height=6)
+        for column, heading, width in zip(columns, ("#", "视频", "状态", "进度", "尝试", "信息"), (40, 330, 70, 110, 50, 200)):
+            self.job_table.heading(column, text=heading)
+            self.job_table.column(column, width=width, stretch=(column in ("url", "message")))
+        self.job_table.pack(side=tk.LEFT, fill="both", expand=True, padx=5, pady=5)
+        job_scrollbar = ttk.Scrollbar(queue_frame, orient=tk.VERTICAL, command=self.job_table.yview)
+        job_scrollbar.pack(side=tk.RIGHT, fill="y")
+        self.job_table.configure(yscrollcommand=job_scrollbar.set)
+
+        self.download_manager = DownloadManager(self._run_download_job, self._on_job_update,
+                                                max_workers=self.max_workers_var.get(),
+                                                max_retries=self.max_retries_var.get())
+        self._job_ids = itertools.count(1)
+        index_error = None
+        try:
+            self.download_index = DownloadIndex()
+        except (OSError, sqlite3.Error) as e:
+            self.download_index = None
+            index_error = e # 日志队列还没创建，建好后再记录
+
+        # --- 后期处理进度（合并、转音频）---
+        postproc_frame = ttk.Frame(master)
+        postproc_frame.pack(padx=10, fill="x")
+        self.postproc_progressbar = ttk.Progressbar(postproc_frame, mode="determinate", length=200)
+        self.postproc_progressbar.pack(side=tk.LEFT, padx=5)
+        self.postproc_status_var = tk.StringVar(value="")
+        ttk.Label(postproc_frame, textvariable=self.postproc_status_var).pack(side=tk.LEFT, fill="x", expand=True)
+        self._postproc_lock = threading.Lock()
+        # 边下载边处理：每个正在下载的专辑文件夹一个 AlbumWatcher，共用一个 ffmpeg 线程池
+        self._album_watchers = {}
+        self._pipeline_executor = None
+        # 还在后台展开分 P、提交任务的专辑文件夹 -> 进行中的次数；只在主线程中访问
+        self._planning_albums = {}
+
         # --- 输出区域 ---
         output_frame = ttk.LabelFrame(master, text="输出信息")
         output_frame.pack(padx=10, pady=10, fill="both", expand=True)
@@ -85,25 +551,57 @@ class BiliDownloaderApp:
         self.editable_output_text.insert(tk.END, "\n".join(self.uptodate_output_lines))
         self.editable_output_text.bind("<<Modified>>", self._on_editable_output_modified)
 
+        # 任何线程都可以往日志队列里放消息，由主线程的定时器批量取出显示
+        self._log_queue = queue.Queue()
+        # 状态或进度有变化、等待定时器刷新到表格的任务：任务 id -> 任务
+        self._dirty_jobs = {}
+        self._dirty_jobs_lock = threading.Lock()
+        self.master.after(LOG_FLUSH_INTERVAL_MS, self._pump_log)
+        if index_error is not None:
+            self._log_output(f"下载索引不可用，不会跳过已下载的视频: {index_error}")
+
         # --- Cookies 路径 (固定) ---
         self.cookies_path = "/Users/qiqizhou/Library/Application Support/Firefox/Profiles/hpv7fq1b.default-release/cookies.sqlite"
 
     # def 
 
 
+    def _pump_log(self):
+        """定时取出日志队列中的全部消息，一次插入输出框，并刷新有变化的任务行；只在主线程中运行"""
+        messages = []
+        try:
+            while True:
+                messages.append(self._log_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if messages:
+            self._update_text_widget("\n".join(messages))
+        with self._dirty_jobs_lock:
+            jobs = list(self._dirty_jobs.values())
+            self._dirty_jobs.clear()
+        for job in jobs:
+            self._refresh_job_row(job)
+        self.master.after(LOG_FLUSH_INTERVAL_MS, self._pump_log)
+
     def _update_text_widget(self, message): # New method for thread-safe UI update
+        lines = message.split('\n')
         self.output_text.configure(state='normal')
-        self.output_text.insert(tk.END, message + "\n")
-        # if "title:" in line of message, append to self.uptodate_output_lines
-        title_lines = [line for line in message.split('\n') if "title:" in line]
-        # 将找到的标题行添加到输出列表中
-        self.uptodate_output_lines.extend(title_lines)
+        # 超出上限的部分插入后也会被删掉，直接只插入最后 MAX_LOG_LINES 行
+        self.output_text.insert(tk.END, "\n".join(lines[-MAX_LOG_LINES:]) + "\n")
+        # 保留最近的 MAX_LOG_LINES 行，从最早的行开始删除（末尾还有一个空行）
+        excess = int(self.output_text.index('end-1c').split('.')[0]) - 1 - MAX_LOG_LINES
+        if excess > 0:
+            self.output_text.delete('1.0', f'{excess + 1}.0')
         self.output_text.see(tk.END) # 滚动到底部
         self.output_text.configure(state='disabled')
 
-        # Update editable output text
-        self.editable_output_text.delete(1.0, tk.END)
-        self.editable_output_text.insert(tk.END, "\n".join(self.uptodate_output_lines))
+        # if "title:" in line of message, append to self.uptodate_output_lines
+        title_lines = [line for line in lines if "title:" in line]
+        if title_lines:
+            # 将找到的标题行添加到输出列表中，并只把新的几行追加到可编辑输出框末尾
+            prefix = "\n" if self.uptodate_output_lines else ""
+            self.uptodate_output_lines.extend(title_lines)
+            self.editable_output_text.insert(tk.END, prefix + "\n".join(title_lines))
 
     def _on_editable_output_modified(self, event):
         # This method is called when the editable_output_text is modified
@@ -115,22 +613,30 @@ class BiliDownloaderApp:
 
 
     def _log_output(self, message):
-        # Schedule the UI update to be run in the main Tkinter thread
-        self.master.after(0, self._update_text_widget, message)
+        # 放进日志队列，由 _pump_log 在 Tkinter 主线程中批量显示
+        self._log_queue.put(message)
 
-    def _run_command_in_thread(self, command_list, cwd=None): # Renamed and modified for threading
-        self._log_output(f">>> 执行命令: {' '.join(command_list)}")
+    def _run_command_in_thread(self, command_list, cwd=None, log_prefix="", on_progress=None, on_line=None): # Renamed and modified for threading
+        # log_prefix 区分并发任务的输出；给出 on_progress 时进度行只交给它，不写入日志
+        self._log_output(f"{log_prefix}>>> 执行命令: {' '.join(command_list)}")
         if cwd:
-            self._log_output(f"    工作目录: {cwd}")
+            self._log_output(f"{log_prefix}    工作目录: {cwd}")
         try:
             process = subprocess.Popen(command_list, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, bufsize=1, universal_newlines=True, cwd=cwd, encoding='utf-8', errors='replace')
             for line in process.stdout:
-                self._log_output(line.strip())
+                match = PROGRESS_RE.search(line) if on_progress else None
+                if match:
+                    part = PROGRESS_PART_RE.search(line)
+                    on_progress(f"{match.group(1)}%" + (f" [{part.group(1)}]" if part else ""))
+                    continue
+                self._log_output(log_prefix + line.strip())
+                if on_line:
+                    on_line(line.strip())
             process.wait()
             if process.returncode == 0:
-                self._log_output("<<< 命令执行成功")
+                self._log_output(f"{log_prefix}<<< 命令执行成功")
             else:
-                self._log_output(f"<<< 命令执行失败, 返回码: {process.returncode}")
+                self._log_output(f"{log_prefix}<<< 命令执行失败, 返回码: {process.returncode}")
             return process.returncode # Return code for sequential operations
         except FileNotFoundError:
             self._log_output("<<< 错误: 'you-get' 命令未找到。请确保已正确安装并配置在系统 PATH 中。")
@@ -149,12 +655,14 @@ class BiliDownloaderApp:
 
         # Find and delete files based on clean_mode
         mp4_files = glob.glob(os.path.join(target_directory, "*.mp4"))
+        merge_pairs = [] # 保留两者模式下要合并的 (视频, 音频, 输出)
         for file_path in mp4_files:
             filename = os.path.basename(file_path)
             if clean_mode == "保留音频":
                 if "[00]" in filename: # Delete video files (marked with [00])
                     try:
                         os.remove(file_path)
+                        self._forget_file(file_path)
                         self._log_output(f"已删除视频文件 (保留音频): {file_path}")
                         cleaned_count += 1
                     except Exception as e:
@@ -163,6 +671,7 @@ class BiliDownloaderApp:
                 if "[01]" in filename: # Delete audio files (marked with [01])
                     try:
                         os.remove(file_path)
+                        self._forget_file(file_path)
                         self._log_output(f"已删除音频文件 (保留视频): {file_path}")
                         cleaned_count += 1
                     except Exception as e:
@@ -172,56 +681,185 @@ class BiliDownloaderApp:
                 if "[00]" in filename:
                     base_name = filename.replace("[00]", "").replace(".mp4", "")
                     audio_file = os.path.join(target_directory, f"{base_name}[01].mp4")
-                    video_file = file_path
-
                     if os.path.exists(audio_file):
-                        output_file = os.path.join(target_directory, f"{base_name}.mp4")
-                        self._log_output(f"正在合并视频 {video_file} 和音频 {audio_file} 到 {output_file}")
-                        try:
-                            # Use ffmpeg to merge video and audio
-                            # -i for input, -c:v copy for video codec copy, -c:a aac for audio codec aac, -strict experimental for non-standard aac
-                            # -map 0:v:0 to select video stream from first input, -map 1:a:0 to select audio stream from second input
-                            subprocess.run([
-                                'ffmpeg',
-                                '-i', video_file,
-                                '-i', audio_file,
-                                '-c:v', 'copy',
-                                '-c:a', 'aac',
-                                '-strict', 'experimental',
-                                output_file
-                            ], check=True, capture_output=True, text=True)
-                            self._log_output(f"合并成功: {output_file}")
-                            # Delete original [00] and [01] files after successful merge
-                            os.remove(video_file)
-                            os.remove(audio_file)
-                            self._log_output(f"已删除原始文件: {video_file} 和 {audio_file}")
-                            cleaned_count += 2 # Count both deleted files
-                        except FileNotFoundError:
-                            self._log_output("<<< 错误: 'ffmpeg' 命令未找到。请确保已正确安装并配置在系统 PATH 中。")
-                            self.master.after(0, lambda: messagebox.showerror("错误", "'ffmpeg' 命令未找到。\n请确保已正确安装并配置在系统 PATH 中。"))
-                        except subprocess.CalledProcessError as e:
-                            self._log_output(f"<<< FFmpeg 合并失败: {e.stderr}")
-                            self.master.after(0, lambda: messagebox.showerror("FFmpeg 错误", f"FFmpeg 合并失败: {e.stderr}"))
-                        except Exception as e:
-                            self._log_output(f"<<< 合并文件时发生错误: {e}")
-                            self.master.after(0, lambda: messagebox.showerror("合并错误", f"合并文件时发生错误: {e}"))
+                        merge_pairs.append((file_path, audio_file, os.path.join(target_directory, f"{base_name}.mp4")))
+
+        # 合并在后期处理线程池中并行执行，每对文件一个 ffmpeg 进程
+        def merge_task(video_file, audio_file, output_file):
+            return lambda on_progress: self._merge_pair(video_file, audio_file, output_file, on_progress)
+
+        if merge_pairs:
+            self._log_output(f"需要合并 {len(merge_pairs)} 对音视频文件，最多同时运行 {POSTPROC_WORKERS} 个 ffmpeg")
+        merged, merge_failures = self._run_postprocess_batch(
+            [(os.path.basename(output_file), merge_task(video_file, audio_file, output_file))
+             for video_file, audio_file, output_file in merge_pairs], "合并")
+        cleaned_count += 2 * len(merged) # Count both deleted files
         
         # Get all .xml files in the target directory and delete them
         xml_files = glob.glob(os.path.join(target_directory, "*.xml"))
         for file_path in xml_files:
             try:
                 os.remove(file_path)
+                self._forget_file(file_path)
                 self._log_output(f"已删除 XML 文件: {file_path}")
                 cleaned_count += 1
             except Exception as e:
                 self._log_output(f"删除文件失败 {file_path}: {e}")
         
         self._log_output(f"--- 清理完成，共删除 {cleaned_count} 个文件于 {target_directory} ---")
-        if cleaned_count > 0:
+        if merge_failures:
+            self._show_postprocess_failures("合并", merge_failures)
+        elif cleaned_count > 0:
             self.master.after(0, lambda: messagebox.showinfo("清理完成", f"在 {target_directory} 中成功删除了 {cleaned_count} 个文件。"))
         else:
             self.master.after(0, lambda: messagebox.showinfo("清理完成", f"在 {target_directory} 中未找到需要清理的文件。"))
 
+    def _merge_pair(self, video_file, audio_file, output_file, on_progress=None):
+        # 视频流直接复制；音频是 mp4 能容纳的编码 (B 站为 AAC) 时也直接复制，只重新封装
+        audio_args, copied = audio_codec_args(probe_codecs(audio_file)["audio"], ".mp4")
+        self._log_output(f"合并 {os.path.basename(output_file)}: 音频{'直接复制' if copied else '转码为 AAC'}")
+        run_ffmpeg_atomic(['-i', video_file, '-i', audio_file, '-map', '0:v:0', '-map', '1:a:0', '-c:v', 'copy'] + audio_args,
+                          output_file, probe_duration(video_file), on_progress)
+        # Delete original [00] and [01] files after successful merge
+        os.remove(video_file)
+        os.remove(audio_file)
+        if self.download_index:
+            self.download_index.replace_paths([video_file, audio_file], output_file)
+        self._log_output(f"合并成功: {output_file}，已删除原始文件: {video_file} 和 {audio_file}")
+
+    def _forget_file(self, path):
+        if self.download_index:
+            self.download_index.remove_path(path)
+
+    def _run_postprocess_batch(self, tasks, title):
+        """在有界线程池中并行执行后期处理任务 [(文件名, task)]，task(on_progress) 各自运行一个 ffmpeg 子进程
+
+        单个文件失败只记录下来，不中断其余文件；返回 (成功的文件名列表, [(文件名, 错误信息)])。
+        """
+        succeeded, failures = [], []
+        if not tasks:
+            return succeeded, failures
+        total = len(tasks)
+        active = {} # 正在处理的文件 -> 百分比
+
+        def progress_callback(name):
+            def on_progress(percent):
+                with self._postproc_lock:
+                    changed = int(percent) != int(active.get(name, -1))
+                    active[name] = percent
+                if changed:
+                    self._update_postprocess_status(title, len(succeeded) + len(failures), total, active)
+            return on_progress
+
+        self._update_postprocess_status(title, 0, total, active)
+        with ThreadPoolExecutor(max_workers=min(POSTPROC_WORKERS, total)) as pool:
+            futures = {}
+            for name, task in tasks:
+                futures[pool.submit(task, progress_callback(name))] = name
+            for future in as_completed(futures):
+                name = futures[future]
+                with self._postproc_lock:
+                    active.pop(name, None)
+                try:
+                    future.result()
+                    succeeded.append(name)
+                except FileNotFoundError:
+                    failures.append((name, "'ffmpeg' 命令未找到。请确保已正确安装并配置在系统 PATH 中。"))
+                except Exception as e:
+                    failures.append((name, str(e)))
+                if failures and failures[-1][0] == name:
+                    self._log_output(f"<<< {title}失败 {name}: {failures[-1][1]}")
+                done = len(succeeded) + len(failures)
+                self._log_output(f"{title}进度: {done}/{total}")
+                self._update_postprocess_status(title, done, total, active)
+        return succeeded, failures
+
+    def _update_postprocess_status(self, title, done, total, active):
+        with self._postproc_lock:
+            running = "，".join(f"{name} {percent:.0f}%" for name, percent in list(active.items())[:4])
+        text = f"{title}: {done}/{total}" + (f"  进行中: {running}" if running else "")
+        self.master.after(0, self._set_postprocess_status, text, 100.0 * done / total)
+
+    def _set_postprocess_status(self, text, percent):
+        self.postproc_status_var.set(text)
+        self.postproc_progressbar["value"] = percent
+
+    def _show_postprocess_failures(self, title, failures):
+        self._log_output(f"<<< {len(failures)} 个文件{title}失败:")
+        for name, error in failures:
+            self._log_output(f"    {name}: {error}")
+        summary = "\n".join(f"{name}: {error[:200]}" for name, error in failures[:5])
+        more = f"\n... 共 {len(failures)} 个" if len(failures) > 5 else ""
+        self.master.after(0, lambda: messagebox.showerror(f"{title}失败", f"以下文件{title}失败，其余文件已处理完成:\n{summary}{more}"))
+
+    def _start_album_watcher(self, download_path):
+        """开始边下载边处理：按当前的清理模式，文件一下载完就删除或合并，不必等整个列表下完"""
+        if download_path in self._album_watchers:
+            return
+        if self._pipeline_executor is None:
+            self._pipeline_executor = ThreadPoolExecutor(max_workers=POSTPROC_WORKERS, thread_name_prefix="postproc")
+        completed_parts = set() # 已下载完成、还没凑成对的 [00]/[01] 文件；只在监视线程中访问
+        watcher = AlbumWatcher(download_path, lambda path: self._pipeline_file(path, completed_parts))
+        self._album_watchers[download_path] = watcher
+        watcher.start()
+        self._log_output(f"边下载边处理: 监视 {download_path}，文件下载完成后立即按 {self.clean_mode_var.get()} 处理")
+
+    def _pipeline_file(self, path, completed_parts):
+        """AlbumWatcher 发现一个下载完成的文件时调用；需要 ffmpeg 的合并提交到线程池，返回其 Future
+
+        [00]/[01] 分段要等所属的下载任务成功结束才处理 (返回 False，下次扫描再问)：you-get 可能还会
+        自己合并或重写它们，任务结束时也已写好下载索引，合并、删除能同步更新索引。
+        """
+        directory, filename = os.path.split(path)
+        is_part = filename.endswith(".mp4") and ("[00]" in filename or "[01]" in filename)
+        if is_part and not self._download_succeeded(path):
+            return False
+        clean_mode = self.clean_mode_var.get()
+        delete = (filename.endswith(".xml")
+                  or (clean_mode == "保留音频" and is_part and "[00]" in filename)
+                  or (clean_mode == "保留视频" and is_part and "[01]" in filename))
+        if delete:
+            try:
+                os.remove(path)
+                self._forget_file(path)
+                self._log_output(f"边下载边处理: 已删除 {path}")
+            except OSError as e:
+                self._log_output(f"删除文件失败 {path}: {e}")
+            return None
+        if clean_mode != "保留两者" or not is_part:
+            return None
+        completed_parts.add(path)
+        base_name = filename.replace("[00]", "").replace("[01]", "").replace(".mp4", "")
+        video_file = os.path.join(directory, f"{base_name}[00].mp4")
+        audio_file = os.path.join(directory, f"{base_name}[01].mp4")
+        if video_file not in completed_parts or audio_file not in completed_parts:
+            return None # 等另一半下载完
+        completed_parts.difference_update((video_file, audio_file))
+        output_file = os.path.join(directory, f"{base_name}.mp4")
+
+        def merge():
+            try:
+                self._merge_pair(video_file, audio_file, output_file)
+            except Exception as e:
+                # 原文件保留，下载全部结束后的清理会再合并一次并汇总报告失败
+                self._log_output(f"<<< 边下载边合并失败 {output_file}: {e}")
+        return self._pipeline_executor.submit(merge)
+
+    def _download_succeeded(self, part_path):
+        """分段文件 X[00].mp4 / X[01].mp4 所属的下载任务 (you-get 报告过 X.mp4) 是否已经成功结束"""
+        directory, filename = os.path.split(os.path.abspath(part_path))
+        name = os.path.join(directory, filename.replace("[00]", "").replace("[01]", ""))
+        return any(job.status == "完成" and name in job.files for job in self.download_manager.jobs())
+
+    def _stop_album_watcher(self, download_path, watcher):
+        if watcher is not None:
+            watcher.stop()
+
+    def _finish_album(self, download_path, watcher):
+        """专辑的下载全部结束：等边下载边处理的任务做完，再整体清理一遍漏下的文件"""
+        self._stop_album_watcher(download_path, watcher)
+        self._clean_files_in_directory(download_path)
+
     def clean_duplicate_files_manual(self):
         folder_selected = filedialog.askdirectory(title="请选择要清理的专辑文件夹")
         if folder_selected:
@@ -238,7 +876,7 @@ class BiliDownloaderApp:
             self._log_output("错误：未指定专辑文件夹名，无法清理。")
             return
 
-        target_directory = os.path.join('/Users/qiqizhou/bili-dl/', album_name)
+        target_directory = os.path.join(DOWNLOAD_ROOT, album_name)
         if not os.path.isdir(target_directory):
             messagebox.showerror("错误", f"指定的专辑文件夹不存在或不是一个文件夹：\n{target_directory}")
             self._log_output(f"错误：指定的专辑文件夹不存在或不是一个文件夹：{target_directory}")
@@ -270,43 +908,43 @@ class BiliDownloaderApp:
             # 
             return filename
 
-        self._log_output(f"--- 开始重命名文件夹中的 MP4 文件: {target_directory} ---")
-        renamed_count = 0
+        output_ext = "." + self.audio_format_var.get()
+        self._log_output(f"--- 开始将文件夹中的 MP4 文件转为 {output_ext}: {target_directory} ---")
         mp4_files = glob.glob(os.path.join(target_directory, "*.mp4"))
-        for file_path in mp4_files:
-            try:
-                base, ext = os.path.splitext(file_path)
-                directory_of_base = os.path.dirname(base)
-                filename_of_base = os.path.basename(base)
-                print(f"directory_of_base: {directory_of_base}")
-                print(f"filename_of_base: {filename_of_base}")
-
-                filename_of_base = ai_convert_filename_to_clean_song_name(filename_of_base)
-                base = os.path.join(directory_of_base, filename_of_base)
-                
-                new_file_path = base + ".mp3"
-
-                # Convert mp4 file to mp3
-                subprocess.run([
-                    'ffmpeg',
-                    '-i', file_path,
-                    '-vn',  # No video
-                    '-acodec', 'libmp3lame',  # Use libmp3lame for MP3 encoding
-                    '-ab', '128k',  # Bitrate
-                    new_file_path
-                ])
-                # Delete the original mp4 file
+
+        def convert_task(file_path, new_file_path):
+            def task(on_progress):
+                # 去掉视频流；音频编码与目标格式一致时只重新封装 (-c:a copy)，否则转码
+                audio_args, copied = audio_codec_args(probe_codecs(file_path)["audio"], output_ext)
+                run_ffmpeg_atomic(['-i', file_path, '-vn'] + audio_args,
+                                  new_file_path, probe_duration(file_path), on_progress)
+                # 转换成功后才删除原始的 mp4 文件
                 os.remove(file_path)
-                self._log_output(f"已将 MP4 文件转换为 MP3: {file_path} -> {new_file_path}")
-                renamed_count += 1
-                self._log_output(f"即, 已 '重命名' : {file_path} -> {new_file_path}")
-                renamed_count += 1
-            except Exception as e:
-                self._log_output(f"重命名文件失败 {file_path}: {e}")
-        
+                if self.download_index:
+                    self.download_index.replace_paths([file_path], new_file_path)
+                self._log_output(f"已将 MP4 文件{'重新封装' if copied else '转码'}为 {output_ext}: {file_path} -> {new_file_path}")
+            return task
+
+        tasks = []
+        for file_path in mp4_files:
+            if file_path.endswith(".part.mp4"):
+                continue # 上次中断留下的临时文件
+            base, ext = os.path.splitext(file_path)
+            directory_of_base = os.path.dirname(base)
+            filename_of_base = ai_convert_filename_to_clean_song_name(os.path.basename(base))
+            new_file_path = os.path.join(directory_of_base, filename_of_base) + output_ext
+            tasks.append((os.path.basename(new_file_path), convert_task(file_path, new_file_path)))
+
+        if tasks:
+            self._log_output(f"需要转换 {len(tasks)} 个文件，最多同时运行 {POSTPROC_WORKERS} 个 ffmpeg")
+        converted, failures = self._run_postprocess_batch(tasks, "转音频")
+        renamed_count = len(converted)
+
         self._log_output(f"--- 重命名完成，共重命名 {renamed_count} 个文件于 {target_directory} ---")
-        if renamed_count > 0:
-            self.master.after(0, lambda: messagebox.showinfo("重命名完成", f"在 {target_directory} 中成功重命名了 {renamed_count} 个 MP4 文件为 MP3。 "))
+        if failures:
+            self._show_postprocess_failures("转音频", failures)
+        elif renamed_count > 0:
+            self.master.after(0, lambda: messagebox.showinfo("重命名完成", f"在 {target_directory} 中成功将 {renamed_count} 个 MP4 文件转为 {output_ext}。 "))
         else:
             self.master.after(0, lambda: messagebox.showinfo("重命名完成", f"在 {target_directory} 中未找到需要重命名的 MP4 文件。 "))
 
@@ -317,7 +955,7 @@ class BiliDownloaderApp:
             self._log_output("错误：未指定专辑文件夹名，无法重命名文件。")
             return
 
-        target_directory = os.path.join('/Users/qiqizhou/bili-dl/', album_name)
+        target_directory = os.path.join(DOWNLOAD_ROOT, album_name)
         if not os.path.isdir(target_directory):
             messagebox.showerror("错误", f"指定的专辑文件夹不存在或不是一个文件夹：\n{target_directory}")
             self._log_output(f"错误：指定的专辑文件夹不存在或不是一个文件夹：{target_directory}")
@@ -327,15 +965,17 @@ class BiliDownloaderApp:
         thread = threading.Thread(target=self._rename_files_in_directory, args=(target_directory,), daemon=True)
         thread.start()
 
+    def _get_urls(self):
+        """输入框中的所有视频地址 / BV 号，以换行、空格或逗号分隔，去重并保持顺序"""
+        items = re.split(r"[\s,，]+", self.url_text.get(1.0, tk.END))
+        return list(dict.fromkeys(normalize_video_url(item) for item in items if item))
+
     def get_video_info(self):
-        url = self.url_entry.get().strip()
-        if not url:
+        urls = self._get_urls()
+        if not urls:
             messagebox.showwarning("输入错误", "请输入视频 URL 或 ID！")
             return
-
-        # 如果是 ID，尝试构造成标准 URL
-        if url.lower().startswith("bv") or url.lower().startswith("av"):
-            url = f"https://www.bilibili.com/video/{url}"
+        url = urls[0] # 输入了多个时只查询第一个
 
         self.output_text.configure(state='normal')
         self.output_text.delete('1.0', tk.END)
@@ -351,35 +991,100 @@ class BiliDownloaderApp:
         thread = threading.Thread(target=self._run_command_in_thread, args=(command,), daemon=True)
         thread.start()
 
-    def _download_and_maybe_clean(self, command, download_path):
-        return_code = self._run_command_in_thread(command, download_path)
-        if return_code == 0 and self.auto_clean_var.get():
-            self._log_output("下载完成，开始自动清理...")
-            self._clean_files_in_directory(download_path)
-        elif return_code != 0:
-            self._log_output("下载失败，跳过自动清理。")
+    def _run_download_job(self, job):
+        """在下载线程中执行一次下载，返回 you-get 的返回码"""
+        def on_progress(text):
+            job.progress = text
+            self._on_job_update(job)
+
+        files = [] # you-get 本次写出的文件名
+        def on_line(line):
+            match = DOWNLOADED_FILE_RE.match(line)
+            if match:
+                files.append(match.group(1) or match.group(2))
+                job.files.add(os.path.abspath(os.path.join(job.download_path, files[-1])))
+
+        return_code = self._run_command_in_thread(job.command, job.download_path, log_prefix=f"[#{job.id}] ",
+                                                  on_progress=on_progress, on_line=on_line)
+        if return_code == 0 and self.download_index and job.part is not None:
+            self._index_downloaded_files(job, files)
+        return return_code
+
+    def _index_downloaded_files(self, job, files):
+        """把下载好的文件写入索引；与其他专辑中已有文件内容相同的换成硬链接，节省磁盘"""
+        paths = []
+        for name in files:
+            # 弹幕 .xml 不算视频内容，只有它在时不能算作已下载
+            if name.endswith(".xml"):
+                continue
+            # DASH 视频分成 X[00].mp4 / X[01].mp4 分别下载，you-get 合并后才有 X.mp4，三者都可能在磁盘上；
+            # 边下载边处理要等任务结束才动这些分段，之后的合并、删除由 _merge_pair / _forget_file 更新索引
+            paths.extend(downloaded_paths(job.download_path, name))
+        for path in dict.fromkeys(paths):
+            if not os.path.isfile(path):
+                continue
+            try:
+                size, sha256 = self.download_index.record(job.bvid, job.part, job.quality, path)
+                duplicate = self.download_index.find_duplicate(path, size, sha256)
+                if duplicate:
+                    hard_link_replace(duplicate, path)
+                    self._log_output(f"[#{job.id}] 与 {duplicate} 内容相同，已换成硬链接，节省 {size / 1024 / 1024:.1f} MB")
+            except (OSError, sqlite3.Error) as e:
+                self._log_output(f"[#{job.id}] 写入下载索引失败 {path}: {e}")
+
+    def _on_job_update(self, job):
+        # 由下载线程调用，只标记任务；一个刷新周期内的多次进度更新合并成一次，由 _pump_log 在主线程中更新表格
+        with self._dirty_jobs_lock:
+            self._dirty_jobs[job.id] = job
+
+    def _refresh_job_row(self, job):
+        values = (job.id, job.url, job.status, job.progress, job.attempts, job.message)
+        if self.job_table.exists(str(job.id)):
+            self.job_table.item(str(job.id), values=values)
+        else:
+            self.job_table.insert("", tk.END, iid=str(job.id), values=values)
+            self.job_table.see(str(job.id))
+        if job.status == "下载中" and self.auto_clean_var.get():
+            self._start_album_watcher(job.download_path)
+        if job.status in JOB_FINISHED_STATES:
+            self._maybe_auto_clean(job.download_path)
+
+    def _maybe_auto_clean(self, download_path):
+        """同一专辑文件夹的任务全部提交并结束后再自动清理，避免处理其他任务还没下载完的文件"""
+        if self._planning_albums.get(download_path):
+            return # 还有任务没提交；第一个任务可能在其余任务提交前就已失败
+        album_jobs = [job for job in self.download_manager.jobs() if job.download_path == download_path]
+        if any(job.status not in JOB_FINISHED_STATES for job in album_jobs):
+            return
+        watcher = self._album_watchers.pop(download_path, None)
+        finished = [job for job in album_jobs if job.status == "完成" and not job.cleaned]
+        for job in finished:
+            job.cleaned = True
+        if finished and self.auto_clean_var.get():
+            self._log_output(f"{download_path} 中的任务已全部结束，开始自动清理...")
+            threading.Thread(target=self._finish_album, args=(download_path, watcher), daemon=True).start()
+        elif watcher is not None:
+            threading.Thread(target=self._stop_album_watcher, args=(download_path, watcher), daemon=True).start()
+
+    def _on_max_workers_changed(self):
+        try:
+            self.download_manager.set_max_workers(int(self.max_workers_var.get()))
+        except (tk.TclError, ValueError):
+            pass # 输入框里暂时不是数字
 
     def download_video(self):
-        url = self.url_entry.get().strip()
+        urls = self._get_urls()
         album_name = self.album_name_entry.get().strip()
 
-        if not url:
+        if not urls:
             messagebox.showwarning("输入错误", "请输入视频 URL 或 ID！")
             return
         if not album_name:
             messagebox.showwarning("输入错误", "请输入专辑名 (文件夹名)！")
             return
 
-        # 如果是 ID，尝试构造成标准 URL
-        if url.lower().startswith("bv") or url.lower().startswith("av"):
-            url = f"https://www.bilibili.com/video/{url}"
-
-        self.output_text.configure(state='normal')
-        self.output_text.delete('1.0', tk.END)
-        self.output_text.configure(state='disabled')
-
         # 创建专辑文件夹（如果不存在）
-        download_path = os.path.join('/Users/qiqizhou/bili-dl/', album_name) # 下载到当前工作目录下的专辑文件夹
+        download_path = os.path.join(DOWNLOAD_ROOT, album_name) # 下载到当前工作目录下的专辑文件夹
         if not os.path.exists(download_path):
             try:
                 os.makedirs(download_path)
@@ -398,14 +1103,94 @@ class BiliDownloaderApp:
         elif selected_quality == "360p":
             format_string = "dash-flv360-AVC" # 假设的格式
 
+        try:
+            self.download_manager.max_retries = int(self.max_retries_var.get())
+            self.download_manager.set_max_workers(int(self.max_workers_var.get()))
+        except (tk.TclError, ValueError):
+            messagebox.showwarning("输入错误", "同时下载数和重试次数必须是整数！")
+            return
+
+        # 查询分 P 需要联网，在后台线程中展开并对照下载索引，再加入下载队列
+        self._planning_albums[download_path] = self._planning_albums.get(download_path, 0) + 1
+        threading.Thread(target=self._plan_downloads, daemon=True,
+                         args=(urls, download_path, selected_quality, format_string, self.is_playlist_var.get())).start()
+
+    def _submit_download(self, url, download_path, format_string, playlist=False, bvid=None, part=None, quality=None):
         command = ['you-get', f'--format={format_string}']
-        if self.is_playlist_var.get():
+        if playlist:
             command.append('--playlist')
         command.extend([url, '-c', self.cookies_path])
-        
         # you-get 默认下载到当前目录，所以我们用 cwd 参数指定下载目录
-        thread = threading.Thread(target=self._download_and_maybe_clean, args=(command, download_path), daemon=True)
-        thread.start()
+        self.download_manager.submit(DownloadJob(next(self._job_ids), url, download_path, command, bvid, part, quality))
+
+    def _plan_downloads(self, urls, download_path, quality, format_string, is_playlist):
+        """把输入展开成 (视频, 分 P) 任务，跳过下载索引中已有的，由下载队列按设置的并行数调度
+
+        播放列表通过 B 站接口查出所有分 P，每个分 P 单独下载 (?p=N)；查不到分 P 时 (如合集、接口失败)
+        退回到 you-get --playlist 一次下载整个列表，此时不做过滤。
+        """
+        try:
+            queued = skipped = linked = 0
+            for url in urls:
+                bvid = extract_bvid(url)
+                if bvid is None or self.download_index is None:
+                    self._submit_download(url, download_path, format_string, playlist=is_playlist)
+                    queued += 1
+                    continue
+                if is_playlist:
+                    parts = fetch_part_numbers(bvid)
+                    if not parts or len(parts) < 2:
+                        self._submit_download(url, download_path, format_string, playlist=True)
+                        queued += 1
+                        continue
+                    items = [(f"https://www.bilibili.com/video/{bvid}?p={part}", part) for part in parts]
+                else:
+                    items = [(url, extract_part(url))]
+                for item_url, part in items:
+                    reused = self._reuse_indexed_files(bvid, part, quality, download_path)
+                    if reused == "present":
+                        skipped += 1
+                    elif reused == "linked":
+                        linked += 1
+                    else:
+                        self._submit_download(item_url, download_path, format_string, bvid=bvid, part=part, quality=quality)
+                        queued += 1
+            self._log_output(f"已加入下载队列: {queued} 个任务，同时下载 {self.download_manager.max_workers} 个；"
+                             f"已下载过而跳过 {skipped} 个，从其他专辑硬链接 {linked} 个")
+        finally:
+            # _planning_albums 只在主线程中访问
+            self.master.after(0, self._finish_planning, download_path)
+
+    def _finish_planning(self, download_path):
+        self._planning_albums[download_path] -= 1
+        if not self._planning_albums[download_path]:
+            del self._planning_albums[download_path]
+        self._maybe_auto_clean(download_path)
+
+    def _reuse_indexed_files(self, bvid, part, quality, download_path):
+        """已下载过时返回 "present" (就在本专辑) 或 "linked" (从其他专辑硬链接过来)，需要下载时返回 None"""
+        try:
+            files = self.download_index.lookup(bvid, part, quality)
+            if not files:
+                return None
+            download_path = os.path.abspath(download_path)
+            if any(os.path.dirname(path) == download_path for path, _, _ in files):
+                return "present"
+            # 在其他专辑里：硬链接到本专辑，不再联网下载
+            for path, _, sha256 in files:
+                target = os.path.join(download_path, os.path.basename(path))
+                if os.path.exists(target):
+                    # 同名文件已经在了，内容不一定相同，按它自己的哈希登记
+                    self.download_index.record(bvid, part, quality, target)
+                    continue
+                os.link(path, target)
+                self.download_index.record(bvid, part, quality, target, sha256)
+            self._log_output(f"{bvid} P{part} 已在 {os.path.dirname(files[0][0])} 下载过，已硬链接到本专辑")
+            return "linked"
+        except (OSError, sqlite3.Error) as e:
+            # 跨文件系统等原因无法硬链接时照常下载
+            self._log_output(f"{bvid} P{part} 无法复用已下载的文件，重新下载: {e}")
+            return None
 
 if __name__ == "__main__":
     root = tk.Tk()
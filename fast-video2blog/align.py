@@ -0,0 +1,75 @@
+"""说话人区间索引：按重叠时长为每个转录片段分配说话人"""
+import heapq
+
+UNKNOWN_SPEAKER = "未知说话人"
+
+
+def annotation_to_turns(diarization):
+    """把 pyannote 的 Annotation 转成可序列化的 [(start, end, speaker), ...]"""
+    return [(turn.start, turn.end, speaker) for turn, _, speaker in diarization.itertracks(yield_label=True)]
+
+
+class SpeakerIndex:
+    """由说话人分离结果一次性构建的有序区间索引
+
+    turns 按开始时间排序后存成平行列表，与排序后的片段做双指针扫描，
+    不再对每个片段从头遍历 itertracks。说话人重叠的区间各自累计重叠时长。
+    扫描逐个读取元素，用 Python 列表而不是 numpy 数组：numpy 标量下标访问反而更慢。
+    """
+
+    def __init__(self, turns):
+        turns = sorted((start, end, speaker) for start, end, speaker in turns if end > start)
+        self.starts = [t[0] for t in turns]
+        self.ends = [t[1] for t in turns]
+        self.speakers = [t[2] for t in turns]
+
+    def __len__(self):
+        return len(self.starts)
+
+    def assign(self, segments):
+        """为每个片段返回重叠时长最长的说话人，顺序与输入一致
+
+        片段按开始时间排序后与 turns 做双指针归并，活动区间用按结束时间排序的堆维护，
+        总复杂度 O((片段数 + turns 数) log n + 重叠数)。
+        """
+        labels = [UNKNOWN_SPEAKER] * len(segments)
+        order = sorted(range(len(segments)), key=lambda i: segments[i]["start"])
+        active = []  # (end, turn 下标)
+        j = 0
+        for i in order:
+            start, end = segments[i]["start"], segments[i]["end"]
+            while j < len(self.starts) and self.starts[j] < end:
+                heapq.heappush(active, (self.ends[j], j))
+                j += 1
+            # 结束时间不晚于当前片段开始的 turn 对后续片段也不会再重叠
+            while active and active[0][0] <= start:
+                heapq.heappop(active)
+            best_speaker, best_overlap = None, 0.0
+            totals = {}
+            for turn_end, k in active:
+                overlap = min(end, turn_end) - max(start, self.starts[k])
+                if overlap <= 0:
+                    continue
+                speaker = self.speakers[k]
+                totals[speaker] = totals.get(speaker, 0.0) + overlap
+                if totals[speaker] > best_overlap:
+                    best_speaker, best_overlap = speaker, totals[speaker]
+            if best_speaker is not None:
+                labels[i] = best_speaker
+        return labels
+
+
+def format_speaker_transcript(segments, speakers):
+    """把连续属于同一说话人的片段合并成 "说话人: 文本" 段落"""
+    final_result = []
+    current_speaker = None
+    current_speech = ""
+    for segment, speaker in zip(segments, speakers):
+        if speaker != current_speaker and current_speech:
+            final_result.append(f"{current_speaker}: {current_speech.strip()}")
+            current_speech = ""
+        current_speaker = speaker
+        current_speech += segment["text"] + " "
+    if current_speech: # 添加最后一段语音
+        final_result.append(f"{current_speaker}: {current_speech.strip()}")
+    return "\n".join(final_result)
@@ -0,0 +1,93 @@
+"""基于 ffmpeg 的流式音频读取
+
+一次 ffmpeg 调用 (-vn) 直接输出 16 kHz 单声道 float32 PCM，不经过 pydub 和临时 WAV；
+时长从容器元数据 (ffprobe) 读取，不需要先解码。
+解码结果可以放在内存映射的 .npy 文件里，whisper、pyannote 和并行转录的子进程共享同一份数据。
+"""
+import os
+import subprocess
+
+import numpy as np
+
+SAMPLE_RATE = 16000  # whisper / pyannote 都使用 16 kHz
+_BYTES_PER_SAMPLE = 4  # float32
+
+
+def probe_duration(path):
+    """用 ffprobe 读取容器记录的时长（秒），读不到时返回 None"""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-show_entries", "format=duration",
+             "-of", "default=noprint_wrappers=1:nokey=1", path],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+        return float(out)
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        # OSError: 没装 ffprobe (FileNotFoundError) 或无法执行
+        return None
+
+
+def _open_pcm_stream(path, sample_rate, start=None, duration=None):
+    cmd = ["ffmpeg", "-nostdin", "-v", "error"]
+    if start:
+        cmd += ["-ss", f"{start:.3f}"]
+    cmd += ["-i", path]
+    if duration:
+        cmd += ["-t", f"{duration:.3f}"]
+    cmd += ["-vn", "-ac", "1", "-ar", str(sample_rate), "-f", "f32le", "-"]
+    return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+
+def _finish(process):
+    stderr = process.stderr.read().decode("utf-8", errors="replace")
+    if process.wait() != 0:
+        raise RuntimeError(f"ffmpeg 解码失败: {stderr.strip()}")
+
+
+def allocate_buffer(n_samples, memmap_path=None):
+    """分配 float32 缓冲区；给出 memmap_path 时使用内存映射的 .npy 文件"""
+    if memmap_path:
+        return np.lib.format.open_memmap(memmap_path, mode="w+", dtype=np.float32, shape=(n_samples,))
+    return np.empty(n_samples, dtype=np.float32)
+
+
+def load_pcm(path, sample_rate=SAMPLE_RATE, duration=None, memmap_path=None):
+    """一次解码整条音轨到预分配的 float32 数组
+
+    数组按 ffprobe 给出的时长预先分配，ffmpeg 的输出直接 readinto 进去，
+    没有中间拷贝；时长未知或偏小时才按块扩容。
+    返回的数组总是从缓冲区开头切出的视图，memmap 模式下仍然是 np.memmap。
+    """
+    if duration is None:
+        duration = probe_duration(path)
+    capacity = int((duration or 60.0) * sample_rate) + sample_rate  # 多留 1 秒余量
+    audio = allocate_buffer(capacity, memmap_path)
+    filled = 0  # 已写入的字节数
+    process = _open_pcm_stream(path, sample_rate)
+    try:
+        while True:
+            if filled == audio.nbytes:
+                # memmap 模式下扩容写到新文件，旧文件随调用方的临时目录一起删除
+                grown_path = memmap_path and f"{os.path.splitext(memmap_path)[0]}-{len(audio) * 2}.npy"
+                grown = allocate_buffer(len(audio) * 2, grown_path)
+                grown[:len(audio)] = audio
+                audio = grown
+            n = process.stdout.readinto(memoryview(audio).cast("B")[filled:])
+            if not n:
+                break
+            filled += n
+        _finish(process)
+    finally:
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+    return audio[:filled // _BYTES_PER_SAMPLE]
+
+
+def audiosegment_to_pcm(segment, sample_rate=SAMPLE_RATE, memmap_path=None):
+    """把 pydub 的 AudioSegment 在内存中转换成 16 kHz 单声道 float32，不再导出临时 WAV"""
+    segment = segment.set_channels(1).set_frame_rate(sample_rate).set_sample_width(2)
+    samples = np.frombuffer(segment.raw_data, dtype=np.int16)
+    audio = allocate_buffer(len(samples), memmap_path)
+    np.multiply(samples, 1 / 32768.0, out=audio, casting="unsafe")
+    return audio
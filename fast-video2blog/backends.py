@@ -0,0 +1,253 @@
+"""可插拔的语音识别后端
+
+所有后端的 transcribe 都返回同样的结构：
+    {"text": str, "language": str | None, "segments": [{"start": 秒, "end": 秒, "text": str}, ...]}
+因此说话人对齐、缓存和分块拼接不关心具体用的是哪个后端。
+"""
+import importlib.util
+import os
+import platform
+from bisect import bisect_right
+
+from audio_io import SAMPLE_RATE
+from model_registry import registry
+
+DEFAULT_MODEL_SIZE = "medium"
+
+
+def _has_module(name):
+    try:
+        return importlib.util.find_spec(name) is not None
+    except (ImportError, ValueError):
+        return False
+
+
+def _cuda_available():
+    if not _has_module("torch"):
+        return False
+    import torch
+    return torch.cuda.is_available()
+
+
+class TranscriptionBackend:
+    name = None # 界面和命令行里使用的名字
+    registry_backend = None # model_registry 中的加载器名
+
+    def __init__(self, model_size=DEFAULT_MODEL_SIZE, device=None):
+        self.model_size = model_size
+        self.device = device or self.default_device()
+        self.model_name = self.model_name_for(model_size)
+        self.dtype = None
+
+    @classmethod
+    def is_available(cls):
+        raise NotImplementedError
+
+    def default_device(self):
+        return "cpu"
+
+    def model_name_for(self, model_size):
+        return model_size
+
+    def registry_spec(self):
+        """(backend, 模型名, device, dtype)，可直接交给 registry.preload"""
+        return (self.registry_backend, self.model_name, self.device, self.dtype)
+
+    def load(self, log=None):
+        return registry.get(*self.registry_spec(), log=log)
+
+    def cache_settings(self):
+        return {"backend": self.name, "model": self.model_name}
+
+    def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+        raise NotImplementedError
+
+    def transcribe_batch(self, windows, language=None, log=None):
+        """转录一批不超过 30 秒的窗口，返回每个窗口的结果（时间戳相对窗口开头）
+
+        默认逐个调用 transcribe；支持批量推理的后端覆盖它，编码器和解码器一次处理整批，
+        解码失败（重复、置信度过低）的窗口再单独走 transcribe 的温度回退。
+        同一窗口的结果不受批大小影响，也不用前一个窗口的文本作提示。
+        """
+        return [self.transcribe(window, language=language, log=log) for window in windows]
+
+
+def _normalize(segments, text=None, language=None):
+    segments = [{"start": float(seg["start"]), "end": float(seg["end"]), "text": seg["text"]} for seg in segments]
+    if text is None:
+        text = "".join(seg["text"] for seg in segments)
+    return {"text": text, "language": language, "segments": segments}
+
+
+class WhisperBackend(TranscriptionBackend):
+    """openai-whisper，PyTorch 实现，可用 MPS / CUDA / CPU"""
+    name = "whisper"
+    registry_backend = "whisper"
+
+    @classmethod
+    def is_available(cls):
+        return _has_module("whisper")
+
+    def default_device(self):
+        import torch
+        if torch.cuda.is_available():
+            return "cuda"
+        return "mps" if torch.backends.mps.is_available() else "cpu"
+
+    def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+        model = self.load(log=log)
+        # verbose=None 不向控制台打印任何内容
+        result = model.transcribe(audio, verbose=None, initial_prompt=initial_prompt, language=language)
+        return _normalize(result["segments"], result["text"], result.get("language"))
+
+    def transcribe_batch(self, windows, language=None, log=None):
+        import torch
+        import whisper
+        from whisper.tokenizer import get_tokenizer
+        model = self.load(log=log)
+        # 每个窗口补齐到 30 秒后堆成 [N, n_mels, 3000]，whisper.decode 对整批做一次编码和逐步解码
+        mel = torch.stack([
+            whisper.log_mel_spectrogram(whisper.pad_or_trim(torch.from_numpy(window)), model.dims.n_mels)
+            for window in windows
+        ]).to(model.device)
+        options = whisper.DecodingOptions(language=language, temperature=0.0, fp16=self.device != "cpu")
+        results = whisper.decode(model, mel, options)
+        tokenizer = get_tokenizer(model.is_multilingual, num_languages=model.num_languages)
+        return [
+            self.transcribe(window, language=language or result.language, log=log) if _needs_fallback(result)
+            else _normalize(_segments_from_tokens(tokenizer, result.tokens, len(window) / SAMPLE_RATE),
+                            language=result.language)
+            for result, window in zip(results, windows)
+        ]
+
+
+def _needs_fallback(result):
+    """贪心解码的结果是否要用更高温度重新解码，判据与 whisper.transcribe 的默认阈值相同"""
+    if result.no_speech_prob > 0.6 and result.avg_logprob < -1.0:
+        return False # 静音窗口，whisper.transcribe 也会直接跳过
+    return result.compression_ratio > 2.4 or result.avg_logprob < -1.0
+
+
+def _segments_from_tokens(tokenizer, tokens, duration):
+    """按时间戳 token 把解码结果切成片段：<|0.00|> 文本 <|2.40|><|2.40|> 文本 <|5.00|> ..."""
+    segments = []
+    start = None
+    text_tokens = []
+    for token in tokens:
+        if token < tokenizer.timestamp_begin:
+            text_tokens.append(token)
+            continue
+        seconds = (token - tokenizer.timestamp_begin) * 0.02
+        if start is not None and text_tokens:
+            segments.append({"start": start, "end": seconds, "text": tokenizer.decode(text_tokens)})
+            text_tokens = []
+            start = None
+        else:
+            start = seconds
+    if text_tokens:
+        # 最后一段没有结束时间戳，延续到窗口末尾
+        segments.append({"start": start or 0.0, "end": duration, "text": tokenizer.decode(text_tokens)})
+    return segments
+
+
+class MlxWhisperBackend(TranscriptionBackend):
+    """mlx-whisper，只能在 Apple Silicon 上运行"""
+    name = "mlx"
+    registry_backend = "mlx_whisper"
+
+    def __init__(self, model_size=DEFAULT_MODEL_SIZE, device=None):
+        super().__init__(model_size, device)
+        self.dtype = "float16"
+
+    @classmethod
+    def is_available(cls):
+        return platform.system() == "Darwin" and platform.machine() == "arm64" and _has_module("mlx_whisper")
+
+    def default_device(self):
+        return "metal"
+
+    def model_name_for(self, model_size):
+        return f"mlx-community/whisper-{model_size}-mlx"
+
+    def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+        import mlx_whisper
+        from mlx_whisper.transcribe import ModelHolder
+        # mlx_whisper.transcribe 只认模型路径，把常驻模型放进它内部的 ModelHolder，避免重新加载权重
+        ModelHolder.model = self.load(log=log)
+        ModelHolder.model_path = self.model_name
+        result = mlx_whisper.transcribe(audio, path_or_hf_repo=self.model_name, verbose=None,
+                                        initial_prompt=initial_prompt, language=language)
+        return _normalize(result["segments"], result["text"], result.get("language"))
+
+
+class FasterWhisperBackend(TranscriptionBackend):
+    """faster-whisper (CTranslate2)，CPU 上使用 int8 量化，适合没有 GPU 的 Linux 服务器"""
+    name = "faster-whisper"
+    registry_backend = "faster_whisper"
+
+    def __init__(self, model_size=DEFAULT_MODEL_SIZE, device=None, compute_type=None):
+        super().__init__(model_size, device)
+        self.dtype = compute_type or ("int8" if self.device == "cpu" else "float16")
+
+    @classmethod
+    def is_available(cls):
+        return _has_module("faster_whisper")
+
+    def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+        model = self.load(log=log)
+        segments, info = model.transcribe(audio, initial_prompt=initial_prompt, language=language, beam_size=5)
+        # faster-whisper 返回的是惰性生成器，遍历时才真正解码
+        segments = [{"start": seg.start, "end": seg.end, "text": seg.text} for seg in segments]
+        return _normalize(segments, language=info.language)
+
+    def transcribe_batch(self, windows, language=None, log=None):
+        import numpy as np
+        from faster_whisper import BatchedInferencePipeline
+        pipeline = BatchedInferencePipeline(model=self.load(log=log))
+        # 把整批窗口首尾相接，用 clip_timestamps（秒）告诉批量管线每个窗口的位置，不再做 VAD
+        starts = np.cumsum([0] + [len(window) for window in windows[:-1]]) / SAMPLE_RATE
+        clips = [{"start": float(start), "end": float(start + len(window) / SAMPLE_RATE)}
+                 for start, window in zip(starts, windows)]
+        segments, info = pipeline.transcribe(np.concatenate(windows), language=language, beam_size=5,
+                                             batch_size=len(windows), clip_timestamps=clips, vad_filter=False)
+        per_window = [[] for _ in windows]
+        for seg in segments:
+            i = max(bisect_right(starts, seg.start) - 1, 0)
+            per_window[i].append({"start": seg.start - starts[i], "end": seg.end - starts[i], "text": seg.text})
+        return [_normalize(segments, language=info.language) for segments in per_window]
+
+
+def _load_faster_whisper(name, device, dtype):
+    from faster_whisper import WhisperModel
+    # 多进程并行时每个进程只分到几个线程，由 FV2B_CPU_THREADS 指定；0 表示 CTranslate2 的默认值
+    threads = int(os.environ.get("FV2B_CPU_THREADS", "0"))
+    return WhisperModel(name, device=device, compute_type=dtype or "int8", cpu_threads=threads)
+
+
+registry.register_loader("faster_whisper", _load_faster_whisper)
+
+BACKENDS = {cls.name: cls for cls in (WhisperBackend, MlxWhisperBackend, FasterWhisperBackend)}
+
+
+def available_backends():
+    return [name for name, cls in BACKENDS.items() if cls.is_available()]
+
+
+def select_backend(name="auto", model_size=DEFAULT_MODEL_SIZE, device=None):
+    """按名字创建后端；"auto" 时根据本机情况选择
+
+    Apple Silicon 优先 mlx，有 CUDA 时用 whisper，其余 (CPU-only Linux 等) 优先 int8 的 faster-whisper。
+    """
+    if name != "auto":
+        if name not in BACKENDS:
+            raise ValueError(f"未知的语音识别后端: {name}，可选: {', '.join(BACKENDS)}")
+        return BACKENDS[name](model_size, device)
+    if MlxWhisperBackend.is_available():
+        return MlxWhisperBackend(model_size, device)
+    if FasterWhisperBackend.is_available() and not _cuda_available():
+        return FasterWhisperBackend(model_size, device)
+    if WhisperBackend.is_available():
+        return WhisperBackend(model_size, device)
+    if FasterWhisperBackend.is_available():
+        return FasterWhisperBackend(model_size, device)
+    raise RuntimeError("没有可用的语音识别后端，请安装 openai-whisper、faster-whisper 或 mlx-whisper")
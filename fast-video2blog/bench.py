@@ -0,0 +1,447 @@
+"""fast-video2blog 微基准
+
+用法:
+    python bench.py align [--segments 10000] [--turns 5000]
+    python bench.py backends [--audio bench_fixtures/sample.wav] [--reference bench_fixtures/sample.txt]
+    python bench.py batch [--audio a.wav b.wav ...] [--batch-sizes 1 4 8 16]
+    python bench.py startup [--modules main cli] [--max-seconds 1.0]
+    python bench.py suite [--seconds 60 600] [--speech bench_fixtures/sample.wav] [--threshold 0.15]
+
+suite 离线运行在只有 CPU 的机器上：测试音频由 ffmpeg 合成（断续的调频音 + 粉红噪声，带一条小视频轨），
+语音识别默认用不加载任何模型的桩后端，只衡量解码、切块、推送和对齐这些本项目自己的开销。
+结果追加到 JSON 历史文件，与同一台机器最近几次结果的中位数比较，变差超过阈值时以非零状态退出。
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import re
+import subprocess
+import sys
+import time
+import unicodedata
+from datetime import datetime
+
+from align import SpeakerIndex
+
+
+def make_alignment_fixture(n_segments, n_turns, duration=None, seed=0):
+    """生成随机的转录片段和说话人区间（含重叠说话）"""
+    rng = random.Random(seed)
+    duration = duration or n_segments * 3.0
+    segments = []
+    t = 0.0
+    step = duration / n_segments
+    for i in range(n_segments):
+        length = rng.uniform(0.5, 2 * step)
+        segments.append({"start": t, "end": t + length, "text": f"片段{i}"})
+        t += step
+    turns = []
+    turn_step = duration / n_turns
+    for i in range(n_turns):
+        start = i * turn_step + rng.uniform(-0.3, 0.3) * turn_step
+        # 约 10% 的 turn 拉长，与下一位说话人重叠
+        length = turn_step * (rng.uniform(1.2, 2.0) if rng.random() < 0.1 else rng.uniform(0.6, 1.0))
+        turns.append((max(start, 0.0), max(start, 0.0) + length, f"SPEAKER_{rng.randrange(6):02d}"))
+    return segments, turns
+
+
+def naive_assign(segments, turns):
+    """旧实现：每个片段取中点，从头线性扫描所有 turn"""
+    labels = []
+    for segment in segments:
+        time_to_check = (segment["start"] + segment["end"]) / 2.0
+        speaker = "未知说话人"
+        for start, end, label in turns:
+            if start <= time_to_check < end:
+                speaker = label
+                break
+        labels.append(speaker)
+    return labels
+
+
+def bench_align(args):
+    segments, turns = make_alignment_fixture(args.segments, args.turns)
+    start = time.perf_counter()
+    index = SpeakerIndex(turns)
+    built = time.perf_counter()
+    labels = index.assign(segments)
+    done = time.perf_counter()
+    print(f"片段 {args.segments} x 说话人区间 {args.turns}")
+    print(f"  区间索引: 构建 {1000 * (built - start):.1f} ms，分配 {1000 * (done - built):.1f} ms")
+    if not args.skip_naive:
+        start = time.perf_counter()
+        naive = naive_assign(segments, turns)
+        elapsed = time.perf_counter() - start
+        agree = sum(a == b for a, b in zip(labels, naive)) / len(labels)
+        print(f"  线性扫描: {1000 * elapsed:.1f} ms，与区间索引结果一致率 {agree:.1%}")
+
+
+def _tokens(text):
+    """含中日韩文字时按字切分 (即 CER)，否则按空格切分单词；忽略标点和大小写"""
+    text = "".join(ch for ch in text.lower() if not unicodedata.category(ch).startswith("P"))
+    if re.search(r"[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af]", text):
+        return [ch for ch in text if not ch.isspace()]
+    return text.split()
+
+
+def word_error_rate(reference, hypothesis):
+    """编辑距离 / 参考长度"""
+    ref, hyp = _tokens(reference), _tokens(hypothesis)
+    previous = list(range(len(hyp) + 1))
+    for i, r in enumerate(ref, 1):
+        current = [i] + [0] * len(hyp)
+        for j, h in enumerate(hyp, 1):
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (r != h))
+        previous = current
+    return previous[-1] / max(len(ref), 1)
+
+
+def bench_backends(args):
+    from audio_io import SAMPLE_RATE, load_pcm
+    from backends import available_backends, select_backend
+
+    if not os.path.exists(args.audio):
+        raise SystemExit(f"找不到样例音频 {args.audio}，请用 --audio 指定一段语音并用 --reference 提供对应文本")
+    reference = None
+    if args.reference and os.path.exists(args.reference):
+        with open(args.reference, "r", encoding="utf-8") as f:
+            reference = f.read()
+    audio = load_pcm(args.audio)
+    duration = len(audio) / SAMPLE_RATE
+    names = args.backends or available_backends()
+    print(f"样例: {args.audio} ({duration:.1f} 秒)，模型 {args.model}")
+    print(f"{'后端':<16}{'加载(秒)':>10}{'转录(秒)':>10}{'RTF':>8}{'WER':>8}")
+    for name in names:
+        backend = select_backend(name, args.model)
+        start = time.perf_counter()
+        backend.load()
+        loaded = time.perf_counter()
+        result = backend.transcribe(audio)
+        done = time.perf_counter()
+        wer = f"{word_error_rate(reference, result['text']):.1%}" if reference is not None else "-"
+        print(f"{name:<16}{loaded - start:>10.2f}{done - loaded:>10.2f}{(done - loaded) / duration:>8.3f}{wer:>8}")
+
+
+def bench_batch(args):
+    from audio_io import SAMPLE_RATE, load_pcm
+    from backends import select_backend
+    from chunking import collect_segments, iter_transcribe_batched, transcribe_many_batched
+
+    missing = [path for path in args.audio if not os.path.exists(path)]
+    if missing:
+        raise SystemExit(f"找不到样例音频 {', '.join(missing)}，请用 --audio 指定一段或多段语音")
+    audios = [load_pcm(path) for path in args.audio]
+    duration = sum(len(audio) for audio in audios) / SAMPLE_RATE
+    backend = select_backend(args.backend, args.model)
+    backend.load()
+    print(f"样例: {len(audios)} 个文件 ({duration:.1f} 秒)，后端 {backend.name}，模型 {args.model}")
+    print(f"{'批大小':<8}{'用时(秒)':>10}{'音频秒/秒':>12}{'与首行一致':>12}")
+    baseline = None
+    for batch_size in args.batch_sizes:
+        start = time.perf_counter()
+        if len(audios) == 1:
+            texts = [collect_segments(iter_transcribe_batched(audios[0], backend, batch_size))["text"]]
+        else:
+            texts = [result["text"] for result in transcribe_many_batched(audios, backend, batch_size)]
+        elapsed = time.perf_counter() - start
+        baseline = baseline or texts
+        print(f"{batch_size:<8}{elapsed:>10.2f}{duration / elapsed:>12.1f}{'是' if texts == baseline else '否':>12}")
+
+
+HEAVY_MODULES = ("torch", "whisper", "pyannote.audio", "pydub", "mlx_whisper", "faster_whisper")
+
+
+def measure_import(module):
+    """在新的解释器里导入 module，返回 (总耗时秒, 最慢的顶层导入 [(耗时秒, 模块名)], 被连带导入的重模块)"""
+    probe = f"import sys; import {module}; print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    completed = subprocess.run([sys.executable, "-X", "importtime", "-c", probe],
+                               capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        errors = [line for line in completed.stderr.splitlines() if not line.startswith("import time:")]
+        raise SystemExit(f"导入 {module} 失败:\n" + "\n".join(errors[-20:]))
+    top_level = []
+    for line in completed.stderr.splitlines():
+        # 格式: "import time:  self [us] |  cumulative | 模块名"，模块名前没有缩进的是顶层导入
+        match = re.match(r"import time:\s+\d+ \|\s+(\d+) \| (\S+)$", line)
+        if match:
+            top_level.append((int(match.group(1)) / 1e6, match.group(2)))
+    heavy = [name for name in completed.stdout.strip().split(",") if name]
+    return sum(seconds for seconds, _ in top_level), sorted(top_level, reverse=True), heavy
+
+
+def bench_startup(args):
+    slow = False
+    for module in args.modules:
+        total, top_level, heavy = measure_import(module)
+        over = total > args.max_seconds
+        slow = slow or over
+        print(f"import {module}: {total:.3f} 秒" + (f"，超出 {args.max_seconds} 秒" if over else ""))
+        for seconds, name in top_level[:args.top]:
+            print(f"  {seconds:8.3f} 秒  {name}")
+        if heavy:
+            print(f"  启动时被导入的重模块: {', '.join(heavy)}")
+    if slow:
+        sys.exit(1)
+
+
+def register_stub_backend():
+    """注册不加载模型的桩后端 "stub"，Transcriber 和 select_backend 可以按名字使用它
+
+    按 5 秒窗口计算音量，有声的窗口产出一个固定文本的片段；运行时间与音频长度成正比，
+    但远小于真实模型，用来衡量转录流程本身的开销。在函数里定义是为了 align / startup 不必导入 numpy。
+    """
+    import numpy as np
+    from audio_io import SAMPLE_RATE
+    from backends import BACKENDS, TranscriptionBackend
+
+    class StubBackend(TranscriptionBackend):
+        name = "stub"
+        window_seconds = 5.0
+
+        @classmethod
+        def is_available(cls):
+            return True
+
+        def load(self, log=None):
+            return None
+
+        def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+            window = int(self.window_seconds * SAMPLE_RATE)
+            segments = []
+            for i, start in enumerate(range(0, len(audio), window)):
+                chunk = np.asarray(audio[start:start + window], dtype=np.float32)
+                if chunk.size and float(np.sqrt(np.mean(chunk * chunk))) > 0.01:
+                    end = min(start + window, len(audio))
+                    segments.append({"start": start / SAMPLE_RATE, "end": end / SAMPLE_RATE, "text": f"片段{i}"})
+            return {"text": "".join(seg["text"] for seg in segments), "language": "zh", "segments": segments}
+
+    return BACKENDS.setdefault(StubBackend.name, StubBackend)
+
+
+def make_synthetic_fixture(path, seconds):
+    """用 ffmpeg 合成测试视频：约 0.6 秒一段的调频音和静音交替，叠加粉红噪声，附一条 160x90 的视频轨"""
+    if os.path.exists(path):
+        return path
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tone = "0.3*sin(2*PI*(200+60*sin(2*PI*0.5*t))*t)*gt(sin(2*PI*0.8*t),0)"
+    subprocess.run(
+        ["ffmpeg", "-nostdin", "-v", "error", "-y",
+         "-f", "lavfi", "-i", f"aevalsrc='{tone}':s=44100:d={seconds}",
+         "-f", "lavfi", "-i", f"anoisesrc=color=pink:amplitude=0.03:sample_rate=44100:d={seconds}",
+         "-f", "lavfi", "-i", f"color=c=black:s=160x90:r=5:d={seconds}",
+         "-filter_complex", "[0:a][1:a]amix=inputs=2:normalize=0[a]", "-map", "2:v", "-map", "[a]",
+         "-c:v", "mpeg4", "-c:a", "aac", "-b:a", "96k", "-shortest", path + ".part.mp4"],
+        check=True,
+    )
+    os.replace(path + ".part.mp4", path)
+    return path
+
+
+def decode_peak_mb(path, memmap):
+    """解码 path 期间本进程 RSS 的增量 (MB)；由 measure_decode_memory 在新的解释器里调用"""
+    import tempfile
+
+    from audio_io import load_pcm
+    from metrics import JobMetrics, current_rss_bytes
+
+    metrics = JobMetrics("decode")
+    baseline = current_rss_bytes()
+    with tempfile.TemporaryDirectory(prefix="fv2b-bench-") as tmp:
+        with metrics.stage("decode"):
+            audio = load_pcm(path, memmap_path=os.path.join(tmp, "audio.npy") if memmap else None)
+            float(audio[::4096].sum()) # 确保数据真的被读过
+        del audio
+    return metrics.stages["decode"]["peak_rss_mb"] - baseline / 1024 / 1024
+
+
+def measure_decode_memory(path, memmap):
+    """在新的解释器里解码，避免前面的测试留下的内存影响峰值"""
+    probe = f"import bench; print(bench.decode_peak_mb({path!r}, {memmap!r}))"
+    completed = subprocess.run([sys.executable, "-c", probe], capture_output=True, text=True,
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    if completed.returncode != 0:
+        raise SystemExit(f"解码内存测试失败:\n{completed.stderr[-2000:]}")
+    return float(completed.stdout.strip().splitlines()[-1])
+
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def run_suite(fixtures, backends, align_sizes, model_size="small"):
+    """依次运行各项测试，返回 {指标名: {"value", "unit", "better": "lower" | "higher"}}"""
+    from audio_io import SAMPLE_RATE, load_pcm
+    from backends import select_backend
+    from chunking import iter_transcribe_sequential
+    from transcriber import Transcriber
+
+    register_stub_backend()
+    results = {}
+
+    def record(name, value, unit, better="lower"):
+        results[name] = {"value": round(value, 4), "unit": unit, "better": better}
+        print(f"  {name:<36}{value:>12.3f} {unit}")
+
+    longest = None
+    for label, path in fixtures.items():
+        print(f"{label}: {path}")
+        elapsed, audio = _timed(load_pcm, path)
+        seconds = len(audio) / SAMPLE_RATE
+        record(f"extract.{label}", seconds / elapsed, "音频秒/秒", better="higher")
+        if longest is None or seconds > longest[1]:
+            longest = (audio, seconds, label)
+        del audio
+        record(f"decode_mb.{label}", measure_decode_memory(path, memmap=False), "MB")
+        record(f"decode_mb.{label}.memmap", measure_decode_memory(path, memmap=True), "MB")
+
+        transcriber = Transcriber(path, diarize=False, use_cache=False, backend="stub", metrics_file="",
+                                  resume=False, use_subtitles=False)
+        elapsed, _ = _timed(transcriber.process)
+        record(f"e2e.{label}", elapsed, "秒")
+
+    if longest is not None:
+        audio, seconds, label = longest
+        print(f"语音识别 ({label}, {seconds:.0f} 秒)")
+        for name in backends:
+            backend = select_backend(name, model_size)
+            backend.load()
+
+            def transcribe_chunk(chunk, prompt, language):
+                return backend.transcribe(chunk, initial_prompt=prompt, language=language)
+
+            elapsed, _ = _timed(lambda: list(iter_transcribe_sequential(audio, transcribe_chunk)))
+            record(f"asr_rtf.{name}", elapsed / seconds, "RTF")
+
+    print("说话人对齐")
+    for n in align_sizes:
+        segments, turns = make_alignment_fixture(n, max(n // 2, 1))
+        elapsed, _ = _timed(lambda: SpeakerIndex(turns).assign(segments))
+        record(f"align_ms.{n}", 1000 * elapsed, "ms")
+    return results
+
+
+def _machine():
+    return f"{platform.node()}/{platform.machine()}/py{platform.python_version()}"
+
+
+def _git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def load_history(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def find_regressions(results, history, threshold, window=5):
+    """与同一台机器最近 window 次结果的中位数比较，返回变差超过 threshold 的 [(指标, 当前值, 基线值, 变化)]"""
+    runs = [run for run in history if run.get("machine") == _machine()][-window:]
+    regressions = []
+    for name, current in results.items():
+        previous = [run["results"][name]["value"] for run in runs if name in run.get("results", {})]
+        if not previous:
+            continue
+        baseline = statistics.median(previous)
+        if not baseline:
+            continue
+        change = (current["value"] - baseline) / baseline
+        if current["better"] == "higher":
+            change = -change
+        if change > threshold:
+            regressions.append((name, current["value"], baseline, change))
+    return regressions
+
+
+def bench_suite(args):
+    fixtures = {f"synthetic_{seconds}s": make_synthetic_fixture(
+        os.path.join(args.fixture_dir, f"synthetic_{seconds}s.mp4"), seconds) for seconds in args.seconds}
+    if args.speech and os.path.exists(args.speech):
+        fixtures["speech"] = args.speech
+    results = run_suite(fixtures, args.backends, args.align_sizes, args.model)
+
+    history = load_history(args.history)
+    regressions = find_regressions(results, history, args.threshold, args.window)
+    if not args.no_save:
+        history.append({
+            "time": datetime.now().isoformat(timespec="seconds"),
+            "revision": _git_revision(),
+            "machine": _machine(),
+            "results": results,
+        })
+        with open(args.history + ".tmp", "w", encoding="utf-8") as f:
+            json.dump(history, f, ensure_ascii=False, indent=1)
+        os.replace(args.history + ".tmp", args.history)
+    if regressions:
+        print(f"与最近 {args.window} 次结果的中位数相比，变差超过 {args.threshold:.0%}:")
+        for name, value, baseline, change in regressions:
+            print(f"  {name}: {value:.3f}，基线 {baseline:.3f}，变差 {change:.0%}")
+        sys.exit(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="fast-video2blog 微基准")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    align = sub.add_parser("align", help="说话人对齐")
+    align.add_argument("--segments", type=int, default=10000)
+    align.add_argument("--turns", type=int, default=5000)
+    align.add_argument("--skip-naive", action="store_true", help="不运行旧的线性扫描实现")
+    align.set_defaults(func=bench_align)
+
+    backends = sub.add_parser("backends", help="各语音识别后端的实时率 (RTF) 和词错误率 (WER)")
+    backends.add_argument("--audio", default=os.path.join("bench_fixtures", "sample.wav"))
+    backends.add_argument("--reference", default=os.path.join("bench_fixtures", "sample.txt"),
+                          help="样例音频的参考文本，用于计算 WER（中文按字计算）")
+    backends.add_argument("--backends", nargs="*", help="要比较的后端，默认为本机已安装的全部")
+    backends.add_argument("--model", default="small")
+    backends.set_defaults(func=bench_backends)
+
+    batch = sub.add_parser("batch", help="批量推理在不同批大小下的吞吐（音频秒/秒），并检查结果是否一致")
+    batch.add_argument("--audio", nargs="+", default=[os.path.join("bench_fixtures", "sample.wav")],
+                       help="一个文件时按单文件组批，多个文件时把各文件的块混合组批")
+    batch.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 4, 8, 16])
+    batch.add_argument("--backend", default="auto")
+    batch.add_argument("--model", default="small")
+    batch.set_defaults(func=bench_batch)
+
+    startup = sub.add_parser("startup", help="启动时的模块导入耗时，以及是否连带导入了 torch 等重模块")
+    startup.add_argument("--modules", nargs="*", default=["main", "cli", "daemon_client"])
+    startup.add_argument("--max-seconds", type=float, default=1.0, help="超过该耗时时以非零状态退出")
+    startup.add_argument("--top", type=int, default=8, help="列出最慢的前几个顶层导入")
+    startup.set_defaults(func=bench_startup)
+
+    suite = sub.add_parser("suite", help="离线基准套件：解码吞吐、解码内存、RTF、对齐、端到端，记录历史并检查回退")
+    suite.add_argument("--seconds", type=int, nargs="+", default=[60, 600], help="合成测试视频的时长")
+    suite.add_argument("--fixture-dir", default=os.path.join("bench_fixtures", "synthetic"),
+                       help="合成视频的存放目录，已存在的文件直接复用")
+    suite.add_argument("--speech", default=os.path.join("bench_fixtures", "sample.wav"),
+                       help="可选的真实语音样例，存在时一并测试")
+    suite.add_argument("--backends", nargs="*", default=["stub"],
+                       help="要测实时率的后端；stub 之外的后端需要本地已有模型文件")
+    suite.add_argument("--model", default="small")
+    suite.add_argument("--align-sizes", type=int, nargs="+", default=[1000, 10000, 100000],
+                       help="对齐测试的片段数，说话人区间数取其一半")
+    suite.add_argument("--history", default="bench_history.json", help="追加结果的 JSON 历史文件")
+    suite.add_argument("--threshold", type=float, default=0.15, help="比历史中位数差出这个比例即视为回退")
+    suite.add_argument("--window", type=int, default=5, help="与同一台机器最近几次的结果比较")
+    suite.add_argument("--no-save", action="store_true", help="只比较，不把本次结果写入历史")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""任务断点与取消：逐块保存转录进度，崩溃、关闭或取消后从最后完成的块继续
+
+每个任务（音频指纹 + 转录设置）对应 JOBS_DIR 下的一个目录，asr.jsonl 每行记录一个已完成的块
+（块序号、采样区间和后端返回的原始结果）。记录只追加写入并立即 fsync，
+进程随时被杀也最多丢掉正在转录的那一块。转录完成、结果写入转录缓存后删除该目录。
+"""
+import hashlib
+import json
+import os
+import shutil
+import threading
+
+from transcript_cache import CACHE_DIR
+
+JOBS_DIR = os.environ.get("FV2B_JOBS_DIR", os.path.join(CACHE_DIR, "jobs"))
+
+
+class Cancelled(Exception):
+    """任务在块边界被取消，已完成的块保留在断点里"""
+
+
+class CancelToken:
+    """跨线程的取消标记；处理流程在每个块边界调用 check()"""
+
+    def __init__(self):
+        self._event = threading.Event()
+
+    def cancel(self):
+        self._event.set()
+
+    def is_cancelled(self):
+        return self._event.is_set()
+
+    def check(self):
+        if self._event.is_set():
+            raise Cancelled("任务已取消")
+
+
+class ChunkCheckpoint:
+    def __init__(self, fingerprint, settings, root=JOBS_DIR, log=None):
+        blob = json.dumps({"fingerprint": fingerprint, "settings": settings}, sort_keys=True)
+        self.path = os.path.join(root, hashlib.sha256(blob.encode()).hexdigest())
+        self.log = log
+        self._lock = threading.Lock()
+
+    @property
+    def _file(self):
+        return os.path.join(self.path, "asr.jsonl")
+
+    def load(self, chunks):
+        """返回 {块序号: 后端结果}；与本次切块计划对不上的记录被忽略"""
+        try:
+            with open(self._file, "r+b") as f:
+                data = f.read()
+                end = data.rfind(b"\n") + 1
+                if end < len(data):
+                    # 崩溃时写了一半的最后一行，截掉以免和下一条记录连在一起
+                    f.truncate(end)
+        except OSError:
+            return {}
+        done = {}
+        for line in data[:end].decode("utf-8").splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            index = record["index"]
+            if index < len(chunks) and tuple(record["chunk"]) == tuple(chunks[index]):
+                done[index] = record["result"]
+        if done and self.log:
+            self.log(f"从断点继续: 已完成 {len(done)}/{len(chunks)} 块")
+        return done
+
+    def save(self, index, chunk, result):
+        line = json.dumps({"index": index, "chunk": [int(x) for x in chunk], "result": result},
+                          ensure_ascii=False)
+        with self._lock:
+            os.makedirs(self.path, exist_ok=True)
+            with open(self._file, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+
+    def remove(self):
+        shutil.rmtree(self.path, ignore_errors=True)
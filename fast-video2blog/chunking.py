@@ -0,0 +1,361 @@
+"""分块转录：普通模式按不超过 30 秒的窗口覆盖整段音频；长音频模式按语音活动边界切块，多进程并行转录
+
+两种模式都按全局时间戳拼接。VAD 使用基于短时能量的自适应阈值，只依赖 numpy；
+只有长音频模式丢弃纯静音，普通模式不做 VAD，避免把没有静音底的语音（压缩过的人声、带背景音乐）误判为静音丢掉。
+"""
+import os
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from audio_io import SAMPLE_RATE
+
+FRAME_SECONDS = 0.03
+# 能量 90% 与 10% 分位相差不到这么多 dB 时，认为音频没有静音底（压缩过的人声、背景音乐），整段都算语音
+MIN_DYNAMIC_RANGE_DB = 12.0
+# 自适应阈值的上限：比它响的帧一定算语音，噪声底再高也不会把正常音量的语音当成静音
+MAX_THRESHOLD_DB = -35.0
+
+
+def frame_energy_db(audio, frame_seconds=FRAME_SECONDS, sample_rate=SAMPLE_RATE):
+    """每帧的 RMS 能量 (dBFS)"""
+    frame = int(frame_seconds * sample_rate)
+    n_frames = len(audio) // frame
+    if n_frames == 0:
+        return np.zeros(0, dtype=np.float32)
+    frames = audio[:n_frames * frame].reshape(n_frames, frame)
+    rms = np.sqrt(np.mean(np.square(frames, dtype=np.float32), axis=1))
+    return 20 * np.log10(np.maximum(rms, 1e-10))
+
+
+def detect_speech(audio, sample_rate=SAMPLE_RATE, min_silence=0.5, padding=0.2, threshold_db=None):
+    """返回语音区间 [(start_sample, end_sample), ...]
+
+    阈值默认取噪声底 (能量 10% 分位) 之上 12 dB，限制在 -50 ~ MAX_THRESHOLD_DB dBFS 之间；
+    能量分布的动态范围不足 MIN_DYNAMIC_RANGE_DB 时整段视为语音。
+    间隔短于 min_silence 的区间合并，每个区间两端各留 padding 秒。
+    """
+    energy = frame_energy_db(audio, sample_rate=sample_rate)
+    if len(energy) == 0:
+        return []
+    if threshold_db is None:
+        floor, loud = (float(x) for x in np.percentile(energy, [10, 90]))
+        if loud - floor < MIN_DYNAMIC_RANGE_DB and loud > -60.0:
+            # 没有明显的静音底；整段接近数字静音 (loud <= -60) 时仍按静音处理
+            return [(0, len(audio))]
+        threshold_db = min(max(floor + 12.0, -50.0), MAX_THRESHOLD_DB)
+    voiced = energy > threshold_db
+    # 找出连续的有声帧区间
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    frame = int(FRAME_SECONDS * sample_rate)
+    pad = int(padding * sample_rate)
+    gap = int(min_silence * sample_rate)
+    regions = []
+    for start_frame, end_frame in zip(edges[::2], edges[1::2]):
+        start = max(0, start_frame * frame - pad)
+        end = min(len(audio), end_frame * frame + pad)
+        if regions and start - regions[-1][1] < gap:
+            regions[-1] = (regions[-1][0], end)
+        else:
+            regions.append((start, end))
+    return regions
+
+
+def plan_chunks(audio, sample_rate=SAMPLE_RATE, max_chunk_seconds=30.0, max_gap_seconds=2.0,
+                overlap_seconds=1.0, regions=None):
+    """把语音区间合并成不超过 max_chunk_seconds 的块 [(start_sample, end_sample), ...]
+
+    块内不跨越超过 max_gap_seconds 的静音；超长的连续语音在最安静的帧处切开，
+    相邻块重叠 overlap_seconds，拼接时再去重。
+    """
+    if regions is None:
+        regions = detect_speech(audio, sample_rate)
+    max_len = int(max_chunk_seconds * sample_rate)
+    max_gap = int(max_gap_seconds * sample_rate)
+    overlap = int(overlap_seconds * sample_rate)
+
+    chunks = []
+    for start, end in regions:
+        if chunks and start - chunks[-1][1] <= max_gap and end - chunks[-1][0] <= max_len:
+            chunks[-1] = (chunks[-1][0], end)
+            continue
+        # 超长语音区间：在块末尾 20% 的范围内找最安静的帧作为切点
+        while end - start > max_len:
+            search_from = start + int(max_len * 0.8)
+            window = audio[search_from:start + max_len]
+            energy = frame_energy_db(window, sample_rate=sample_rate)
+            frame = int(FRAME_SECONDS * sample_rate)
+            cut = search_from + (int(np.argmin(energy)) * frame if len(energy) else len(window))
+            chunks.append((start, cut))
+            start = max(cut - overlap, start + 1)
+        chunks.append((start, end))
+    return chunks
+
+
+def whole_audio(audio):
+    """不做 VAD 时交给 plan_chunks 的语音区间：整段音频"""
+    return [(0, len(audio))] if len(audio) else []
+
+
+def _keep_bounds(chunks, i):
+    """相邻块重叠时以重叠区中点为界，返回第 i 块应保留的片段开始时间范围 [lower, upper)"""
+    lower = -float("inf")
+    upper = float("inf")
+    if i > 0 and chunks[i - 1][1] > chunks[i][0]:
+        lower = (chunks[i][0] + chunks[i - 1][1]) / 2
+    if i + 1 < len(chunks) and chunks[i + 1][0] < chunks[i][1]:
+        upper = (chunks[i + 1][0] + chunks[i][1]) / 2
+    return lower, upper
+
+
+def _dedupe(segments, lower, upper, last_text):
+    kept = []
+    for segment in segments:
+        if not lower <= segment["start"] < upper:
+            continue
+        text = segment["text"].strip()
+        if text and text == last_text:
+            continue
+        kept.append(segment)
+        last_text = text
+    return kept, last_text
+
+
+def stitch_segments(chunk_results):
+    """按全局时间拼接各块的片段，去掉重叠区域里重复出现的文本
+
+    chunk_results: [((start_sec, end_sec), [segment, ...]), ...]，片段时间戳已是全局时间。
+    相邻块重叠时以重叠区中点为界，前一块只保留中点之前开始的片段，后一块只保留之后的。
+    """
+    chunk_results = sorted(chunk_results, key=lambda item: item[0][0])
+    chunks = [bounds for bounds, _ in chunk_results]
+    stitched = []
+    last_text = None
+    for i, (_, segments) in enumerate(chunk_results):
+        kept, last_text = _dedupe(segments, *_keep_bounds(chunks, i), last_text)
+        stitched.extend(kept)
+    return stitched
+
+
+def _offset_segments(result, offset):
+    return [
+        {"start": seg["start"] + offset, "end": seg["end"] + offset, "text": seg["text"]}
+        for seg in result["segments"]
+    ]
+
+
+def iter_transcribe_sequential(audio, transcribe_chunk, sample_rate=SAMPLE_RATE, max_chunk_seconds=30.0,
+                               checkpoint=None, cancel=None, vad=False):
+    """在当前进程中逐块转录，按时间顺序逐个产出全局时间戳的片段
+
+    transcribe_chunk(chunk_audio, initial_prompt, language) 返回 backends 约定的结果结构；
+    上一块的文本作为下一块的 initial_prompt，第一块检测出的语言沿用到后续各块。
+    checkpoint (checkpoint.ChunkCheckpoint) 中已有的块直接复用，新完成的块立即写入；
+    cancel (checkpoint.CancelToken) 在每块开始前检查。
+    默认整段音频都送进模型（在窗口末尾最安静处切开，相邻窗口重叠 1 秒）；vad=True 时只转录检测到的语音区间。
+    """
+    chunks = plan_chunks(audio, sample_rate, max_chunk_seconds=max_chunk_seconds,
+                         regions=None if vad else whole_audio(audio))
+    bounds = [(start / sample_rate, end / sample_rate) for start, end in chunks]
+    done_chunks = checkpoint.load(chunks) if checkpoint else {}
+    last_text = None
+    prompt = None
+    language = None
+    for i, (start, end) in enumerate(chunks):
+        result = done_chunks.get(i)
+        if result is None:
+            if cancel is not None:
+                cancel.check()
+            result = transcribe_chunk(audio[start:end], prompt, language)
+            if checkpoint:
+                checkpoint.save(i, chunks[i], result)
+        language = language or result.get("language")
+        kept, last_text = _dedupe(_offset_segments(result, bounds[i][0]), *_keep_bounds(bounds, i), last_text)
+        prompt = result["text"][-200:] or None
+        yield from kept
+
+
+def _decode_in_batches(windows, backend, batch_size, language=None, detect_first=True, cancel=None, log=None):
+    """按 batch_size 个一组调用 backend.transcribe_batch，依次产出 (序号, 结果)
+
+    windows: [(序号, 音频), ...]。language 未指定且 detect_first 时，先单独解码第一个窗口确定语言，
+    其余窗口沿用；否则每个窗口各自检测。两种情况下每个窗口的结果都与 batch_size 无关。
+    """
+    if language is None and detect_first and windows:
+        index, window = windows[0]
+        result = backend.transcribe_batch([window], log=log)[0]
+        language = result.get("language")
+        windows = windows[1:]
+        yield index, result
+    for i in range(0, len(windows), batch_size):
+        if cancel is not None:
+            cancel.check()
+        batch = windows[i:i + batch_size]
+        results = backend.transcribe_batch([window for _, window in batch], language=language, log=log)
+        for (index, _), result in zip(batch, results):
+            yield index, result
+
+
+def iter_transcribe_batched(audio, backend, batch_size=8, sample_rate=SAMPLE_RATE, max_chunk_seconds=30.0,
+                            language=None, checkpoint=None, cancel=None, log=None, vad=False):
+    """在当前进程中批量转录，按时间顺序逐个产出全局时间戳的片段
+
+    切块与 iter_transcribe_sequential 相同，每 batch_size 块组成一批，由后端在一次前向中处理
+    （见 backends.transcribe_batch）。同一批的块并行解码，块之间无法传递提示文本，
+    所以结果与 batch_size 无关，但与顺序模式不完全相同：用吞吐换了一点上下文连贯性。
+    checkpoint / cancel / vad 的用法与 iter_transcribe_sequential 相同。
+    """
+    chunks = plan_chunks(audio, sample_rate, max_chunk_seconds=max_chunk_seconds,
+                         regions=None if vad else whole_audio(audio))
+    bounds = [(start / sample_rate, end / sample_rate) for start, end in chunks]
+    finished = checkpoint.load(chunks) if checkpoint else {}
+    if language is None and 0 in finished:
+        language = finished[0].get("language")
+    todo = [(i, audio[start:end]) for i, (start, end) in enumerate(chunks) if i not in finished]
+    results = _decode_in_batches(todo, backend, batch_size, language=language, cancel=cancel, log=log)
+    next_index = 0
+    last_text = None
+    while True:
+        while next_index in finished:
+            segments = _offset_segments(finished.pop(next_index), bounds[next_index][0])
+            kept, last_text = _dedupe(segments, *_keep_bounds(bounds, next_index), last_text)
+            next_index += 1
+            yield from kept
+        item = next(results, None)
+        if item is None:
+            break
+        i, result = item
+        if checkpoint:
+            checkpoint.save(i, chunks[i], result)
+        finished[i] = result
+
+
+def transcribe_many_batched(audios, backend, batch_size=8, sample_rate=SAMPLE_RATE, max_chunk_seconds=30.0,
+                            language=None, cancel=None, log=None, vad=False):
+    """把多个文件的块混在一起组批转录，返回每个文件的 {"text", "segments", "language"}
+
+    适合排队的短文件：单个文件凑不满一批时，用后面文件的块补齐。未指定语言时每个窗口各自检测。
+    """
+    plans = [plan_chunks(audio, sample_rate, max_chunk_seconds=max_chunk_seconds,
+                         regions=None if vad else whole_audio(audio)) for audio in audios]
+    windows = [((f, i), audio[start:end])
+               for f, (audio, chunks) in enumerate(zip(audios, plans))
+               for i, (start, end) in enumerate(chunks)]
+    chunk_results = [[] for _ in audios]
+    for (f, i), result in _decode_in_batches(windows, backend, batch_size, language=language,
+                                             detect_first=False, cancel=cancel, log=log):
+        start, end = plans[f][i]
+        chunk_results[f].append(((start / sample_rate, end / sample_rate),
+                                 _offset_segments(result, start / sample_rate)))
+    return [collect_segments(stitch_segments(results), language) for results in chunk_results]
+
+
+def default_workers():
+    """每个进程 2 个计算线程，进程数占满 CPU"""
+    return max(1, (os.cpu_count() or 1) // 2)
+
+
+_worker_backend = None
+
+
+def _init_worker(backend_name, model_size, threads):
+    global _worker_backend
+    from backends import select_backend
+    if backend_name == "faster-whisper":
+        os.environ["FV2B_CPU_THREADS"] = str(threads)
+    elif backend_name == "whisper":
+        import torch
+        torch.set_num_threads(threads)
+    # mlx 在 Metal 上计算，没有对应的线程数设置，也不依赖 torch
+    _worker_backend = select_backend(backend_name, model_size, device="cpu")
+    _worker_backend.load()
+
+
+def _chunk_source(audio, start, end):
+    """memmap 音频只把 (文件名, 区间) 发给子进程，由子进程映射同一个文件，省去逐块序列化的拷贝"""
+    filename = getattr(audio, "filename", None)
+    if filename:
+        return (filename, start, end)
+    return np.ascontiguousarray(audio[start:end])
+
+
+def _transcribe_chunk(source, options):
+    if isinstance(source, tuple):
+        filename, start, end = source
+        # "c" 为写时复制映射：页面按需读入，模型即使原地修改也不会写回文件
+        chunk_audio = np.load(filename, mmap_mode="c")[start:end]
+    else:
+        chunk_audio = source
+    return _worker_backend.transcribe(chunk_audio, **options)
+
+
+def iter_transcribe_parallel(audio, backend_name, model_size, workers=None, sample_rate=SAMPLE_RATE,
+                             max_chunk_seconds=30.0, on_chunk_done=None, checkpoint=None, cancel=None, **options):
+    """多进程并行转录长音频，按时间顺序逐个产出全局时间戳的片段
+
+    每个进程用 backend_name 指定的后端在 CPU 上加载一份模型。
+    各块乱序完成，先完成的后面的块暂存，等前面的块到齐后再按顺序产出。
+    options 原样传给后端的 transcribe（如 language）；未指定语言时每块各自检测。
+    on_chunk_done(已完成块数, 总块数) 用于汇报进度。
+    checkpoint 中已有的块不再提交；cancel 被触发后撤销尚未开始的块，
+    正在转录的块完成并写入断点后抛出 checkpoint.Cancelled。
+    """
+    workers = workers or default_workers()
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    chunks = plan_chunks(audio, sample_rate, max_chunk_seconds=max_chunk_seconds)
+    if not chunks:
+        return
+    bounds = [(start / sample_rate, end / sample_rate) for start, end in chunks]
+    done_chunks = checkpoint.load(chunks) if checkpoint else {}
+    finished = {i: _offset_segments(result, bounds[i][0]) for i, result in done_chunks.items()}
+    todo = [i for i in range(len(chunks)) if i not in finished]
+    completed = len(finished)
+
+    next_index = 0
+    last_text = None
+    # spawn 而不是 fork：父进程里已有 torch / Qt 线程，fork 容易死锁
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=max(1, min(workers, len(todo))), mp_context=context,
+                             initializer=_init_worker, initargs=(backend_name, model_size, threads)) as executor:
+        futures = {
+            executor.submit(_transcribe_chunk, _chunk_source(audio, *chunks[i]), options): i
+            for i in todo
+        }
+        running = set(futures)
+        try:
+            while True:
+                while next_index in finished:
+                    kept, last_text = _dedupe(finished.pop(next_index), *_keep_bounds(bounds, next_index), last_text)
+                    next_index += 1
+                    yield from kept
+                if not running:
+                    break
+                # 带超时等待，取消请求最多延迟半秒生效
+                done, running = wait(running, timeout=0.5, return_when=FIRST_COMPLETED)
+                if cancel is not None and cancel.is_cancelled():
+                    for future in running:
+                        future.cancel()
+                for future in done:
+                    if future.cancelled():
+                        continue
+                    i = futures[future]
+                    result = future.result()
+                    if checkpoint:
+                        checkpoint.save(i, chunks[i], result)
+                    finished[i] = _offset_segments(result, bounds[i][0])
+                    completed += 1
+                    if on_chunk_done:
+                        on_chunk_done(completed, len(chunks))
+        finally:
+            # 出错或调用方提前关闭生成器时撤销还没开始的块，退出 with 时只等正在转录的几块
+            for future in futures:
+                future.cancel()
+    if completed < len(chunks):
+        cancel.check()
+
+
+def collect_segments(segments, language=None):
+    """把片段迭代器收集成与 whisper transcribe 相同结构的结果"""
+    segments = list(segments)
+    return {"text": "".join(seg["text"] for seg in segments), "segments": segments, "language": language}
@@ -0,0 +1,162 @@
+"""fast-video2blog 命令行批量模式（无界面）
+
+用法:
+    python cli.py lectures/*.mp4 "archive/**/*.mkv" --output-dir transcripts
+    python cli.py --manifest jobs.txt --diarize
+
+输入可以是文件、目录、glob 或清单文件（每行一个路径，# 开头为注释）。
+提取音频（I/O 密集）在后台线程中提前进行，通过有界队列交给转录（CPU 密集），
+两者重叠执行；已有输出的文件直接跳过。
+"""
+import argparse
+import glob
+import os
+import queue
+import sys
+import threading
+import time
+
+from backends import BACKENDS
+from metrics import METRICS_FILE
+from transcriber import Transcriber
+
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mov", ".mkv", ".flv", ".m4a", ".mp3", ".wav")
+_DONE = object()
+
+
+def expand_inputs(patterns, manifest=None):
+    """把文件、目录、glob 和清单展开成去重后的文件列表，保持输入顺序"""
+    if manifest:
+        base = os.path.dirname(os.path.abspath(manifest))
+        with open(manifest, "r", encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith("#"):
+                    patterns.append(os.path.join(base, line))
+
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = sorted(
+                os.path.join(dirpath, name)
+                for dirpath, _, names in os.walk(pattern)
+                for name in names if name.lower().endswith(VIDEO_EXTENSIONS)
+            )
+        else:
+            matches = sorted(glob.glob(pattern, recursive=True)) or [pattern]
+        files.extend(os.path.abspath(path) for path in matches)
+    return list(dict.fromkeys(files))
+
+
+def output_path_for(video_path, output_dir=None):
+    stem = os.path.splitext(os.path.basename(video_path))[0]
+    return os.path.join(output_dir or os.path.dirname(video_path), f"{stem}.txt")
+
+
+def write_atomic(path, text):
+    """先写临时文件再改名，中断时不会留下被误认为已完成的半个输出"""
+    tmp_path = f"{path}.part"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def make_transcriber(video_path, args):
+    transcriber = Transcriber(video_path, diarize=args.diarize, long_audio=args.long_audio,
+                              use_cache=not args.no_cache, backend=args.backend, model_size=args.model,
+                              metrics_file=args.metrics_file, resume=not args.no_resume, batch_size=args.batch_size,
+                              use_subtitles=not args.no_subtitles, subtitle_gaps=args.subtitle_gaps)
+    name = os.path.basename(video_path)
+    transcriber.message.connect(lambda text: print(f"[{name}] {text}", file=sys.stderr))
+    if args.verbose:
+        transcriber.segment.connect(
+            lambda start, end, text: print(f"[{name}] [{start:7.1f}-{end:7.1f}] {text.strip()}", file=sys.stderr))
+    return transcriber
+
+
+def extract_worker(jobs, args, ready):
+    """生产者：依次提取音频放进有界队列，队列满时阻塞，内存中最多同时存在 prefetch 份音频"""
+    for video_path, output_path in jobs:
+        transcriber = None
+        try:
+            transcriber = make_transcriber(video_path, args)
+            audio = transcriber.extract_audio(video_path) if transcriber.needs_audio() else None
+            ready.put((video_path, output_path, transcriber, audio, None))
+        except Exception as e:
+            ready.put((video_path, output_path, transcriber, None, e))
+    ready.put(_DONE)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fast-video2blog 命令行批量转写")
+    parser.add_argument("inputs", nargs="*", help="视频文件、目录或 glob（支持 **）")
+    parser.add_argument("--manifest", help="清单文件，每行一个路径")
+    parser.add_argument("-o", "--output-dir", help="输出目录，默认写在输入文件旁边")
+    parser.add_argument("--diarize", action="store_true", help="识别说话人")
+    parser.add_argument("--long-audio", action="store_true", help="长音频模式：VAD 切块 + 多进程并行转录")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(BACKENDS),
+                        help="语音识别后端，默认根据本机自动选择")
+    parser.add_argument("--model", default="medium", help="模型大小，如 tiny / base / small / medium / large-v3")
+    parser.add_argument("--batch-size", type=int, default=0,
+                        help="批量推理：每次前向解码的 30 秒窗口数，吞吐更高，但窗口之间不传递上文，"
+                             "结果与逐块顺序解码略有不同；0 (默认) 为逐块顺序解码")
+    parser.add_argument("--no-subtitles", action="store_true", help="不使用内嵌字幕轨和同名字幕文件")
+    parser.add_argument("--subtitle-gaps", action="store_true", help="字幕没覆盖的部分用语音识别补齐")
+    parser.add_argument("--no-cache", action="store_true", help="不使用转录缓存")
+    parser.add_argument("--force", action="store_true", help="即使输出已存在也重新处理")
+    parser.add_argument("--no-resume", action="store_true", help="不使用也不写入逐块断点，从头转录")
+    parser.add_argument("--prefetch", type=int, default=2, help="提前提取好音频的文件数（队列容量）")
+    parser.add_argument("--metrics-file", default=METRICS_FILE,
+                        help="把每个任务的分阶段指标以 JSON 行追加到该文件")
+    parser.add_argument("-v", "--verbose", action="store_true", help="逐段打印转录结果")
+    args = parser.parse_args(argv)
+
+    files = expand_inputs(list(args.inputs), args.manifest)
+    if not files:
+        parser.error("没有找到输入文件")
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+
+    jobs = []
+    skipped = 0
+    for video_path in files:
+        output_path = output_path_for(video_path, args.output_dir)
+        if os.path.exists(output_path) and not args.force:
+            skipped += 1
+            continue
+        jobs.append((video_path, output_path))
+    print(f"共 {len(files)} 个文件，待处理 {len(jobs)} 个，已完成跳过 {skipped} 个", file=sys.stderr)
+
+    ready = queue.Queue(maxsize=max(1, args.prefetch))
+    threading.Thread(target=extract_worker, args=(jobs, args, ready), daemon=True).start()
+
+    start = time.time()
+    done = 0
+    failed = []
+    audio_seconds = 0.0
+    while (item := ready.get()) is not _DONE:
+        video_path, output_path, transcriber, audio, error = item
+        try:
+            if error is not None:
+                raise error
+            transcript = transcriber.process(audio=audio)
+            write_atomic(output_path, transcript)
+            done += 1
+            audio_seconds += transcriber.duration_seconds or 0.0
+            print(f"[{done + len(failed)}/{len(jobs)}] 完成: {output_path}", file=sys.stderr)
+        except Exception as e:
+            failed.append(video_path)
+            print(f"[{done + len(failed)}/{len(jobs)}] 失败: {video_path}: {e}", file=sys.stderr)
+
+    wall_seconds = time.time() - start
+    throughput = audio_seconds / wall_seconds if wall_seconds > 0 else 0.0
+    print(f"完成 {done} 个，失败 {len(failed)} 个，跳过 {skipped} 个", file=sys.stderr)
+    print(f"音频 {audio_seconds / 3600:.2f} 小时，用时 {wall_seconds / 3600:.2f} 小时，"
+          f"吞吐 {throughput:.1f} 音频小时/小时", file=sys.stderr)
+    for video_path in failed:
+        print(f"  失败: {video_path}", file=sys.stderr)
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,321 @@
+"""fast-video2blog 本地后台服务：模型常驻内存，通过本机 HTTP 接口接收任务
+
+用法:
+    python daemon.py [--port 8765] [--max-jobs 1] [--memory-mb 8000] [--backend auto] [--model medium]
+
+接口（JSON，只监听 127.0.0.1）:
+    POST /jobs                 提交任务 {"path": 绝对路径, "diarize", "long_audio", "backend", "model",
+                                         "use_cache", "batch_size", "draft_model", "use_subtitles", "subtitle_gaps"}
+    GET  /jobs                 所有任务的状态
+    GET  /jobs/<id>            单个任务的状态，完成后带 transcript
+    GET  /jobs/<id>/events     按行推送 JSON 事件 (segment / draft_segment / progress / message / audio_duration)，
+                               直到 done / failed / cancelled；?from=N 从第 N 个事件开始
+    POST /jobs/<id>/cancel     取消任务，正在运行的任务在下一个块边界停止
+    GET  /health               服务状态和常驻模型
+
+同时运行的任务数由 --max-jobs 限制，其余排队；常驻模型的总内存由 --memory-mb 限制，
+超出时按最近最少使用淘汰（见 model_registry）。openai-whisper 的模型实例不是线程安全的，
+同一模型上并发多个任务时请使用 faster-whisper 或长音频模式（每个任务在自己的进程池里转录）。
+"""
+import argparse
+import itertools
+import json
+import os
+import re
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from backends import BACKENDS, select_backend
+from checkpoint import Cancelled
+from model_registry import registry
+from transcriber import DIARIZATION_MODEL, Transcriber
+
+DEFAULT_PORT = 8765
+FINISHED_STATES = ("done", "failed", "cancelled")
+# 请求字段 -> (Transcriber 参数名, 允许的类型)
+_JOB_OPTIONS = {"diarize": ("diarize", bool), "long_audio": ("long_audio", bool), "backend": ("backend", str),
+                "model": ("model_size", str), "use_cache": ("use_cache", bool), "batch_size": ("batch_size", int),
+                "draft_model": ("draft_model", (str, type(None))), "use_subtitles": ("use_subtitles", bool),
+                "subtitle_gaps": ("subtitle_gaps", bool)}
+
+
+def parse_job_options(request):
+    """把请求里的任务选项转换成 Transcriber 的参数，类型或取值不对时抛出 ValueError"""
+    options = {}
+    for key, value in request.items():
+        if key not in _JOB_OPTIONS:
+            continue
+        name, expected = _JOB_OPTIONS[key]
+        # bool 是 int 的子类，batch_size 不接受 true / false
+        if not isinstance(value, expected) or (expected is int and isinstance(value, bool)):
+            raise ValueError(f"{key} 的类型不对: {value!r}")
+        options[name] = value
+    if options.get("backend", "auto") not in ["auto"] + list(BACKENDS):
+        raise ValueError(f"未知的语音识别后端: {options['backend']}，可选: auto, {', '.join(BACKENDS)}")
+    if options.get("batch_size", 0) < 0:
+        raise ValueError("batch_size 不能为负数")
+    return options
+
+
+class Job:
+    def __init__(self, job_id, path, options):
+        self.id = job_id
+        self.path = path
+        self.options = options
+        self.state = "queued"
+        self.progress = 0
+        self.duration_seconds = None
+        self.error = None
+        self.transcript = None
+        self.created_at = time.time()
+        self.events = []
+        self._condition = threading.Condition()
+        # 模型由服务内的所有任务共享，取消时不释放
+        self.transcriber = Transcriber(path, release_on_cancel=False, **options)
+        self.transcriber.segment.connect(
+            lambda start, end, text: self._emit({"type": "segment", "start": start, "end": end, "text": text}))
+        self.transcriber.draft_segment.connect(
+            lambda start, end, text: self._emit({"type": "draft_segment", "start": start, "end": end, "text": text}))
+        self.transcriber.progress.connect(self._on_progress)
+        self.transcriber.message.connect(lambda text: self._emit({"type": "message", "text": text}))
+        self.transcriber.audio_duration.connect(self._on_audio_duration)
+
+    def _emit(self, event):
+        with self._condition:
+            self.events.append(event)
+            self._condition.notify_all()
+
+    def _on_progress(self, value):
+        self.progress = value
+        self._emit({"type": "progress", "value": value})
+
+    def _on_audio_duration(self, seconds):
+        self.duration_seconds = seconds
+        self._emit({"type": "audio_duration", "seconds": seconds})
+
+    def _finish(self, state, **fields):
+        with self._condition:
+            self.state = state
+            self.events.append(dict({"type": state}, **fields))
+            self._condition.notify_all()
+
+    def cancel(self):
+        self.transcriber.cancel()
+        with self._condition:
+            if self.state == "queued":
+                # 还没开始的任务直接结束，不必等到轮到它
+                self._finish("cancelled")
+
+    def run(self):
+        with self._condition:
+            if self.state != "queued":
+                return
+            self.state = "running"
+        try:
+            self.transcript = self.transcriber.process()
+            self._finish("done", transcript=self.transcript)
+        except Cancelled:
+            self._finish("cancelled")
+        except Exception as e:
+            self.error = str(e)
+            self._finish("failed", error=self.error)
+
+    def iter_events(self, start=0):
+        """依次产出事件，没有新事件时阻塞等待，任务结束后停止"""
+        index = start
+        while True:
+            with self._condition:
+                while index >= len(self.events) and self.state not in FINISHED_STATES:
+                    self._condition.wait()
+                pending = self.events[index:]
+            yield from pending
+            index += len(pending)
+            if not pending:
+                return
+
+    def to_status(self):
+        status = {
+            "id": self.id,
+            "path": self.path,
+            "state": self.state,
+            "progress": self.progress,
+            "duration_seconds": self.duration_seconds,
+            "options": self.options,
+            "created_at": self.created_at,
+            "events": len(self.events),
+        }
+        if self.error is not None:
+            status["error"] = self.error
+        if self.state == "done":
+            status["transcript"] = self.transcript
+        return status
+
+
+class JobManager:
+    """任务表和有界的执行线程池；只保留最近 keep_finished 个已结束的任务"""
+
+    def __init__(self, max_jobs=1, keep_finished=100):
+        self.max_jobs = max_jobs
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix="fv2b-job")
+        self._jobs = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def submit(self, path, options):
+        # 创建 Transcriber 时可能要导入 torch，耗时数秒，不能占着锁挡住其他请求
+        job = Job(str(next(self._ids)), path, options)
+        with self._lock:
+            self._jobs[job.id] = job
+            self._prune()
+        self._executor.submit(job.run)
+        return job
+
+    def _prune(self):
+        finished = [job_id for job_id, job in self._jobs.items() if job.state in FINISHED_STATES]
+        for job_id in finished[:max(0, len(finished) - self.keep_finished)]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def shutdown(self):
+        for job in self.jobs():
+            job.cancel()
+        self._executor.shutdown(wait=True)
+
+
+class DaemonHandler(BaseHTTPRequestHandler):
+    manager = None # 由 serve() 设置
+
+    def log_message(self, format, *args):
+        print(f"[daemon] {self.address_string()} {format % args}", file=sys.stderr)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return None
+
+    def _job_or_404(self, job_id):
+        job = self.manager.get(job_id)
+        if job is None:
+            self._send_json(404, {"error": f"任务不存在: {job_id}"})
+        return job
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == "/health":
+            jobs = self.manager.jobs()
+            self._send_json(200, {
+                "ok": True,
+                "max_jobs": self.manager.max_jobs,
+                "running": sum(job.state == "running" for job in jobs),
+                "queued": sum(job.state == "queued" for job in jobs),
+                "models": registry.summary(),
+            })
+        elif url.path == "/jobs":
+            self._send_json(200, [job.to_status() for job in self.manager.jobs()])
+        elif match := re.fullmatch(r"/jobs/([^/]+)", url.path):
+            if job := self._job_or_404(match.group(1)):
+                self._send_json(200, job.to_status())
+        elif match := re.fullmatch(r"/jobs/([^/]+)/events", url.path):
+            if job := self._job_or_404(match.group(1)):
+                start = int(parse_qs(url.query).get("from", ["0"])[0])
+                self._stream_events(job, start)
+        else:
+            self._send_json(404, {"error": "未知接口"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path == "/jobs":
+            request = self._read_json()
+            if not isinstance(request, dict) or not request.get("path") or not isinstance(request["path"], str):
+                self._send_json(400, {"error": "需要 JSON 请求体，且包含 path"})
+                return
+            if not os.path.isfile(request["path"]):
+                # 服务和客户端在同一台机器上，按服务端看到的路径检查
+                self._send_json(400, {"error": f"文件不存在: {request['path']}"})
+                return
+            try:
+                job = self.manager.submit(request["path"], parse_job_options(request))
+            except (ValueError, TypeError, RuntimeError) as e:
+                self._send_json(400, {"error": str(e)})
+                return
+            self._send_json(201, job.to_status())
+        elif match := re.fullmatch(r"/jobs/([^/]+)/cancel", url.path):
+            if job := self._job_or_404(match.group(1)):
+                job.cancel()
+                self._send_json(200, job.to_status())
+        else:
+            self._send_json(404, {"error": "未知接口"})
+
+    def _stream_events(self, job, start):
+        """每行一个 JSON 事件，连接在任务结束后关闭（HTTP/1.0，无 Content-Length）"""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson; charset=utf-8")
+        self.end_headers()
+        try:
+            for event in job.iter_events(start):
+                self.wfile.write(json.dumps(event, ensure_ascii=False).encode("utf-8") + b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            pass # 客户端断开，任务继续运行，可以重新连接
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, max_jobs=1):
+    manager = JobManager(max_jobs=max_jobs)
+    handler = type("Handler", (DaemonHandler,), {"manager": manager})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    print(f"fast-video2blog 后台服务已启动: http://{host}:{port}，最多同时运行 {max_jobs} 个任务", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        manager.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="fast-video2blog 本地后台服务")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址，默认只接受本机连接")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT)
+    parser.add_argument("--max-jobs", type=int, default=1, help="同时运行的任务数，其余排队")
+    parser.add_argument("--memory-mb", type=int, default=None,
+                        help="常驻模型的内存预算 (MB)，超出时淘汰最久未用的模型；默认取 FV2B_MODEL_MEMORY_MB")
+    parser.add_argument("--backend", default="auto", choices=["auto"] + list(BACKENDS), help="启动时预加载的后端")
+    parser.add_argument("--model", default="medium", help="启动时预加载的模型大小")
+    parser.add_argument("--preload-diarization", action="store_true", help="启动时同时预加载说话人识别模型")
+    args = parser.parse_args(argv)
+
+    if args.memory_mb is not None:
+        registry.memory_budget_bytes = args.memory_mb * 1024 * 1024
+    specs = [select_backend(args.backend, args.model).registry_spec()]
+    if args.preload_diarization:
+        specs.append(("pyannote", DIARIZATION_MODEL, Transcriber.default_device(), None))
+    registry.preload(specs, log=lambda text: print(text, file=sys.stderr))
+    serve(args.host, args.port, args.max_jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""后台服务 (daemon.py) 的客户端，只依赖标准库
+
+RemoteTranscriber 与 Transcriber 的接口相同（progress / message / audio_duration / segment / draft_segment
+信号，process() 和 cancel()），GUI 和脚本可以直接替换使用，不必在本进程里导入 torch 或加载模型。
+"""
+import json
+import os
+import threading
+import urllib.error
+import urllib.request
+
+from checkpoint import Cancelled
+from signals import Signal
+
+# 设置后 GUI 把任务交给该地址的后台服务，如 http://127.0.0.1:8765
+DAEMON_URL = os.environ.get("FV2B_DAEMON_URL", "")
+
+
+def request_json(url, method="GET", payload=None, timeout=10):
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    request = urllib.request.Request(url, data=data, method=method,
+                                     headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        try:
+            message = json.loads(e.read()).get("error", str(e))
+        except ValueError:
+            message = str(e)
+        raise RuntimeError(f"后台服务返回错误: {message}") from None
+
+
+def ping(url, timeout=0.5):
+    """服务可用时返回 True"""
+    try:
+        return bool(request_json(f"{url}/health", timeout=timeout).get("ok"))
+    except (OSError, RuntimeError, ValueError):
+        return False
+
+
+class RemoteTranscriber:
+    def __init__(self, video_path, url=DAEMON_URL, diarize=True, long_audio=False, use_cache=True,
+                 backend="auto", model_size="medium", batch_size=0, draft_model=None, use_subtitles=True,
+                 subtitle_gaps=False):
+        self.progress = Signal()
+        self.message = Signal()
+        self.audio_duration = Signal() # 音频时长（秒）
+        self.segment = Signal() # 每解码出一个片段就发送 (开始秒, 结束秒, 文本)
+        self.draft_segment = Signal() # 草稿模型的片段 (开始秒, 结束秒, 文本)，之后会被 segment 替换
+
+        self.video_path = os.path.abspath(video_path)
+        self.url = url.rstrip("/")
+        self.options = {"diarize": diarize, "long_audio": long_audio, "use_cache": use_cache,
+                        "backend": backend, "model": model_size, "batch_size": batch_size,
+                        "draft_model": draft_model, "use_subtitles": use_subtitles, "subtitle_gaps": subtitle_gaps}
+        self.job_id = None
+        self.duration_seconds = None
+        self._cancel_requested = False
+
+    def cancel(self):
+        """请求取消；GUI 线程会调用它，请求在后台线程里发送，服务无响应也不会卡住界面"""
+        self._cancel_requested = True
+        if self.job_id is not None:
+            threading.Thread(target=self._send_cancel, args=(self.job_id,), daemon=True).start()
+
+    def _send_cancel(self, job_id):
+        try:
+            request_json(f"{self.url}/jobs/{job_id}/cancel", method="POST", payload={}, timeout=5)
+        except (OSError, RuntimeError, ValueError) as e:
+            self.message.emit(f"取消请求发送失败: {e}")
+
+    def process(self):
+        """提交任务并跟随事件流，返回转录文本"""
+        job = request_json(f"{self.url}/jobs", method="POST", payload=dict(self.options, path=self.video_path))
+        self.job_id = job["id"]
+        self.message.emit(f"已提交到后台服务 {self.url}，任务 {self.job_id}")
+        if self._cancel_requested:
+            self.cancel()
+        # 事件流在任务结束前一直保持连接，不设读超时
+        with urllib.request.urlopen(f"{self.url}/jobs/{self.job_id}/events") as response:
+            for line in response:
+                event = json.loads(line)
+                kind = event["type"]
+                if kind == "segment":
+                    self.segment.emit(event["start"], event["end"], event["text"])
+                elif kind == "draft_segment":
+                    self.draft_segment.emit(event["start"], event["end"], event["text"])
+                elif kind == "progress":
+                    self.progress.emit(event["value"])
+                elif kind == "message":
+                    self.message.emit(event["text"])
+                elif kind == "audio_duration":
+                    self.duration_seconds = event["seconds"]
+                    self.audio_duration.emit(event["seconds"])
+                elif kind == "done":
+                    return event["transcript"]
+                elif kind == "cancelled":
+                    raise Cancelled("任务已取消")
+                elif kind == "failed":
+                    raise RuntimeError(event["error"])
+        raise RuntimeError("与后台服务的连接中断")
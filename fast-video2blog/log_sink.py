@@ -0,0 +1,107 @@
+"""缓冲的日志接收端，替代每次 write 都发一次 Qt 信号的 stdout/stderr 重定向
+
+whisper / pyannote / tqdm 会产生成千上万次很小的 write。这里先在内存中合并，
+由界面定时器每隔一段时间取走一批，一次性追加到日志框：
+- tqdm 用 \\r 刷新的进度只保留最新的一条；
+- 待显示的行放在有上限的环形缓冲里，界面来不及取时丢弃最旧的行，内存不会无限增长；
+- 可选把完整日志（不受环形缓冲上限影响）写到文件。
+"""
+import os
+import threading
+from collections import deque
+
+# 完整日志文件，为空时不写
+LOG_FILE = os.environ.get("FV2B_LOG_FILE", "")
+# 两次刷新之间最多暂存的行数
+MAX_PENDING_LINES = int(os.environ.get("FV2B_LOG_MAX_LINES", "2000"))
+FLUSH_INTERVAL_MS = 100
+
+
+def _last_piece(line):
+    """\\r 把光标移回行首，只有最后一段非空内容是用户实际看到的"""
+    pieces = [piece for piece in line.split("\r") if piece.strip()]
+    return pieces[-1] if pieces else ""
+
+
+class LogStream:
+    """可以赋给 sys.stdout / sys.stderr 的流，每个流各自维护未换行的当前行"""
+    encoding = "utf-8"
+
+    def __init__(self, buffer):
+        self._buffer = buffer
+        self._partial = ""
+
+    def write(self, text):
+        *lines, partial = (self._partial + str(text)).split("\n")
+        progress = None
+        if "\r" in partial:
+            # 进度条不断用 \r 覆盖同一行，只留最新一次的内容
+            progress = _last_piece(partial)
+            partial = "\r" + progress
+        self._partial = partial
+        self._buffer.add([_last_piece(line) for line in lines], progress, owner=self)
+        return len(text)
+
+    def flush(self):
+        self._buffer.flush_file()
+
+    def isatty(self):
+        return False
+
+
+class LogBuffer:
+    """线程安全的日志缓冲；任意线程写入，界面线程用 drain() 定时取走"""
+
+    def __init__(self, max_lines=MAX_PENDING_LINES, log_file=LOG_FILE):
+        self._lines = deque(maxlen=max_lines)
+        self._dropped = 0
+        self._progress = None # (所属的流, 最新一条进度)
+        self._changed = False
+        self._lock = threading.Lock()
+        self._file = open(log_file, "a", encoding="utf-8") if log_file else None
+
+    def stream(self):
+        return LogStream(self)
+
+    def add(self, lines, progress=None, owner=None):
+        with self._lock:
+            for line in lines:
+                if not line.strip(): # 只保留非空行
+                    continue
+                if len(self._lines) == self._lines.maxlen:
+                    self._dropped += 1
+                self._lines.append(line)
+                if self._file:
+                    self._file.write(line + "\n")
+                self._changed = True
+            if progress:
+                self._progress = (owner, progress)
+                self._changed = True
+            elif lines and self._progress and self._progress[0] is owner:
+                # 进度条所在的行已经换行结束，最终内容就在 lines 里
+                self._progress = None
+                self._changed = True
+
+    def drain(self):
+        """取走待显示的行和当前进度；自上次以来没有变化时返回 None"""
+        with self._lock:
+            if not self._changed:
+                return None
+            lines = list(self._lines)
+            if self._dropped:
+                lines.insert(0, f"……日志过多，省略了 {self._dropped} 行")
+            self._lines.clear()
+            self._dropped = 0
+            self._changed = False
+            return lines, self._progress[1] if self._progress else None
+
+    def flush_file(self):
+        with self._lock:
+            if self._file:
+                self._file.flush()
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
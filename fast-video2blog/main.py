@@ -1,18 +1,29 @@
 import os
 import sys
-import subprocess
-import tempfile
-import numpy as np
-import torch
+import threading
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout, QHBoxLayout, 
-                             QPushButton, QFileDialog, QLabel, QProgressBar, QTextEdit, QCheckBox)
-from PyQt5.QtCore import QThread, pyqtSignal, Qt, QObject
-from PyQt5.QtGui import QTextCursor
-import whisper
-from pyannote.audio import Pipeline
-from pydub import AudioSegment
-import mlx_whisper
+                             QPushButton, QFileDialog, QLabel, QProgressBar, QTextEdit, QCheckBox, QComboBox)
+from PyQt5.QtCore import QThread, pyqtSignal, QTimer
+from PyQt5.QtGui import QColor, QTextCharFormat, QTextCursor
 import time # 导入 time 模块
+from model_registry import registry
+from transcriber import Transcriber
+from checkpoint import Cancelled
+from daemon_client import DAEMON_URL, RemoteTranscriber, ping
+from backends import BACKENDS, available_backends, select_backend
+from log_sink import FLUSH_INTERVAL_MS, LogBuffer
+
+# 窗口显示后是否在后台线程里预先导入 torch 等重模块并加载模型
+WARM_UP = os.environ.get("FV2B_WARM_UP", "1") != "0"
+
+MAX_LOG_BLOCKS = 5000 # 日志框最多保留的行数，更早的行自动删除
+DRAFT_MODEL = "base" # 两遍模式下先出草稿的小模型
+
+
+def _qt_length(text):
+    """QTextDocument 中的位置按 UTF-16 码元计数"""
+    return len(text.encode("utf-16-le")) // 2
+
 
 class AudioProcessor(QThread):
     progress = pyqtSignal(int)
@@ -20,150 +31,59 @@ class AudioProcessor(QThread):
     result = pyqtSignal(str)
     finished = pyqtSignal()
     audio_duration = pyqtSignal(float) # 新增信号，用于传递音频时长
+    segment = pyqtSignal(float, float, str) # 每解码出一个片段就发送 (开始秒, 结束秒, 文本)
+    draft_segment = pyqtSignal(float, float, str) # 两遍模式下草稿模型的片段
 
-    def __init__(self, video_path, diarize=True):
+    def __init__(self, video_path, diarize=True, daemon_url=None, **options):
         super().__init__()
         self.video_path = video_path
         self.diarize = diarize
-        self.device = "mps" if torch.backends.mps.is_available() else "cpu"
-        os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+        self.daemon_url = daemon_url
+        self.options = options
+        self.transcriber = None # 在 run() 中创建，选择后端时可能要导入 torch，不阻塞界面线程
+        self._cancel_requested = False
 
         self.improvement_prompt = "加标点符号并排版，整理成一篇博客文章，尽量内容完整：\n"
         self.improvement_prompt_en = "加标点符号并排版，整理成一篇博客文章，要英文版本：\n"
         # self.improvement_prompt = "加标点符号并排版，整理成一篇博客文章，可能有一些错别字，如果错误非常明显你可以根据上下文改一下，不明显就不要改：\n"
 
-    def extract_audio(self, video_path):
-        """提取视频音轨为WAV格式"""
-        self.message.emit("提取音频中...")
-        audio = AudioSegment.from_file(video_path)
-        duration_seconds = len(audio) / 1000.0 # 获取音频时长（秒）
-        self.audio_duration.emit(duration_seconds) # 发送音频时长
-        with tempfile.NamedTemporaryFile(suffix=".wav", delete=False) as tmpfile:
-            audio.export(tmpfile.name, format="wav")
-            return tmpfile.name
-
-    def transcribe_with_speakers(self, audio_path):
-        """执行语音识别和说话人分离"""
-        # 加载模型
-        self.message.emit("加载语音识别模型...")
-        model = whisper.load_model("medium", device=self.device)
-        
-        self.message.emit("加载说话人识别模型...")
-        diarization_pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
-            use_auth_token=YOUR_HF_TOKEN  # 替换为你的HuggingFace token
-        ).to(torch.device(self.device))
-
-        # 执行说话人分离
-        self.message.emit("识别说话人...")
-        diarization = diarization_pipeline(audio_path)
-        
-        # 加载音频数据
-        self.message.emit("加载音频数据...")
-        audio = whisper.load_audio(audio_path)
-        
-        # 转录音频
-        self.message.emit("转录音频中...")
-        result_text = model.transcribe(audio_path, verbose=False) # verbose=False to avoid printing to console
-        self.progress.emit(50) # Placeholder progress
-
-        if not self.diarize:
-            self.progress.emit(100)
-            return result_text["text"]
-
-        # 如果需要说话人识别，继续执行
-        self.message.emit("加载说话人识别模型...")
-        diarization_pipeline = Pipeline.from_pretrained(
-            "pyannote/speaker-diarization-3.1",
-            use_auth_token=YOUR_HF_TOKEN  # 替换为你的HuggingFace token
-        ).to(torch.device(self.device))
-
-        # 执行说话人分离
-        self.message.emit("识别说话人...")
-        diarization = diarization_pipeline(audio_path)
-        self.progress.emit(75) # Placeholder progress
-        
-        # 将转录结果与说话人对应
-        # 注意：这里的对应逻辑可能需要根据 whisper 和 pyannote 的输出格式进行调整
-        # 这是一个简化的示例，实际应用中可能需要更复杂的对齐逻辑
-        final_result = []
-        # 获取每个词的时间戳
-        segments = result_text["segments"]
-        
-        # 创建一个函数来查找给定时间点属于哪个说话人
-        def get_speaker_for_time(time_sec):
-            for turn, _, speaker in diarization.itertracks(yield_label=True):
-                if turn.start <= time_sec < turn.end:
-                    return speaker
-            return "未知说话人"
-
-        current_speaker = None
-        current_speech = ""
-
-        for segment in segments:
-            segment_start_time = segment['start']
-            # 尝试获取片段中间时间的说话人，以提高准确性
-            # 如果片段很短，就用开始时间
-            time_to_check = segment_start_time
-            if 'end' in segment and (segment['end'] - segment_start_time > 0.1):
-                 time_to_check = (segment_start_time + segment['end']) / 2.0
-
-            speaker = get_speaker_for_time(time_to_check)
-            
-            if speaker != current_speaker and current_speech:
-                final_result.append(f"{current_speaker}: {current_speech.strip()}")
-                current_speech = ""
-            
-            current_speaker = speaker
-            current_speech += segment['text'] + " "
-
-        if current_speech: # 添加最后一段语音
-            final_result.append(f"{current_speaker}: {current_speech.strip()}")
-        
-        self.progress.emit(100)
-        return "\n".join(final_result)
-
-    def transcribe_text_only(self, audio_path):
-        """仅执行语音识别，不进行说话人分离"""
-        self.message.emit("加载语音识别模型...")
-        # model = whisper.load_model("medium", device="cpu")
-        # 
-        # model = model.to("mps").half()
-        self.message.emit("转录音频中...")
-        # 使用基础的 transcribe 方法
-        # result = model.transcribe(audio_path, verbose=False)
-        result = mlx_whisper.transcribe(audio_path, path_or_hf_repo="mlx-community/whisper-medium-mlx")
-        self.progress.emit(100) # 假设转录完成占100%进度
-        return result["text"]
+    def create_transcriber(self):
+        # 实际的处理逻辑在 Transcriber 中，这里只把它的回调转成 Qt 信号；
+        # 连接了后台服务时改用接口相同的 RemoteTranscriber，模型在服务进程里常驻
+        if self.daemon_url:
+            transcriber = RemoteTranscriber(self.video_path, self.daemon_url, diarize=self.diarize, **self.options)
+        else:
+            transcriber = Transcriber(self.video_path, diarize=self.diarize, **self.options)
+        for name in ("progress", "message", "audio_duration", "segment", "draft_segment"):
+            getattr(transcriber, name).connect(getattr(self, name).emit)
+        return transcriber
+
+    def cancel(self):
+        self._cancel_requested = True
+        if self.transcriber is not None:
+            self.transcriber.cancel()
 
     def run(self):
         try:
-            # 步骤1: 提取音频
-            audio_path = self.extract_audio(self.video_path)
-            self.message.emit(f"音频已提取到: {audio_path}")
-            
-            # 步骤2: 根据设置选择转录方式
-            if self.diarize:
-                self.message.emit("开始转录和说话人识别...")
-                transcript = self.transcribe_with_speakers(audio_path)
-            else:
-                self.message.emit("开始仅文本转录...")
-                transcript = self.transcribe_text_only(audio_path)
-            
-            # 清理临时文件
-            os.unlink(audio_path)
+            self.transcriber = self.create_transcriber()
+            if self._cancel_requested:
+                self.transcriber.cancel()
+            transcript = self.transcriber.process()
             
             # 发送结果
             self.result.emit(transcript)
             self.message.emit("处理完成!")
+        except Cancelled:
+            self.message.emit("已取消")
         except Exception as e:
             self.message.emit(f"错误: {str(e)}")
         finally:
             self.finished.emit()
 
 class VideoTranscriberApp(QMainWindow):
-    def __init__(self):
+    def __init__(self, daemon_url=None):
         super().__init__()
+        self.daemon_url = daemon_url
         self.setWindowTitle("视频转文字工具")
         self.setGeometry(100, 100, 800, 600)
         
@@ -188,6 +108,36 @@ class VideoTranscriberApp(QMainWindow):
         self.diarize_checkbox = QCheckBox("识别说话人 (实验性，可能不准确)")
         self.diarize_checkbox.setChecked(False) # 默认勾选
         layout.addWidget(self.diarize_checkbox)
+
+        # 长音频并行模式
+        self.long_audio_checkbox = QCheckBox("长音频并行模式 (按静音切块，多进程 CPU 转录)")
+        self.long_audio_checkbox.setChecked(False)
+        layout.addWidget(self.long_audio_checkbox)
+
+        # 两遍模式：小模型先出草稿（灰色斜体），选定的模型随后逐段替换为定稿
+        self.draft_checkbox = QCheckBox(f"快速草稿 (先用 {DRAFT_MODEL} 模型出草稿，再逐段替换为定稿)")
+        self.draft_checkbox.setChecked(False)
+        layout.addWidget(self.draft_checkbox)
+
+        # 已有字幕：内嵌字幕轨或同名 .srt/.vtt/.ass/CC 字幕文件
+        self.subtitles_checkbox = QCheckBox("优先使用已有字幕 (内嵌字幕轨或同名字幕文件)，找到时跳过语音识别")
+        self.subtitles_checkbox.setChecked(True)
+        layout.addWidget(self.subtitles_checkbox)
+        self.subtitle_gaps_checkbox = QCheckBox("字幕没覆盖的部分用语音识别补齐")
+        self.subtitle_gaps_checkbox.setChecked(False)
+        layout.addWidget(self.subtitle_gaps_checkbox)
+
+        # 语音识别后端
+        backend_layout = QHBoxLayout()
+        backend_layout.addWidget(QLabel("识别后端:"))
+        self.backend_combo = QComboBox()
+        self.backend_combo.addItem("自动", "auto")
+        installed = available_backends()
+        for name in BACKENDS:
+            self.backend_combo.addItem(name if name in installed else f"{name} (未安装)", name)
+        backend_layout.addWidget(self.backend_combo)
+        backend_layout.addStretch()
+        layout.addLayout(backend_layout)
         
         # 进度区域
         self.progress_label = QLabel("准备就绪")
@@ -200,10 +150,17 @@ class VideoTranscriberApp(QMainWindow):
         self.process_btn.clicked.connect(self.start_processing)
         self.process_btn.setEnabled(False)
         layout.addWidget(self.process_btn)
+
+        # 取消按钮：在当前块完成后停止，已完成的块保存为断点
+        self.cancel_btn = QPushButton("取消")
+        self.cancel_btn.clicked.connect(self.cancel_processing)
+        self.cancel_btn.setEnabled(False)
+        layout.addWidget(self.cancel_btn)
         
         # 结果区域
         self.result_area = QTextEdit()
-        self.result_area.setReadOnly(True)
+        # 片段边转录边追加，可以在尾部还没转完时就开始编辑前面的文字
+        self.result_area.setReadOnly(False)
         self.result_area.setFixedHeight(200) # 设置一个初始高度
         layout.addWidget(self.result_area)
 
@@ -229,12 +186,21 @@ class VideoTranscriberApp(QMainWindow):
         self.log_area = QTextEdit()
         self.log_area.setReadOnly(True)
         self.log_area.setFixedHeight(150) # 设置一个初始高度
+        self.log_area.document().setMaximumBlockCount(MAX_LOG_BLOCKS)
         layout.addWidget(self.log_area)
         
         # 状态变量
         self.current_file = None
         self.worker = None
         self.audio_duration_seconds = 0.0
+        self.streamed_segments = 0
+        self.live_progress = None # 日志框最后一行显示的 tqdm 进度
+        self.draft_mode = False
+        self.draft_segments = [] # 尚未定稿的草稿 [(开始秒, 结束秒, 长度)]，按时间顺序排在定稿文字之后
+        self.final_position = 0 # 定稿文字在结果框中的结束位置
+        self.draft_format = QTextCharFormat()
+        self.draft_format.setForeground(QColor("gray"))
+        self.draft_format.setFontItalic(True)
 
     def select_file(self):
         file_path, _ = QFileDialog.getOpenFileName(
@@ -251,31 +217,123 @@ class VideoTranscriberApp(QMainWindow):
             return
             
         self.process_btn.setEnabled(False)
-        self.result_area.clear()
+        self.cancel_btn.setEnabled(True)
+        self.result_area.setPlainText(f"文件名: {os.path.basename(self.current_file)}\n\n")
         self.progress_bar.setValue(0)
         self.progress_label.setText("处理中...")
         self.start_time = time.time() # 记录开始时间
+        self.audio_duration_seconds = 0.0
+        self.streamed_segments = 0
+        self.draft_mode = self.draft_checkbox.isChecked()
+        self.draft_segments = []
+        self.final_position = self.result_area.document().characterCount() - 1
+        # 草稿会被原地替换，两遍模式下转录期间暂不允许编辑
+        self.result_area.setReadOnly(self.draft_mode)
         
         # 创建工作线程
         diarize_enabled = self.diarize_checkbox.isChecked()
-        self.worker = AudioProcessor(self.current_file, diarize=diarize_enabled)
+        self.worker = AudioProcessor(self.current_file, diarize=diarize_enabled,
+                                     long_audio=self.long_audio_checkbox.isChecked(),
+                                     backend=self.backend_combo.currentData(),
+                                     draft_model=DRAFT_MODEL if self.draft_mode else None,
+                                     use_subtitles=self.subtitles_checkbox.isChecked(),
+                                     subtitle_gaps=self.subtitle_gaps_checkbox.isChecked(),
+                                     daemon_url=self.daemon_url)
         self.worker.message.connect(self.update_log_and_progress_label)
         self.worker.progress.connect(self.progress_bar.setValue)
         self.worker.result.connect(self.on_result)
         self.worker.finished.connect(self.on_finished)
         self.worker.audio_duration.connect(self.display_audio_duration) # 连接信号
+        self.worker.segment.connect(self.on_segment)
+        self.worker.draft_segment.connect(self.on_draft_segment)
         self.worker.start()
 
+    def cancel_processing(self):
+        if self.worker is not None and self.worker.isRunning():
+            self.cancel_btn.setEnabled(False)
+            self.worker.cancel()
+            self.update_log_and_progress_label("正在取消，当前块完成后停止...")
+
     def update_log_and_progress_label(self, message_text):
         self.progress_label.setText(message_text)
         self.log_area.append(message_text)
         self.log_area.moveCursor(QTextCursor.End)
 
-    def append_to_log(self, text):
-        self.log_area.append(text.strip()) # strip to remove extra newlines from print
+    def flush_log(self, log_buffer):
+        """定时器回调：把缓冲的 stdout/stderr 一次性追加到日志框，进度条原地替换"""
+        drained = log_buffer.drain()
+        if drained is None:
+            return
+        lines, progress = drained
+        document = self.log_area.document()
+        cursor = QTextCursor(document)
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        if self.live_progress is not None and document.lastBlock().text() == self.live_progress:
+            # 删掉上一次显示的进度行（连同它前面的换行）
+            cursor.select(QTextCursor.BlockUnderCursor)
+            cursor.removeSelectedText()
+        self.live_progress = progress
+        if progress is not None:
+            lines.append(progress)
+        if lines:
+            # insertText 按纯文本插入，一批只触发一次重排
+            prefix = "\n" if document.characterCount() > 1 else ""
+            cursor.insertText(prefix + "\n".join(line.strip() for line in lines))
+        cursor.endEditBlock()
         self.log_area.moveCursor(QTextCursor.End)
 
+    def on_draft_segment(self, start, end, text):
+        cursor = QTextCursor(self.result_area.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.insertText(text, self.draft_format)
+        self.draft_segments.append((start, end, _qt_length(text)))
+
+    def on_segment(self, start, end, text):
+        cursor = QTextCursor(self.result_area.document())
+        if self.draft_mode:
+            # 定稿片段替换它覆盖到的草稿（中点在其结束之前的草稿片段）
+            replaced = 0
+            while self.draft_segments and sum(self.draft_segments[0][:2]) / 2 < end:
+                replaced += self.draft_segments.pop(0)[2]
+            cursor.setPosition(self.final_position)
+            cursor.setPosition(self.final_position + replaced, QTextCursor.KeepAnchor)
+            cursor.insertText(text, QTextCharFormat())
+            self.final_position += _qt_length(text)
+        else:
+            # 追加到末尾，不移动用户正在编辑的光标
+            cursor.movePosition(QTextCursor.End)
+            cursor.insertText(text)
+        self.streamed_segments += 1
+
+        if self.audio_duration_seconds <= 0 or end <= 0:
+            return
+        fraction = min(end / self.audio_duration_seconds, 1.0)
+        elapsed = time.time() - self.start_time
+        eta = elapsed * (1 - fraction) / fraction
+        rtf = elapsed / end # 实时率：处理用时 / 已转录的音频时长
+        self.progress_bar.setValue(int(fraction * 100))
+        self.progress_label.setText(
+            f"转录中 {int(end // 60)}:{int(end % 60):02d} / "
+            f"{int(self.audio_duration_seconds // 60)}:{int(self.audio_duration_seconds % 60):02d}，"
+            f"预计剩余 {int(eta // 60)} 分 {int(eta % 60)} 秒，RTF {rtf:.2f}"
+            + (f"，{len(self.draft_segments)} 段草稿待定稿" if self.draft_mode else ""))
+
+    def discard_drafts(self):
+        """删除定稿之后剩下的草稿（例如结尾处定稿模型判定为静音的部分）"""
+        if not self.draft_segments:
+            return
+        cursor = QTextCursor(self.result_area.document())
+        cursor.setPosition(self.final_position)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        self.draft_segments = []
+
     def on_result(self, result):
+        if self.streamed_segments and not self.worker.diarize:
+            # 结果已经逐段显示过，保留用户在转录期间做的编辑
+            self.discard_drafts()
+            return
         # 在结果开头添加文件名信息
         file_name = os.path.basename(self.current_file)
         formatted_result = f"文件名: {file_name}\n\n{result}"
@@ -283,6 +341,8 @@ class VideoTranscriberApp(QMainWindow):
 
     def on_finished(self):
         self.process_btn.setEnabled(True)
+        self.cancel_btn.setEnabled(False)
+        self.result_area.setReadOnly(False)
         self.copy_button.setEnabled(True) # 处理完成后启用复制按钮
         end_time = time.time() # 记录结束时间
         elapsed_time = end_time - self.start_time # 计算用时
@@ -316,40 +376,46 @@ class VideoTranscriberApp(QMainWindow):
         self.log_area.append(f"视频时长: {minutes} 分 {seconds} 秒")
         self.log_area.moveCursor(QTextCursor.End)
 
-# 自定义流以捕获stdout/stderr
-class QTextEditLogger(QObject):
-    messageWritten = pyqtSignal(str)
-
-    def __init__(self, parent=None):
-        super().__init__(parent)
-
-    def write(self, message):
-        if message.strip(): #只发送非空消息
-            self.messageWritten.emit(str(message))
-
-    def flush(self):
-        # 这个方法是必须的，即使它什么也不做
-        pass
+def warm_up():
+    """窗口显示后在后台线程导入 torch 并预加载自动选择的后端的模型，之后的每次转换直接复用"""
+    try:
+        import torch
+    except ImportError:
+        pass # mlx / faster-whisper 等后端不依赖 torch，没装时不检查 GPU
+    else:
+        # 检查GPU可用性 (现在会输出到log_area)
+        if torch.cuda.is_available():
+            print("检测到GPU，将使用CUDA加速")
+        else:
+            print("警告: 未检测到GPU，处理速度可能较慢")
+    try:
+        registry.preload([select_backend("auto").registry_spec()], log=print)
+    except RuntimeError as e:
+        print(f"警告: {e}")
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
     
-    window = VideoTranscriberApp()
+    # 设置了 FV2B_DAEMON_URL 且服务在线时作为后台服务的客户端运行
+    daemon_url = DAEMON_URL if DAEMON_URL and ping(DAEMON_URL) else None
+    window = VideoTranscriberApp(daemon_url=daemon_url)
+
+    # 重定向stdout和stderr：写入只进缓冲，由定时器批量刷到日志框
+    log_buffer = LogBuffer()
+    sys.stdout = log_buffer.stream()
+    sys.stderr = log_buffer.stream()
+    log_timer = QTimer()
+    log_timer.timeout.connect(lambda: window.flush_log(log_buffer))
+    log_timer.start(FLUSH_INTERVAL_MS)
+    app.aboutToQuit.connect(log_buffer.close)
 
-    # 重定向stdout和stderr
-    stdout_logger = QTextEditLogger()
-    stdout_logger.messageWritten.connect(window.append_to_log)
-    sys.stdout = stdout_logger
-
-    stderr_logger = QTextEditLogger()
-    stderr_logger.messageWritten.connect(window.append_to_log) # 也可连接到不同的处理函数，例如用红色显示错误
-    sys.stderr = stderr_logger
+    window.show()
 
-    # 检查GPU可用性 (现在会输出到log_area)
-    if torch.cuda.is_available():
-        print("检测到GPU，将使用CUDA加速")
+    if daemon_url:
+        print(f"使用后台服务 {daemon_url}，模型由服务进程常驻")
     else:
-        print("警告: 未检测到GPU，处理速度可能较慢")
-    
-    window.show()
+        if DAEMON_URL:
+            print(f"警告: 无法连接后台服务 {DAEMON_URL}，改为在本进程中处理")
+        if WARM_UP:
+            threading.Thread(target=warm_up, daemon=True).start()
     sys.exit(app.exec_())
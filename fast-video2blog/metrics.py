@@ -0,0 +1,139 @@
+"""按阶段统计每个任务的耗时和资源占用，输出结构化 JSON
+
+每个阶段记录墙钟时间、CPU 时间（本进程 + 已回收的子进程）、峰值 RSS 和处理的音频秒数。
+可以对某一个阶段开启 cProfile 或 py-spy 采样。
+"""
+import cProfile
+import json
+import os
+import resource
+import signal
+import subprocess
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+# 追加写入的 JSONL 指标文件，为空时不写
+METRICS_FILE = os.environ.get("FV2B_METRICS_FILE", "")
+# 需要剖析的阶段名（如 asr），以及剖析器: cprofile / py-spy
+PROFILE_STAGE = os.environ.get("FV2B_PROFILE_STAGE", "")
+PROFILER = os.environ.get("FV2B_PROFILER", "cprofile")
+PROFILE_DIR = os.environ.get("FV2B_PROFILE_DIR", ".")
+
+
+def current_rss_bytes():
+    """当前常驻内存；没有 /proc 的系统 (macOS) 退回到进程历史峰值"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _cpu_seconds():
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime + children.ru_utime + children.ru_stime
+
+
+class _RssSampler(threading.Thread):
+    """阶段运行期间每 50 ms 采样一次 RSS，记录峰值"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        return self.peak
+
+
+class JobMetrics:
+    def __init__(self, job, profile_stage=PROFILE_STAGE, profiler=PROFILER, profile_dir=PROFILE_DIR):
+        self.job = job
+        self.profile_stage = profile_stage
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.started_at = datetime.now().isoformat(timespec="seconds")
+        self._start = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, audio_seconds=None):
+        """统计一个阶段；并发的阶段 (如 asr 和 diarization) 的 CPU 时间会互相包含
+
+        with 语句得到一个 dict，阶段内可以再设置 info["audio_seconds"]（例如解码后才知道时长）。
+        """
+        info = {"audio_seconds": audio_seconds}
+        sampler = _RssSampler()
+        sampler.start()
+        stop_profile = self._start_profile(name) if name == self.profile_stage else None
+        cpu_start = _cpu_seconds()
+        wall_start = time.perf_counter()
+        try:
+            yield info
+        finally:
+            audio_seconds = info["audio_seconds"]
+            wall = time.perf_counter() - wall_start
+            cpu = _cpu_seconds() - cpu_start
+            if stop_profile:
+                stop_profile()
+            record = {
+                "wall_s": round(wall, 3),
+                "cpu_s": round(cpu, 3),
+                "peak_rss_mb": round(sampler.stop() / 1024 / 1024, 1),
+            }
+            if audio_seconds:
+                record["audio_s"] = round(audio_seconds, 3)
+                record["rtf"] = round(wall / audio_seconds, 4)
+            with self._lock:
+                self.stages[name] = record
+
+    def _start_profile(self, name):
+        os.makedirs(self.profile_dir, exist_ok=True)
+        base = os.path.join(self.profile_dir, f"{os.path.splitext(self.job)[0]}-{name}")
+        if self.profiler == "py-spy":
+            # 外部采样，可以看到原生扩展 (torch) 内部的耗时；SIGINT 后 py-spy 写出火焰图
+            process = subprocess.Popen(["py-spy", "record", "--pid", str(os.getpid()), "--native",
+                                        "--output", f"{base}.svg"])
+
+            def stop():
+                process.send_signal(signal.SIGINT)
+                process.wait()
+            return stop
+
+        profile = cProfile.Profile()
+        profile.enable()
+
+        def stop():
+            profile.disable()
+            profile.dump_stats(f"{base}.prof")
+        return stop
+
+    def to_record(self):
+        return {
+            "job": self.job,
+            "started_at": self.started_at,
+            "total_wall_s": round(time.perf_counter() - self._start, 3),
+            "stages": dict(self.stages),
+        }
+
+    def summary(self):
+        return "，".join(f"{name} {stats['wall_s']:.2f} 秒" for name, stats in self.stages.items())
+
+    def append_to(self, path):
+        """把本任务的记录作为一行 JSON 追加到 path"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.to_record(), ensure_ascii=False) + "\n")
@@ -0,0 +1,179 @@
+"""进程级常驻模型注册表
+
+按 (backend, 模型名, device, dtype) 缓存已加载的模型，让多次转换共享同一份权重，
+超出内存预算时按 LRU 淘汰，并记录命中次数和加载耗时。
+"""
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+HF_TOKEN = os.environ.get("HF_TOKEN", "")  # 替换为你的HuggingFace token，或设置环境变量 HF_TOKEN
+
+# 默认内存预算 (MB)，0 表示不限制
+DEFAULT_MEMORY_BUDGET_MB = int(os.environ.get("FV2B_MODEL_MEMORY_MB", "0"))
+
+ModelKey = namedtuple("ModelKey", ["backend", "name", "device", "dtype"])
+
+
+def _load_whisper(name, device, dtype):
+    import whisper
+    return whisper.load_model(name, device=device)
+
+
+def _load_pyannote(name, device, dtype):
+    import torch
+    from pyannote.audio import Pipeline
+    pipeline = Pipeline.from_pretrained(name, use_auth_token=HF_TOKEN)
+    return pipeline.to(torch.device(device))
+
+
+def _load_mlx_whisper(name, device, dtype):
+    import mlx.core as mx
+    from mlx_whisper.load_models import load_model
+    return load_model(name, dtype=getattr(mx, dtype or "float16"))
+
+
+def estimate_model_bytes(model, _depth=2):
+    """粗略估算模型占用的内存（参数 + buffer 的字节数）"""
+    torch = sys.modules.get("torch")
+    if torch is not None and isinstance(model, torch.nn.Module):
+        tensors = list(model.parameters()) + list(model.buffers())
+        return sum(t.numel() * t.element_size() for t in tensors)
+    if "mlx.core" in sys.modules and hasattr(model, "parameters"):
+        try:
+            from mlx.utils import tree_flatten
+            return sum(v.nbytes for _, v in tree_flatten(model.parameters()))
+        except Exception:
+            pass
+    # pyannote 的 Pipeline 不是 nn.Module，子模型挂在属性上，向下找一层
+    if _depth > 0 and hasattr(model, "__dict__"):
+        return sum(estimate_model_bytes(v, _depth - 1) for v in vars(model).values())
+    return 0
+
+
+class ModelRegistry:
+    def __init__(self, memory_budget_mb=DEFAULT_MEMORY_BUDGET_MB):
+        self.memory_budget_bytes = memory_budget_mb * 1024 * 1024
+        self._loaders = {
+            "whisper": _load_whisper,
+            "pyannote": _load_pyannote,
+            "mlx_whisper": _load_mlx_whisper,
+        }
+        self._models = OrderedDict()  # ModelKey -> (model, nbytes)，按最近使用排序
+        self._lock = threading.Lock()
+        self._loading = {}  # ModelKey -> threading.Event，避免同一个模型被并发加载两次
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.load_times = {}  # ModelKey -> 加载耗时（秒）
+
+    def register_loader(self, backend, loader):
+        """注册新的后端加载函数 loader(name, device, dtype)"""
+        self._loaders[backend] = loader
+
+    def get(self, backend, name, device="cpu", dtype=None, log=None):
+        """返回常驻模型，不存在时加载；log 用于输出命中/加载信息"""
+        key = ModelKey(backend, name, device, dtype)
+        while True:
+            with self._lock:
+                if key in self._models:
+                    self._models.move_to_end(key)
+                    self.hits += 1
+                    if log:
+                        log(f"模型缓存命中: {backend}/{name} ({device})")
+                    return self._models[key][0]
+                event = self._loading.get(key)
+                if event is None:
+                    event = self._loading[key] = threading.Event()
+                    break
+            # 其他线程正在加载同一个模型，等它完成后再取
+            event.wait()
+
+        try:
+            if log:
+                log(f"加载模型: {backend}/{name} ({device})...")
+            start = time.perf_counter()
+            model = self._loaders[backend](name, device, dtype)
+            elapsed = time.perf_counter() - start
+            nbytes = estimate_model_bytes(model)
+            with self._lock:
+                self.misses += 1
+                self.load_times[key] = elapsed
+                self._models[key] = (model, nbytes)
+                self._evict_over_budget(keep=key, log=log)
+            if log:
+                log(f"模型已加载: {backend}/{name}，用时 {elapsed:.2f} 秒，约 {nbytes / 1024 / 1024:.0f} MB")
+            return model
+        finally:
+            with self._lock:
+                self._loading.pop(key).set()
+
+    def _evict_over_budget(self, keep, log=None):
+        if not self.memory_budget_bytes:
+            return
+        total = sum(nbytes for _, nbytes in self._models.values())
+        evicted = False
+        for key in list(self._models):
+            if total <= self.memory_budget_bytes:
+                break
+            if key == keep:
+                continue
+            total -= self._models.pop(key)[1]
+            self.evictions += 1
+            evicted = True
+            if log:
+                log(f"超出模型内存预算，淘汰: {key.backend}/{key.name}")
+        if evicted:
+            _release_device_memory()
+
+    def evict(self, backend, name, device="cpu", dtype=None):
+        with self._lock:
+            removed = self._models.pop(ModelKey(backend, name, device, dtype), None)
+        if removed is not None:
+            _release_device_memory()
+        return removed is not None
+
+    def clear(self):
+        with self._lock:
+            self._models.clear()
+        _release_device_memory()
+
+    def preload(self, specs, log=None):
+        """在后台线程中预加载 [(backend, name, device, dtype), ...]，返回该线程"""
+        def worker():
+            for spec in specs:
+                try:
+                    self.get(*spec, log=log)
+                except Exception as e:
+                    if log:
+                        log(f"预加载模型失败 {spec[0]}/{spec[1]}: {e}")
+
+        thread = threading.Thread(target=worker, daemon=True)
+        thread.start()
+        return thread
+
+    def summary(self):
+        with self._lock:
+            total = sum(nbytes for _, nbytes in self._models.values())
+            resident = ", ".join(f"{k.backend}/{k.name}" for k in self._models) or "无"
+        return (f"模型缓存: 命中 {self.hits} 次，加载 {self.misses} 次，淘汰 {self.evictions} 次，"
+                f"常驻约 {total / 1024 / 1024:.0f} MB ({resident})")
+
+
+def _release_device_memory():
+    """释放已淘汰模型占用的显存/统一内存"""
+    import gc
+    gc.collect()
+    torch = sys.modules.get("torch")
+    if torch is None:
+        return
+    if torch.cuda.is_available():
+        torch.cuda.empty_cache()
+    if hasattr(torch, "mps") and torch.backends.mps.is_available():
+        torch.mps.empty_cache()
+
+
+# 进程内共享的注册表
+registry = ModelRegistry()
@@ -0,0 +1,15 @@
+"""无 Qt 依赖的简易信号，Transcriber 和后台服务的客户端共用"""
+
+
+class Signal:
+    """无 Qt 依赖的简易信号：connect 注册回调，emit 依次调用"""
+
+    def __init__(self):
+        self._slots = []
+
+    def connect(self, slot):
+        self._slots.append(slot)
+
+    def emit(self, *args):
+        for slot in self._slots:
+            slot(*args)
@@ -0,0 +1,54 @@
+"""显式阶段图：每个阶段只执行一次，结果沿依赖边传递，互不依赖的阶段并发执行"""
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+
+class StageGraph:
+    def __init__(self, max_workers=2, on_stage_done=None):
+        self.max_workers = max_workers
+        self.on_stage_done = on_stage_done  # 回调 on_stage_done(name, 已完成数, 总数, 用时)
+        self._stages = {}  # name -> (func, deps)，保持添加顺序
+        self.timings = {}
+        self.results = {}  # 已完成阶段的结果，出错时也保留，便于调用方清理中间产物
+
+    def add(self, name, func, deps=()):
+        """添加阶段；func 以依赖阶段的结果作为同名关键字参数被调用"""
+        if name in self._stages:
+            raise ValueError(f"阶段重复: {name}")
+        for dep in deps:
+            if dep not in self._stages:
+                raise ValueError(f"阶段 {name} 依赖未定义的阶段 {dep}")
+        self._stages[name] = (func, tuple(deps))
+        return self
+
+    def _run_stage(self, name, kwargs):
+        func, _ = self._stages[name]
+        start = time.perf_counter()
+        result = func(**kwargs)
+        self.timings[name] = time.perf_counter() - start
+        return result
+
+    def run(self):
+        """执行整张图，返回 {阶段名: 结果}；任一阶段出错时取消未开始的阶段并抛出该异常"""
+        results = self.results = {}
+        pending = dict(self._stages)
+        running = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                for name, (_, deps) in list(pending.items()):
+                    if all(dep in results for dep in deps):
+                        kwargs = {dep: results[dep] for dep in deps}
+                        running[executor.submit(self._run_stage, name, kwargs)] = name
+                        del pending[name]
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    error = future.exception()
+                    if error is not None:
+                        for other in running:
+                            other.cancel()
+                        raise error
+                    results[name] = future.result()
+                    if self.on_stage_done:
+                        self.on_stage_done(name, len(results), len(self._stages), self.timings[name])
+        return results
@@ -0,0 +1,141 @@
+"""复用已有字幕：内嵌字幕轨和同名字幕文件，找到时可以完全跳过语音识别
+
+支持的同名文件: .srt / .vtt / .ass / .ssa，以及 B 站 CC 字幕的 JSON（{"body": [{"from", "to", "content"}]}）；
+也匹配 "视频名.zh.srt" 这类带语言后缀的文件。bili-dl 下载的 .xml 是弹幕（观众评论），不是字幕，不使用。
+内嵌字幕只取文本类字幕轨 (subrip / ass / mov_text / webvtt)，图形字幕 (PGS / DVD) 无法直接得到文字。
+"""
+import glob
+import json
+import os
+import re
+import subprocess
+
+SIDECAR_EXTENSIONS = (".srt", ".vtt", ".ass", ".ssa", ".json")
+TEXT_SUBTITLE_CODECS = ("subrip", "srt", "ass", "ssa", "mov_text", "webvtt", "text")
+_TIME = re.compile(r"(?:(\d+):)?(\d{1,2}):(\d{2})[,.](\d{1,3})")
+_TAGS = re.compile(r"<[^>]+>|\{\\[^}]*\}")
+_CJK = re.compile(r"[\u3040-\u30ff\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def _seconds(match):
+    hours, minutes, seconds, fraction = match.groups()
+    return int(hours or 0) * 3600 + int(minutes) * 60 + int(seconds) + int(fraction) / 10 ** len(fraction)
+
+
+def _segment(start, end, text):
+    text = _TAGS.sub("", text).replace("\\N", " ").replace("\\n", " ").strip()
+    if text and not _CJK.search(text):
+        text = " " + text # 与 whisper 一样，非中日韩文字的片段以空格开头，拼接后词之间有空格
+    return {"start": start, "end": end, "text": text}
+
+
+def parse_srt(text):
+    """解析 SRT / WebVTT：以空行分隔的块，"开始 --> 结束" 一行之后是字幕文本"""
+    segments = []
+    for block in re.split(r"\n\s*\n", text.replace("\r\n", "\n")):
+        lines = block.strip().split("\n")
+        for i, line in enumerate(lines):
+            if "-->" not in line:
+                continue
+            times = list(_TIME.finditer(line))
+            if len(times) >= 2:
+                segments.append(_segment(_seconds(times[0]), _seconds(times[1]), " ".join(lines[i + 1:])))
+            break
+    return segments
+
+
+def parse_ass(text):
+    """解析 ASS / SSA 的 Dialogue 行，文本是第 10 个字段（可以含逗号）"""
+    segments = []
+    for line in text.splitlines():
+        if not line.startswith("Dialogue:"):
+            continue
+        fields = line.split(":", 1)[1].split(",", 9)
+        start, end = _TIME.search(fields[1]), _TIME.search(fields[2])
+        if start and end and len(fields) == 10:
+            segments.append(_segment(_seconds(start), _seconds(end), fields[9]))
+    return segments
+
+
+def parse_bcc(text):
+    """解析 B 站 CC 字幕 JSON"""
+    body = json.loads(text).get("body", [])
+    return [_segment(float(item["from"]), float(item["to"]), item["content"]) for item in body]
+
+
+def parse_subtitle_file(path):
+    with open(path, "r", encoding="utf-8-sig", errors="replace") as f:
+        text = f.read()
+    ext = os.path.splitext(path)[1].lower()
+    if ext in (".ass", ".ssa"):
+        segments = parse_ass(text)
+    elif ext == ".json":
+        try:
+            segments = parse_bcc(text)
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return [] # 同名的 JSON 不一定是字幕
+    else:
+        segments = parse_srt(text)
+    return sorted((seg for seg in segments if seg["text"]), key=lambda seg: seg["start"])
+
+
+def sidecar_files(video_path):
+    """同目录下与视频同名的字幕文件，完全同名的排在带语言后缀的前面"""
+    stem = os.path.splitext(video_path)[0]
+    exact = [stem + ext for ext in SIDECAR_EXTENSIONS if os.path.isfile(stem + ext)]
+    tagged = sorted(path for ext in SIDECAR_EXTENSIONS for path in glob.glob(glob.escape(stem) + ".*" + ext))
+    return list(dict.fromkeys(exact + tagged))
+
+
+def probe_subtitle_streams(video_path):
+    """用 ffprobe 列出文本类字幕轨 [(流序号, 语言)]"""
+    try:
+        out = subprocess.run(
+            ["ffprobe", "-v", "error", "-select_streams", "s",
+             "-show_entries", "stream=index,codec_name:stream_tags=language", "-of", "json", video_path],
+            capture_output=True, text=True, check=True,
+        ).stdout
+        streams = json.loads(out).get("streams", [])
+    except (OSError, subprocess.CalledProcessError, ValueError):
+        return []
+    return [(stream["index"], stream.get("tags", {}).get("language"))
+            for stream in streams if stream.get("codec_name") in TEXT_SUBTITLE_CODECS]
+
+
+def extract_subtitle_stream(video_path, index):
+    """把内嵌字幕轨转成 SRT 再解析；只解复用，不解码音视频"""
+    try:
+        out = subprocess.run(
+            ["ffmpeg", "-nostdin", "-v", "error", "-i", video_path, "-map", f"0:{index}", "-f", "srt", "-"],
+            capture_output=True, check=True,
+        ).stdout.decode("utf-8", errors="replace")
+    except (OSError, subprocess.CalledProcessError):
+        return []
+    return [seg for seg in parse_srt(out) if seg["text"]]
+
+
+def find_subtitles(video_path, embedded=True):
+    """返回 (来源说明, 片段列表)；没有可用字幕时返回 None。先找同名文件，再找内嵌字幕轨"""
+    for path in sidecar_files(video_path):
+        segments = parse_subtitle_file(path)
+        if segments:
+            return os.path.basename(path), segments
+    if embedded:
+        for index, language in probe_subtitle_streams(video_path):
+            segments = extract_subtitle_stream(video_path, index)
+            if segments:
+                return f"内嵌字幕轨 #{index} ({language or '未知语言'})", segments
+    return None
+
+
+def uncovered_gaps(segments, duration, min_gap=3.0):
+    """字幕没有覆盖、且不短于 min_gap 秒的区间 [(开始秒, 结束秒)]"""
+    gaps = []
+    covered = 0.0
+    for seg in segments:
+        if seg["start"] - covered >= min_gap:
+            gaps.append((covered, seg["start"]))
+        covered = max(covered, seg["end"])
+    if duration is not None and duration - covered >= min_gap:
+        gaps.append((covered, duration))
+    return gaps
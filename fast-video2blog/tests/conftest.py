@@ -0,0 +1,5 @@
+import os
+import sys
+
+# 各模块以脚本方式运行，互相按顶层模块名导入
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
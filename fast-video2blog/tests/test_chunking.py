@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+from bench import register_stub_backend
+from chunking import detect_speech, iter_transcribe_batched, iter_transcribe_sequential
+
+SR = 16000
+
+
+def noise(seconds, level=0.1, seed=0):
+    rng = np.random.default_rng(seed)
+    return (level * rng.standard_normal(int(seconds * SR))).astype(np.float32)
+
+
+def recording_chunk(calls):
+    """桩转录：记录每块的长度和提示，每秒产出一个片段"""
+    def transcribe_chunk(chunk, prompt, language):
+        calls.append((len(chunk), prompt))
+        seconds = len(chunk) / SR
+        segments = [{"start": float(t), "end": min(t + 1.0, seconds), "text": f" {len(calls)}.{t}"}
+                    for t in range(int(np.ceil(seconds)))]
+        return {"text": f" 块{len(calls)}", "language": "zh", "segments": segments}
+    return transcribe_chunk
+
+
+def covered_seconds(segments):
+    return sum(seg["end"] - seg["start"] for seg in segments)
+
+
+def test_sequential_covers_constant_level_audio():
+    # 没有静音底的音频：普通模式不做 VAD，整段都要送进模型
+    audio = noise(100)
+    calls = []
+    segments = list(iter_transcribe_sequential(audio, recording_chunk(calls)))
+    assert sum(n for n, _ in calls) >= len(audio)
+    assert all(n <= 30 * SR for n, _ in calls)
+    assert covered_seconds(segments) == pytest.approx(100, abs=2)
+
+
+def test_sequential_chains_prompts():
+    calls = []
+    list(iter_transcribe_sequential(noise(70), recording_chunk(calls)))
+    assert calls[0][1] is None
+    assert [prompt for _, prompt in calls[1:]] == [f" 块{i}" for i in range(1, len(calls))]
+
+
+def test_sequential_vad_drops_silence():
+    audio = np.concatenate([noise(10), np.zeros(20 * SR, dtype=np.float32), noise(10, seed=1)])
+    calls = []
+    list(iter_transcribe_sequential(audio, recording_chunk(calls), vad=True))
+    assert sum(n for n, _ in calls) < 25 * SR
+
+
+@pytest.mark.parametrize("batch_size", [1, 3, 8])
+def test_batched_matches_sequential_on_stub_backend(batch_size):
+    # 桩后端不看提示文本：两种模式切块相同，差别只在提示，输出应完全一致
+    backend = register_stub_backend()("tiny")
+    audio = np.concatenate([noise(40), np.zeros(15 * SR, dtype=np.float32), noise(50, seed=1)])
+    sequential = list(iter_transcribe_sequential(
+        audio, lambda chunk, prompt, language: backend.transcribe(chunk, prompt, language)))
+    batched = list(iter_transcribe_batched(audio, backend, batch_size))
+    assert batched == sequential
+    assert batched[-1]["end"] == pytest.approx(105, abs=1)
+
+
+def tone(seconds, freq, level):
+    t = np.arange(int(seconds * SR)) / SR
+    return (level * np.sin(2 * np.pi * freq * t)).astype(np.float32)
+
+
+def voiced_fraction(regions, n_samples):
+    return sum(end - start for start, end in regions) / n_samples
+
+
+def test_detect_speech_constant_level_is_all_speech():
+    # 压缩过的人声：能量几乎恒定，没有静音底
+    audio = noise(60, level=0.2)
+    assert detect_speech(audio) == [(0, len(audio))]
+
+
+def test_detect_speech_keeps_speech_over_music_bed():
+    # 持续的背景音乐 (-23 dBFS 左右) 上叠加断续的"语音"，语音之间不能被当作静音丢掉
+    bed = tone(60, 220, 0.1)
+    speech = noise(60, level=0.15) * (np.sin(2 * np.pi * 0.7 * np.arange(60 * SR) / SR) > -0.3)
+    regions = detect_speech(bed + speech.astype(np.float32))
+    assert voiced_fraction(regions, 60 * SR) > 0.99
+
+
+def test_detect_speech_still_drops_real_silence():
+    audio = np.concatenate([noise(5), np.zeros(10 * SR, dtype=np.float32), noise(5, seed=1)])
+    regions = detect_speech(audio)
+    assert len(regions) == 2
+    assert voiced_fraction(regions, len(audio)) < 0.6
+
+
+def test_detect_speech_digital_silence():
+    assert detect_speech(np.zeros(10 * SR, dtype=np.float32)) == []
@@ -0,0 +1,21 @@
+import pytest
+
+from daemon import parse_job_options
+
+
+def test_parse_job_options_maps_names():
+    assert parse_job_options({"path": "/a.mp4", "model": "small", "batch_size": 4, "draft_model": None}) == \
+        {"model_size": "small", "batch_size": 4, "draft_model": None}
+
+
+@pytest.mark.parametrize("request_body", [
+    {"diarize": "yes"},
+    {"batch_size": "8"},
+    {"batch_size": True},
+    {"batch_size": -1},
+    {"model": 3},
+    {"backend": "nope"},
+])
+def test_parse_job_options_rejects_bad_input(request_body):
+    with pytest.raises(ValueError):
+        parse_job_options(request_body)
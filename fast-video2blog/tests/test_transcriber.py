@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+import transcriber as transcriber_module
+from backends import TranscriptionBackend
+from transcript_cache import TranscriptCache
+from transcriber import Transcriber
+
+SR = 16000
+
+
+class StubBackend(TranscriptionBackend):
+    """不加载模型：每次调用产出一个覆盖整块的片段，文本为 "识别"，并记录调用次数"""
+    name = "stub"
+
+    def __init__(self):
+        super().__init__("tiny")
+        self.calls = 0
+
+    def load(self, log=None):
+        return None
+
+    def transcribe(self, audio, initial_prompt=None, language=None, log=None):
+        self.calls += 1
+        return {"text": "识别", "language": "zh",
+                "segments": [{"start": 0.0, "end": len(audio) / SR, "text": "识别"}]}
+
+
+@pytest.fixture
+def video(tmp_path, monkeypatch):
+    monkeypatch.setattr(transcriber_module, "transcript_cache", TranscriptCache(root=str(tmp_path / "cache")))
+    path = tmp_path / "v.mp4"
+    path.write_bytes(b"not really a video")
+    return path
+
+
+def make_transcriber(path, **options):
+    transcriber = Transcriber(str(path), diarize=False, backend="faster-whisper", metrics_file="",
+                              resume=False, **options)
+    transcriber.backend = StubBackend()
+    return transcriber
+
+
+def test_subtitles_take_priority_over_earlier_asr_cache(video):
+    audio = np.full(20 * SR, 0.1, dtype=np.float32)
+    first = make_transcriber(video)
+    assert first.process(audio=audio) == "识别"
+
+    # 之后出现了同名字幕：字幕覆盖 0-5 秒，5-20 秒的空档用语音识别补齐
+    video.with_suffix(".srt").write_text("1\n00:00:00,000 --> 00:00:05,000\n字幕\n", encoding="utf-8")
+    second = make_transcriber(video, subtitle_gaps=True)
+    assert second.needs_audio()
+    assert second.process(audio=audio) == "字幕识别"
+    assert second.backend.calls == 1
+
+
+def test_subtitles_without_gaps_skip_audio(video):
+    make_transcriber(video).process(audio=np.full(5 * SR, 0.1, dtype=np.float32))
+    video.with_suffix(".srt").write_text("1\n00:00:00,000 --> 00:00:05,000\n字幕\n", encoding="utf-8")
+    assert not make_transcriber(video).needs_audio()
+
+
+def test_long_or_unknown_audio_is_decoded_to_memmap(video):
+    transcriber = make_transcriber(video)
+    assert transcriber.audio_buffer_path(60.0) is None
+    assert transcriber.audio_buffer_path(4 * 3600.0).endswith(".npy")
+    assert transcriber.audio_buffer_path(None).endswith(".npy")
+    transcriber.release_audio_buffer()
+    assert make_transcriber(video, memmap_audio=False).audio_buffer_path(4 * 3600.0) is None
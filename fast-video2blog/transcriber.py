@@ -0,0 +1,461 @@
+"""视频转文字的核心流程，不依赖 Qt
+
+Transcriber 通过简易的 Signal 对外汇报进度、日志和逐段结果，
+GUI (main.AudioProcessor) 和命令行 (cli.py) 共用同一套逻辑。
+torch、pydub 等重模块在真正用到时才导入，导入本模块本身很快。
+"""
+import os
+import tempfile
+import threading
+import time
+
+from model_registry import registry
+from backends import select_backend
+from stages import StageGraph
+from align import SpeakerIndex, annotation_to_turns, format_speaker_transcript
+from audio_io import SAMPLE_RATE, audiosegment_to_pcm, load_pcm, probe_duration
+from chunking import (collect_segments, default_workers, iter_transcribe_batched, iter_transcribe_parallel,
+                      iter_transcribe_sequential)
+from transcript_cache import file_fingerprint, timed_get, transcript_cache
+from metrics import METRICS_FILE, JobMetrics
+from checkpoint import CancelToken, Cancelled, ChunkCheckpoint
+from signals import Signal
+from subtitles import find_subtitles, uncovered_gaps
+
+DIARIZATION_MODEL = "pyannote/speaker-diarization-3.1"
+# 未指定 memmap_audio 时，超过这个时长 (秒) 或时长未知的音频解码到内存映射文件，内存占用不随长度增长
+MEMMAP_MIN_SECONDS = float(os.environ.get("FV2B_MEMMAP_MIN_SECONDS", "1800"))
+
+
+class Transcriber:
+    def __init__(self, video_path, diarize=True, extract_mode="stream", long_audio=False, use_cache=True,
+                 backend="auto", model_size="medium", metrics_file=METRICS_FILE, memmap_audio=None,
+                 resume=True, release_on_cancel=True, batch_size=0, draft_model=None, use_subtitles=True,
+                 subtitle_gaps=False):
+        self.progress = Signal()
+        self.message = Signal()
+        self.audio_duration = Signal() # 音频时长（秒）
+        self.segment = Signal() # 每解码出一个片段就发送 (开始秒, 结束秒, 文本)
+        self.draft_segment = Signal() # 草稿模型的片段 (开始秒, 结束秒, 文本)，之后会被 segment 替换
+
+        self.video_path = video_path
+        self.diarize = diarize
+        self.long_audio = long_audio # 长音频模式：VAD 切块 + 多进程并行转录（CPU）
+        self.use_cache = use_cache # 按音频指纹 + 模型设置缓存转录结果和说话人区间
+        self._fingerprint = None
+        self.duration_seconds = None
+        # "stream": ffmpeg 一次解码为 16 kHz 单声道数组；"pydub": 旧的 pydub 解码方式（在内存中转换，不写临时 WAV）
+        self.extract_mode = extract_mode
+        # 解码结果放在内存映射的 .npy 里：长音频模式下子进程直接映射同一个文件，不再逐块序列化；
+        # None 表示按音频时长自动决定 (见 MEMMAP_MIN_SECONDS)
+        if memmap_audio is None and (long_audio or os.environ.get("FV2B_AUDIO_MEMMAP") == "1"):
+            memmap_audio = True
+        self.memmap_audio = memmap_audio
+        self._audio_dir = None
+        self._device = None
+        os.environ["PYTORCH_ENABLE_MPS_FALLBACK"] = "1"
+        # 语音识别后端："auto" 根据本机选择，也可指定 whisper / mlx / faster-whisper
+        self.backend = select_backend(backend, model_size)
+        # >0 时每批解码这么多个 30 秒窗口（批量推理，块之间不传递提示，结果与顺序模式略有不同）；0 为逐块顺序解码
+        self.batch_size = batch_size
+        # 两遍模式：先用小模型 (如 base) 在后台出草稿，选定的模型随后逐段定稿
+        self.draft_model = draft_model if draft_model != model_size else None
+        self._final_end = 0.0 # 已定稿到的音频位置（秒）
+        # 有内嵌字幕轨或同名字幕文件时直接用字幕；subtitle_gaps 时字幕没覆盖的部分再做语音识别
+        self.use_subtitles = use_subtitles
+        self.subtitle_gaps = subtitle_gaps
+        self._subtitles = False # 未查找过；查找后为 (来源, 片段) 或 None
+        # 每个阶段的耗时/CPU/内存，处理结束后可追加写入 metrics_file (JSONL)
+        self.metrics = JobMetrics(os.path.basename(video_path))
+        self.metrics_file = metrics_file
+        # 逐块保存转录进度，中断后再处理同一文件时从最后完成的块继续
+        self.resume = resume
+        self.cancel_token = CancelToken()
+        # 取消后是否释放模型；后台服务里模型由多个任务共享，不释放
+        self.release_on_cancel = release_on_cancel
+
+    @staticmethod
+    def default_device():
+        """说话人识别模型使用的设备"""
+        import torch
+        return "mps" if torch.backends.mps.is_available() else "cpu"
+
+    @property
+    def device(self):
+        if self._device is None:
+            self._device = self.default_device()
+        return self._device
+
+    def cancel(self):
+        """请求取消；在下一个块边界停止，可从任意线程调用"""
+        self.cancel_token.cancel()
+
+    def checkpoint(self):
+        if not self.resume:
+            return None
+        return ChunkCheckpoint(self.fingerprint(), self.asr_settings(), log=self.message.emit)
+
+    def release_models(self):
+        """取消后释放本任务用到的模型，下次处理时重新加载"""
+        registry.evict(*self.backend.registry_spec())
+        registry.evict("pyannote", DIARIZATION_MODEL, device=self.device)
+
+    def probe_audio(self, video_path):
+        """从容器元数据读取时长（秒），不需要解码；读不到时返回 None"""
+        with self.metrics.stage("extract"):
+            duration_seconds = probe_duration(video_path) if self.extract_mode == "stream" else None
+        if duration_seconds is not None:
+            self.duration_seconds = duration_seconds
+            self.audio_duration.emit(duration_seconds) # 时长取自容器元数据，无需等待解码
+        return duration_seconds
+
+    def decode_audio(self, video_path, duration_seconds=None):
+        """把音轨一次解码成 16 kHz 单声道 float32 数组，whisper 和 pyannote 共用这一份"""
+        self.message.emit("提取音频中...")
+        with self.metrics.stage("decode") as stage:
+            if self.extract_mode == "stream":
+                audio = load_pcm(video_path, duration=duration_seconds,
+                                 memmap_path=self.audio_buffer_path(duration_seconds))
+            else:
+                from pydub import AudioSegment
+                segment = AudioSegment.from_file(video_path)
+                audio = audiosegment_to_pcm(segment, memmap_path=self.audio_buffer_path(segment.duration_seconds))
+            stage["audio_seconds"] = len(audio) / SAMPLE_RATE
+        if duration_seconds is None:
+            self.duration_seconds = len(audio) / SAMPLE_RATE # 获取音频时长（秒）
+            self.audio_duration.emit(self.duration_seconds) # 发送音频时长
+        return audio
+
+    def extract_audio(self, video_path):
+        """提取视频音轨，返回 16 kHz 单声道 float32 数组（memmap 模式下为 np.memmap）"""
+        return self.decode_audio(video_path, self.probe_audio(video_path))
+
+    def audio_buffer_path(self, duration_seconds=None):
+        """memmap 模式下解码结果所在的 .npy 路径，放在本任务专用的临时目录里；不用 memmap 时返回 None"""
+        memmap_audio = self.memmap_audio
+        if memmap_audio is None:
+            memmap_audio = duration_seconds is None or duration_seconds >= MEMMAP_MIN_SECONDS
+        if not memmap_audio:
+            return None
+        if self._audio_dir is None:
+            self._audio_dir = tempfile.TemporaryDirectory(prefix="fv2b-audio-")
+        return os.path.join(self._audio_dir.name, "audio.npy")
+
+    def release_audio_buffer(self):
+        if self._audio_dir is not None:
+            self._audio_dir.cleanup()
+            self._audio_dir = None
+
+    def fingerprint(self):
+        if self._fingerprint is None:
+            self._fingerprint = file_fingerprint(self.video_path)
+        return self._fingerprint
+
+    def asr_settings(self):
+        """决定转录结果的模型设置，作为缓存键的一部分"""
+        settings = dict(self.backend.cache_settings(), long_audio=self.long_audio)
+        if not self.long_audio:
+            settings["coverage"] = "full" # 普通模式转录整段音频；旧的按 VAD 切块的缓存结果可能缺段，不再复用
+        if self.batch_size and not self.long_audio:
+            settings["batched"] = True # 批量模式不用上一块的文本作提示，结果与顺序模式不同
+        return settings
+
+    def cache_get(self, kind, **settings):
+        if not self.use_cache:
+            return None
+        return timed_get(transcript_cache, kind, self.fingerprint(), log=self.message.emit, **settings)
+
+    def cache_put(self, kind, value, **settings):
+        if self.use_cache:
+            transcript_cache.put(kind, self.fingerprint(), value, **settings)
+
+    def cache_asr_result(self, result, **settings):
+        """只保留片段的时间戳和文本，连同音频时长一起写入缓存"""
+        cached = {
+            "text": result["text"],
+            "language": result.get("language"),
+            "duration": self.duration_seconds,
+            "segments": [{"start": seg["start"], "end": seg["end"], "text": seg["text"]}
+                         for seg in result["segments"]],
+        }
+        self.cache_put("asr", cached, **settings)
+        return cached
+
+    def transcribe_with_speakers(self, video_path, audio=None):
+        """执行语音识别和说话人分离
+
+        按阶段图执行: 提取 -> 解码 -> (语音识别 || 说话人分离) -> 对齐，
+        每个阶段只执行一次，语音识别和说话人分离只共享解码后的音频，在两个线程上并发。
+        转录结果和说话人区间分别缓存，两者都命中时不再提取音频。
+        """
+        asr_settings = self.asr_settings()
+        diarization_settings = {"model": DIARIZATION_MODEL}
+        # 有字幕时以字幕为准，不用缓存的识别结果
+        cached_asr = None if self.find_subtitles() else self.cache_get("asr", **asr_settings)
+        cached_turns = self.cache_get("diarization", **diarization_settings)
+        if cached_asr is not None and cached_turns is not None:
+            self.duration_seconds = cached_asr["duration"]
+            self.audio_duration.emit(self.duration_seconds)
+            self.progress.emit(100)
+            return self.align_speakers(cached_asr["segments"], cached_turns)
+
+        def extract():
+            if audio is not None:
+                return None
+            return self.probe_audio(video_path)
+
+        def decode(extract):
+            if audio is not None:
+                return audio
+            return self.decode_audio(video_path, extract)
+
+        def asr(decode):
+            if cached_asr is not None:
+                return cached_asr
+            result = self.transcribe(decode)
+            # 来自字幕的结果不写入识别缓存
+            return result if self.find_subtitles() else self.cache_asr_result(result, **asr_settings)
+
+        def diarize(decode):
+            if cached_turns is not None:
+                return cached_turns
+            self.message.emit("加载说话人识别模型...")
+            with self.metrics.stage("model_load_diarization"):
+                diarization_pipeline = registry.get("pyannote", DIARIZATION_MODEL, device=self.device,
+                                                    log=self.message.emit)
+            self.message.emit("识别说话人...")
+
+            def hook(*args, **kwargs):
+                # pyannote 每完成一步（分段、每批嵌入、聚类）调用一次，在这里响应取消
+                self.cancel_token.check()
+
+            import torch
+            with self.metrics.stage("diarization", audio_seconds=len(decode) / SAMPLE_RATE):
+                # 直接把解码好的波形交给 pyannote：from_numpy + unsqueeze 都是视图，不拷贝数据
+                waveform = torch.from_numpy(decode).unsqueeze(0)
+                diarization = diarization_pipeline({"waveform": waveform, "sample_rate": SAMPLE_RATE}, hook=hook)
+                turns = annotation_to_turns(diarization)
+            self.cache_put("diarization", turns, **diarization_settings)
+            return turns
+
+        def align(asr, diarize):
+            with self.metrics.stage("alignment"):
+                return self.align_speakers(asr["segments"], diarize)
+
+        def on_stage_done(name, done, total, elapsed):
+            self.message.emit(f"阶段 {name} 完成，用时 {elapsed:.2f} 秒")
+            self.progress.emit(int(done * 100 / total))
+
+        graph = StageGraph(max_workers=2, on_stage_done=on_stage_done)
+        graph.add("extract", extract)
+        graph.add("decode", decode, deps=["extract"])
+        graph.add("asr", asr, deps=["decode"])
+        graph.add("diarize", diarize, deps=["decode"])
+        graph.add("align", align, deps=["asr", "diarize"])
+        return graph.run()["align"]
+
+    def align_speakers(self, segments, turns):
+        """将转录结果与说话人对应，按片段与说话人区间的重叠时长分配"""
+        index = SpeakerIndex(turns)
+        speakers = index.assign(segments)
+        return format_speaker_transcript(segments, speakers)
+
+    def transcribe(self, audio):
+        """用选定的后端逐块转录并逐段推送，返回 backends 约定的结果结构
+
+        每块完成后写入断点；整段转录完成后断点删除，结果由调用方写入转录缓存。
+        找到可用字幕时直接返回字幕（subtitle_gaps 时只识别字幕没覆盖的部分）。
+        """
+        self.cancel_token.check()
+        if (subtitles := self.find_subtitles()) is not None:
+            with self.metrics.stage("subtitles"):
+                return self.stream_segments(self.iter_subtitle_segments(
+                    subtitles, audio if self.subtitle_gaps else None))
+        checkpoint = self.checkpoint()
+        draft = self.start_draft(audio) if self.draft_model else None
+        try:
+            if self.long_audio:
+                with self.metrics.stage("asr", audio_seconds=len(audio) / SAMPLE_RATE):
+                    result = self.transcribe_long(audio, checkpoint)
+            elif self.batch_size:
+                result = self.transcribe_batched(audio, checkpoint)
+            else:
+                result = self.transcribe_sequential(audio, checkpoint)
+        finally:
+            if draft:
+                # 正式结果已经完整，停掉草稿线程（最多等它把当前小块转完）
+                stop, thread = draft
+                stop.cancel()
+                thread.join()
+        if checkpoint:
+            checkpoint.remove()
+        return result
+
+    def find_subtitles(self):
+        """查找内嵌字幕轨和同名字幕文件，结果只查一次"""
+        if self._subtitles is False:
+            self._subtitles = None
+            if self.use_subtitles and (found := find_subtitles(self.video_path)) is not None:
+                source, segments = found
+                self.message.emit(f"使用已有字幕: {source}，共 {len(segments)} 段")
+                self._subtitles = segments
+        return self._subtitles
+
+    def iter_subtitle_segments(self, subtitles, audio=None):
+        """按时间顺序产出字幕片段；给出 audio 时把字幕没覆盖的空档送去识别，穿插在对应位置"""
+        gaps = uncovered_gaps(subtitles, len(audio) / SAMPLE_RATE) if audio is not None else []
+        if gaps:
+            self.message.emit(f"字幕有 {len(gaps)} 处空档，共 {sum(end - start for start, end in gaps):.0f} 秒，"
+                              f"用 {self.backend.name} 补齐")
+            self.backend.load(log=self.message.emit)
+
+        def transcribe_chunk(chunk, prompt, language):
+            return self.backend.transcribe(chunk, initial_prompt=prompt, language=language)
+
+        i = 0
+        for gap_start, gap_end in gaps:
+            while i < len(subtitles) and subtitles[i]["start"] < gap_start:
+                yield subtitles[i]
+                i += 1
+            gap_audio = audio[int(gap_start * SAMPLE_RATE):int(gap_end * SAMPLE_RATE)]
+            for seg in iter_transcribe_sequential(gap_audio, transcribe_chunk, cancel=self.cancel_token):
+                yield dict(seg, start=seg["start"] + gap_start, end=seg["end"] + gap_start)
+        yield from subtitles[i:]
+
+    def start_draft(self, audio):
+        """在后台线程用草稿模型快速转录，通过 draft_segment 推送还没定稿的部分
+
+        返回 (停止标记, 线程)。草稿只用于尽早显示，不进入缓存和断点。
+        """
+        draft_backend = select_backend(self.backend.name, self.draft_model)
+        stop = CancelToken()
+        started = time.perf_counter()
+        self.message.emit(f"两遍模式: {self.draft_model} 模型先出草稿，{self.backend.model_size} 模型随后定稿")
+
+        def transcribe_chunk(chunk, prompt, language):
+            return draft_backend.transcribe(chunk, initial_prompt=prompt, language=language)
+
+        def run():
+            first = True
+            try:
+                draft_backend.load(log=self.message.emit)
+                for seg in iter_transcribe_sequential(audio, transcribe_chunk, cancel=stop):
+                    if seg["end"] <= self._final_end:
+                        continue # 这一段已经定稿
+                    if first:
+                        self.message.emit(f"草稿首段用时 {time.perf_counter() - started:.1f} 秒")
+                        first = False
+                    self.draft_segment.emit(seg["start"], seg["end"], seg["text"])
+            except Cancelled:
+                pass
+            except Exception as e:
+                self.message.emit(f"草稿转录失败，只等待定稿结果: {e}")
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return stop, thread
+
+    def transcribe_sequential(self, audio, checkpoint=None):
+        self.message.emit(f"加载语音识别模型 ({self.backend.name})...")
+        with self.metrics.stage("model_load_asr"):
+            self.backend.load(log=self.message.emit)
+        self.message.emit("转录音频中...")
+
+        def transcribe_chunk(chunk, prompt, language):
+            return self.backend.transcribe(chunk, initial_prompt=prompt, language=language)
+
+        with self.metrics.stage("asr", audio_seconds=len(audio) / SAMPLE_RATE):
+            return self.stream_segments(iter_transcribe_sequential(
+                audio, transcribe_chunk, checkpoint=checkpoint, cancel=self.cancel_token))
+
+    def transcribe_batched(self, audio, checkpoint=None):
+        self.message.emit(f"加载语音识别模型 ({self.backend.name})...")
+        with self.metrics.stage("model_load_asr"):
+            self.backend.load(log=self.message.emit)
+        self.message.emit(f"批量转录音频中，每批 {self.batch_size} 个窗口...")
+        with self.metrics.stage("asr", audio_seconds=len(audio) / SAMPLE_RATE):
+            return self.stream_segments(iter_transcribe_batched(
+                audio, self.backend, self.batch_size, checkpoint=checkpoint, cancel=self.cancel_token))
+
+    def transcribe_long(self, audio, checkpoint=None):
+        """长音频模式：按语音活动切块，在进程池中并行转录（每个进程在 CPU 上加载一份模型）"""
+        workers = default_workers()
+        self.message.emit(f"长音频模式: 按语音活动切块，{workers} 个进程并行转录 ({self.backend.name})...")
+
+        def on_chunk_done(done, total):
+            self.message.emit(f"已转录 {done}/{total} 块")
+
+        return self.stream_segments(iter_transcribe_parallel(
+            audio, self.backend.name, self.backend.model_size, workers=workers, on_chunk_done=on_chunk_done,
+            checkpoint=checkpoint, cancel=self.cancel_token))
+
+    def stream_segments(self, segments):
+        """逐个把片段推送给界面，同时收集成 whisper 结构的结果"""
+        collected = []
+        for seg in segments:
+            self._final_end = seg["end"]
+            self.segment.emit(seg["start"], seg["end"], seg["text"])
+            collected.append(seg)
+        return collect_segments(collected)
+
+    def transcribe_text_only(self, audio):
+        """仅执行语音识别，不进行说话人分离；audio 为 16 kHz float32 数组"""
+        result = self.transcribe(audio)
+        self.progress.emit(100)
+        if self.find_subtitles() is not None:
+            return result["text"]
+        return self.cache_asr_result(result, **self.asr_settings())["text"]
+
+    def needs_audio(self):
+        """所需的缓存都命中（或字幕足够）时返回 False，调用方可以跳过音频提取"""
+        if self.find_subtitles() is not None:
+            # 有字幕时以字幕为准，不看识别缓存；只有补齐空档或说话人识别需要音频
+            asr_needs_audio = self.subtitle_gaps
+        elif not self.use_cache:
+            return True
+        else:
+            asr_needs_audio = transcript_cache.get("asr", self.fingerprint(), **self.asr_settings()) is None
+        if self.diarize:
+            return (asr_needs_audio or not self.use_cache
+                    or transcript_cache.get("diarization", self.fingerprint(), model=DIARIZATION_MODEL) is None)
+        return asr_needs_audio
+
+    def process(self, audio=None):
+        """完整处理一个视频并返回文本；audio 为预先解码好的 16 kHz float32 数组，可省略"""
+        try:
+            # 根据设置选择转录方式
+            if self.diarize:
+                # 说话人模式由阶段图负责提取和解码音频
+                self.message.emit("开始转录和说话人识别...")
+                transcript = self.transcribe_with_speakers(self.video_path, audio=audio)
+            elif self.find_subtitles() is not None and not self.subtitle_gaps:
+                # 字幕就是完整的转录结果，不需要解码音频，只从容器读取时长
+                self.probe_audio(self.video_path)
+                transcript = self.transcribe_text_only(None)
+            elif (self.find_subtitles() is None
+                  and (cached := self.cache_get("asr", **self.asr_settings())) is not None):
+                self.duration_seconds = cached["duration"]
+                self.audio_duration.emit(self.duration_seconds)
+                self.progress.emit(100)
+                transcript = cached["text"]
+            else:
+                # 步骤1: 提取音频
+                if audio is None:
+                    audio = self.extract_audio(self.video_path)
+
+                # 步骤2: 仅文本转录
+                self.message.emit("开始仅文本转录...")
+                transcript = self.transcribe_text_only(audio)
+        except Cancelled:
+            if self.release_on_cancel:
+                self.release_models()
+            self.message.emit("已取消，已完成的块保存在断点中，再次处理同一文件时继续")
+            raise
+        finally:
+            # 删除 memmap 模式的解码文件；仍持有映射的数组在 POSIX 上可以继续读取
+            self.release_audio_buffer()
+        self.message.emit(registry.summary())
+        self.message.emit(f"阶段耗时: {self.metrics.summary()}")
+        if self.metrics_file:
+            self.metrics.append_to(self.metrics_file)
+        return transcript
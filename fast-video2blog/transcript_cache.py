@@ -0,0 +1,98 @@
+"""按内容寻址的转录缓存
+
+键 = 文件指纹 + 结果类型 + 模型设置。命中时不必解码音频。转录片段 ("asr") 和说话人区间 ("diarization") 分开存放，
+切换说话人识别时可以复用已有的转录结果。总大小超过上限时按最近使用时间 (LRU) 淘汰。
+"""
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+CACHE_DIR = os.environ.get("FV2B_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "fast-video2blog"))
+DEFAULT_MAX_MB = int(os.environ.get("FV2B_CACHE_MAX_MB", "1024"))
+
+_SAMPLE_BYTES = 1024 * 1024
+
+
+def file_fingerprint(path):
+    """快速文件指纹：文件大小 + 开头/中间/结尾各 1 MB 的 sha256，不需要解码"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha256(str(size).encode())
+    with open(path, "rb") as f:
+        for offset in (0, max(0, size // 2 - _SAMPLE_BYTES // 2), max(0, size - _SAMPLE_BYTES)):
+            f.seek(offset)
+            digest.update(f.read(_SAMPLE_BYTES))
+    return digest.hexdigest()
+
+
+class TranscriptCache:
+    def __init__(self, root=CACHE_DIR, max_mb=DEFAULT_MAX_MB):
+        self.root = root
+        self.max_bytes = max_mb * 1024 * 1024
+        self._lock = threading.Lock()
+
+    def _path(self, kind, fingerprint, settings):
+        blob = json.dumps({"fingerprint": fingerprint, "settings": settings}, sort_keys=True)
+        key = hashlib.sha256(blob.encode()).hexdigest()
+        return os.path.join(self.root, kind, f"{key}.json")
+
+    def get(self, kind, fingerprint, **settings):
+        """命中时返回缓存的对象并刷新其使用时间，否则返回 None"""
+        path = self._path(kind, fingerprint, settings)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return None
+        os.utime(path)  # 刷新 mtime 作为最近使用时间
+        return value
+
+    def put(self, kind, fingerprint, value, **settings):
+        path = self._path(kind, fingerprint, settings)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 先写临时文件再原子替换，进程中途崩溃不会留下半个 JSON
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(value, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._evict()
+
+    def _evict(self):
+        with self._lock:
+            entries = []
+            for dirpath, _, filenames in os.walk(self.root):
+                for name in filenames:
+                    if name.endswith(".json"):
+                        path = os.path.join(dirpath, name)
+                        stat = os.stat(path)
+                        entries.append((stat.st_mtime, stat.st_size, path))
+            total = sum(size for _, size, _ in entries)
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                os.remove(path)
+                total -= size
+
+    def clear(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if name.endswith(".json"):
+                    os.remove(os.path.join(dirpath, name))
+
+
+def timed_get(cache, kind, fingerprint, log=None, **settings):
+    """带耗时日志的 get，命中/未命中都写一条日志"""
+    start = time.perf_counter()
+    value = cache.get(kind, fingerprint, **settings)
+    if log:
+        if value is None:
+            log(f"缓存未命中: {kind}")
+        else:
+            log(f"缓存命中: {kind}，用时 {1000 * (time.perf_counter() - start):.1f} ms")
+    return value
+
+
+# 进程内共享的缓存
+transcript_cache = TranscriptCache()